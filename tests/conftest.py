@@ -37,3 +37,17 @@ pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+
+def pytest_configure(config):
+    # До сбора тестов: сбор обращается к атрибутам модулей, и прокси
+    # django.core.cache.cache создаёт бэкенд по текущим настройкам.
+    from yatube.test_runner import test_environment
+
+    config._test_environment = test_environment()
+    config._test_environment.__enter__()
+
+
+def pytest_unconfigure(config):
+    config._test_environment.__exit__(None, None, None)
@@ -0,0 +1,241 @@
+"""Read-only JSON API без фреймворков.
+
+Списки постов листаются курсором по (pub_date, id), как и HTML-ленты.
+Параметр ``?fields=id,text`` ограничивает и ответ, и запрос: выбранные
+поля превращаются в ``.only()``, а связанные таблицы присоединяются
+только для запрошенных полей. Каждый эндпоинт делает фиксированное
+число запросов, не зависящее от размера страницы.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+
+from . import counters, feed
+from .models import FeedEntry, Group, Post, User
+from .utils.pagination import CursorPaginator, CursorSource
+from .utils.query_budget import query_budget
+
+# Поле ответа -> поля модели, которые нужно загрузить.
+POST_FIELDS = {
+    'id': ('id',),
+    'text': ('text',),
+    'pub_date': ('pub_date',),
+    'author': ('author', 'author__username'),
+    'group': ('group', 'group__slug'),
+    'image': ('image',),
+    'comment_count': ('comment_count',),
+}
+COMMENT_FIELDS = ('id', 'created', 'text', 'post', 'author',
+                  'author__username')
+
+
+class BadRequest(Exception):
+    pass
+
+
+def json_response(data, status=200):
+    return JsonResponse(
+        data, status=status, json_dumps_params={'ensure_ascii': False}
+    )
+
+
+def api_view(view):
+    """Превращает BadRequest в ответ 400 с описанием ошибки."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as error:
+            return json_response({'detail': str(error)}, status=400)
+    return wrapper
+
+
+def requested_fields(request):
+    value = request.GET.get('fields')
+    if not value:
+        return list(POST_FIELDS)
+    fields = [field for field in value.split(',') if field]
+    unknown = set(fields) - set(POST_FIELDS)
+    if unknown:
+        raise BadRequest(
+            'Неизвестные поля: {}'.format(', '.join(sorted(unknown)))
+        )
+    return fields
+
+
+def page_size(request):
+    try:
+        limit = int(request.GET.get('limit', settings.PAGE_SIZE))
+    except ValueError:
+        raise BadRequest('limit должен быть числом')
+    return max(1, min(limit, settings.API_MAX_PAGE_SIZE))
+
+
+def project(queryset, fields, prefix='', known=()):
+    """``.only()`` по запрошенным полям; ключ курсора грузится всегда.
+
+    ``known`` — связи, которые проставляет related manager: для них
+    JOIN не нужен.
+    """
+    related = [field for field in ('author', 'group')
+               if field in fields and field not in known]
+    only = {'id', 'pub_date'}
+    for field in fields:
+        only.update(POST_FIELDS[field][:1] if field in known
+                    else POST_FIELDS[field])
+    if prefix:
+        # Источник с готовым select_related: связанные поля обязательны.
+        only.update(('author', 'author__username', 'group', 'group__slug'))
+        # Ключ курсора записи ленты — её собственные pub_date и post_id.
+        return queryset.only(
+            'pub_date', 'post', *(prefix + name for name in only)
+        )
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset.only(*only)
+
+
+def serialize_post(post, fields):
+    values = {
+        'id': lambda: post.id,
+        'text': lambda: post.text,
+        'pub_date': lambda: post.pub_date.isoformat(),
+        'author': lambda: post.author.username,
+        'group': lambda: post.group.slug if post.group_id else None,
+        'image': lambda: post.image.url if post.image else None,
+        'comment_count': lambda: post.comment_count,
+    }
+    return {field: values[field]() for field in fields}
+
+
+def cursor_page(request, queryset, sources=None, per_page=None):
+    """Страница курсорной ленты и ссылки на соседние страницы."""
+    paginator = CursorPaginator(
+        queryset,
+        per_page or page_size(request),
+        request.GET.get('cursor'),
+        sources,
+    )
+    page = paginator.get_page()
+    links = {}
+    for name, cursor in (('next', paginator.next_cursor),
+                         ('previous', paginator.previous_cursor)):
+        links[name] = None
+        if cursor:
+            params = request.GET.copy()
+            params['cursor'] = cursor
+            links[name] = f'{request.path}?{params.urlencode()}'
+    return page, links
+
+
+def post_list(request, queryset, known=()):
+    fields = requested_fields(request)
+    page, links = cursor_page(request, project(queryset, fields, known=known))
+    return json_response({
+        'results': [serialize_post(post, fields) for post in page],
+        **links,
+    })
+
+
+@query_budget(1)
+@api_view
+def posts(request):
+    return post_list(request, Post.objects.all())
+
+
+@query_budget(2)
+@api_view
+def group_posts(request, slug):
+    group = get_object_or_404(Group.objects.only('id', 'slug'), slug=slug)
+    return post_list(request, group.posts.all(), known=('group',))
+
+
+@query_budget(2)
+@api_view
+def profile_posts(request, username):
+    author = get_object_or_404(
+        User.objects.only('id', 'username'), username=username
+    )
+    return post_list(request, author.posts.all(), known=('author',))
+
+
+@query_budget(5)
+@api_view
+def follow_posts(request):
+    if not request.user.is_authenticated:
+        return json_response(
+            {'detail': 'Требуется авторизация'}, status=401
+        )
+    fields = requested_fields(request)
+    sources = [
+        source._replace(queryset=project(
+            source.queryset, fields,
+            'post__' if source.queryset.model is FeedEntry else '',
+        ))
+        for source in feed.sources(request.user)
+    ]
+    page, links = cursor_page(request, sources[0].queryset, sources)
+    return json_response({
+        'results': [serialize_post(post, fields) for post in page],
+        **links,
+    })
+
+
+@query_budget(2)
+@api_view
+def post_detail(request, post_id):
+    """Пост и страница его комментариев (курсор ?cursor= по комментариям)."""
+    fields = requested_fields(request)
+    post = get_object_or_404(project(Post.objects.all(), fields), pk=post_id)
+    comments = post.comments.select_related('author').only(*COMMENT_FIELDS)
+    page, links = cursor_page(
+        request,
+        comments,
+        [CursorSource(comments, ('created', 'id'))],
+        settings.COMMENTS_PAGE_SIZE,
+    )
+    return json_response({
+        **serialize_post(post, fields),
+        'comments': [{
+            'id': comment.id,
+            'author': comment.author.username,
+            'text': comment.text,
+            'created': comment.created.isoformat(),
+        } for comment in page],
+        'comments_next': links['next'],
+        'comments_previous': links['previous'],
+    })
+
+
+@query_budget(1)
+def groups(request):
+    return json_response({'results': list(
+        Group.objects.order_by('title').values('slug', 'title',
+                                               'description')
+    )})
+
+
+@query_budget(1)
+def group_detail(request, slug):
+    group = get_object_or_404(
+        Group.objects.values('slug', 'title', 'description'), slug=slug
+    )
+    return json_response(group)
+
+
+@query_budget(2)
+def profile(request, username):
+    author = get_object_or_404(
+        User.objects.only('id', 'username', 'first_name', 'last_name'),
+        username=username,
+    )
+    stats = counters.for_user(author)
+    return json_response({
+        'username': author.username,
+        'full_name': author.get_full_name(),
+        'posts_count': stats.posts_count,
+        'followers_count': stats.followers_count,
+        'following_count': stats.following_count,
+    })
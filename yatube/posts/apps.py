@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class PostsConfig(AppConfig):
     name = 'posts'
     verbose_name = 'Посты'
+
+    def ready(self):
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .utils import sqlite
+
+        connection_created.connect(sqlite.on_connection_created)
+        request_started.connect(sqlite.check_connections)
@@ -0,0 +1,347 @@
+"""Двухуровневый кеш: LRU в процессе поверх общего файла SQLite.
+
+У ``LocMemCache`` каждый воркер держит свой кеш: с N процессами доля
+попаданий падает примерно в N раз, а инвалидация (поколения страниц в
+``posts.utils.page_cache``) не доходит до соседей. Здесь второй уровень
+— таблица в файле SQLite ``LOCATION``, общая для всех процессов хоста,
+а первый — небольшой LRU в памяти процесса
+(``OPTIONS['L1_MAX_ENTRIES']``).
+
+Первый уровень согласован через штампы версий: рядом с базой лежит
+отображённый в память файл ``<LOCATION>.stamps`` из ``STAMP_SLOTS``
+слотов по 8 байт. Ключ хешируется в слот, каждая запись или удаление
+ключа пишет в слот новое случайное значение. Запись первого уровня
+помнит значение слота, прочитанное до чтения из SQLite, и действительна,
+пока слот не изменился: проверка — 8 байт из памяти, без обращения к
+базе. Совпадение слотов у разных ключей приводит только к лишнему
+чтению второго уровня.
+"""
+import mmap
+import os
+import pickle
+import random
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+from .utils.sqlite import configure
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+}
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache '
+    '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)'
+)
+STAMP = struct.Struct('<Q')
+# Ключей в одном запросе IN (...) — ниже лимита переменных SQLite.
+BATCH_SIZE = 500
+# Доля записей, после которых вытесняются лишние строки второго уровня.
+CULL_PROBABILITY = 0.01
+
+# Первый уровень и штампы общие для всех потоков процесса: Django
+# создаёт отдельный экземпляр бэкенда в каждом потоке.
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class LRU:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class Stamps:
+    """Слоты штампов в общем файле, отображённом в память."""
+    def __init__(self, path, slots):
+        descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Файл, созданный с другим числом слотов, не уменьшается:
+            # все процессы должны хешировать ключи одинаково.
+            size = max(slots * STAMP.size, os.fstat(descriptor).st_size)
+            os.ftruncate(descriptor, size)
+            self.map = mmap.mmap(descriptor, size)
+        finally:
+            os.close(descriptor)
+        self.slots = size // STAMP.size
+
+    def offset(self, key):
+        return zlib.crc32(key.encode()) % self.slots * STAMP.size
+
+    def read(self, key):
+        return STAMP.unpack_from(self.map, self.offset(key))[0]
+
+    def renew(self, keys):
+        for key in keys:
+            STAMP.pack_into(self.map, self.offset(key),
+                            random.getrandbits(64))
+
+    def renew_all(self):
+        self.map[:] = os.urandom(len(self.map))
+
+
+def shared(location, l1_max_entries, slots):
+    with _shared_lock:
+        if location not in _shared:
+            _shared[location] = (
+                LRU(l1_max_entries), Stamps(f'{location}.stamps', slots)
+            )
+        return _shared[location]
+
+
+def private_directory(directory):
+    """Создаёт каталог кеша с правами 0700 и проверяет владельца.
+
+    Значения кеша — pickle: файл, который может подменить другой
+    пользователь, означает выполнение его кода в процессе сервера.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    owner = os.stat(directory).st_uid
+    if owner != os.getuid():
+        raise ImproperlyConfigured(
+            f'Каталог кеша {directory} принадлежит другому пользователю '
+            f'(uid {owner}).'
+        )
+
+
+def chunks(keys):
+    for start in range(0, len(keys), BATCH_SIZE):
+        yield keys[start:start + BATCH_SIZE]
+
+
+class TwoTierCache(BaseCache):
+    """Бэкенд ``posts.cache.TwoTierCache``; ``LOCATION`` — путь к файлу."""
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.location = location
+        private_directory(os.path.dirname(os.path.abspath(location)))
+        self.l1, self.stamps = shared(
+            location,
+            options.get('L1_MAX_ENTRIES', 1000),
+            options.get('STAMP_SLOTS', 65536),
+        )
+        self.local = threading.local()
+
+    def connection(self):
+        """Соединение потока; после fork открывается заново."""
+        local = self.local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(
+                self.location, isolation_level=None,
+                timeout=PRAGMAS['busy_timeout'] / 1000,
+            )
+            configure(local.connection, PRAGMAS)
+            local.connection.execute(SCHEMA)
+            local.pid = os.getpid()
+        return local.connection
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connection()
+        cursor = connection.cursor()
+        # IMMEDIATE: блокировка записи берётся сразу, и чтение-изменение
+        # в incr не теряет запись соседнего процесса.
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            yield cursor
+        except BaseException:
+            connection.rollback()
+            raise
+        else:
+            connection.commit()
+        finally:
+            cursor.close()
+
+    def key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def fetch(self, keys):
+        """Сериализованные значения ключей: из L1, остальное из SQLite."""
+        now = time.time()
+        found, missing = {}, []
+        for key in keys:
+            entry = self.l1.get(key)
+            if (entry is not None and entry[2] == self.stamps.read(key)
+                    and (entry[1] is None or entry[1] > now)):
+                found[key] = entry[0]
+            else:
+                missing.append(key)
+        if not missing:
+            return found
+        # Штамп читается до строки: запись, изменившая ключ после этого,
+        # сменит и штамп, и запись L1 станет недействительной.
+        stamps = {key: self.stamps.read(key) for key in missing}
+        connection = self.connection()
+        for batch in chunks(missing):
+            rows = connection.execute(
+                'SELECT key, value, expires FROM cache WHERE key IN ({})'
+                .format(', '.join('?' * len(batch))), batch
+            )
+            for key, value, expires in rows:
+                if expires is None or expires > now:
+                    self.l1.set(key, (value, expires, stamps[key]))
+                    found[key] = value
+        return found
+
+    def changed(self, keys):
+        self.stamps.renew(keys)
+        # Своё значение тоже перечитывается из SQLite: параллельная
+        # запись другого процесса могла оказаться в базе позже нашей.
+        self.l1.discard(keys)
+
+    def get(self, key, default=None, version=None):
+        key = self.key(key, version)
+        value = self.fetch([key]).get(key)
+        return default if value is None else pickle.loads(value)
+
+    def get_many(self, keys, version=None):
+        made = {self.key(key, version): key for key in keys}
+        return {
+            made[key]: pickle.loads(value)
+            for key, value in self.fetch(list(made)).items()
+        }
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.store({self.key(key, version): value}, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self.store({self.key(key, version): value
+                    for key, value in data.items()}, timeout)
+        return []
+
+    def store(self, data, timeout):
+        expires = self.get_backend_timeout(timeout)
+        rows = [(key, pickle.dumps(value, self.pickle_protocol), expires)
+                for key, value in data.items()]
+        with self.transaction() as cursor:
+            cursor.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)', rows
+            )
+        self.changed(list(data))
+        if random.random() < CULL_PROBABILITY:
+            self.cull()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.key(key, version)
+        with self.transaction() as cursor:
+            cursor.execute(
+                'INSERT INTO cache (key, value, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+                'expires = excluded.expires '
+                'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+                (key, pickle.dumps(value, self.pickle_protocol),
+                 self.get_backend_timeout(timeout), time.time())
+            )
+            added = cursor.rowcount == 1
+        if added:
+            self.changed([key])
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        key = self.key(key, version)
+        with self.transaction() as cursor:
+            row = cursor.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)', (key, time.time())
+            ).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            cursor.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (pickle.dumps(value, self.pickle_protocol), key)
+            )
+        self.changed([key])
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.key(key, version)
+        with self.transaction() as cursor:
+            cursor.execute(
+                'UPDATE cache SET expires = ? WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), key, time.time())
+            )
+            touched = cursor.rowcount == 1
+        if touched:
+            self.changed([key])
+        return touched
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.key(key, version) for key in keys]
+        with self.transaction() as cursor:
+            for batch in chunks(keys):
+                cursor.execute(
+                    'DELETE FROM cache WHERE key IN ({})'.format(
+                        ', '.join('?' * len(batch))), batch
+                )
+        self.changed(keys)
+
+    def clear(self):
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM cache')
+        self.stamps.renew_all()
+        self.l1.clear()
+
+    def cull(self):
+        """Удаляет просроченные строки и долю самых старых сверх лимита.
+
+        Штампы вытесненных ключей не меняются: копия в L1 процесса
+        остаётся верным значением, просто живёт дольше строки.
+        """
+        with self.transaction() as cursor:
+            cursor.execute(
+                'DELETE FROM cache WHERE expires IS NOT NULL '
+                'AND expires <= ?', (time.time(),)
+            )
+            count, = cursor.execute('SELECT COUNT(*) FROM cache').fetchone()
+            if count <= self._max_entries:
+                return
+            excess = (count // self._cull_frequency
+                      if self._cull_frequency else count)
+            cursor.execute(
+                'DELETE FROM cache WHERE rowid IN '
+                '(SELECT rowid FROM cache ORDER BY rowid LIMIT ?)', (excess,)
+            )
@@ -0,0 +1,90 @@
+"""Хранимые счётчики постов, комментариев и подписок.
+
+Счётчики меняются F()-выражениями в обработчиках сигналов, то есть
+в той же транзакции, что и создание или удаление записи. Строка
+счётчиков пользователя создаётся при первом чтении и сразу
+пересчитывается целиком.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import AuthorStats, Comment, Follow, Post
+
+
+def _count(model, field, outer='user_id'):
+    rows = model.objects.filter(**{field: OuterRef(outer)}).order_by()
+    return Coalesce(
+        Subquery(rows.values(field).annotate(total=Count('id')).values(
+            'total'
+        )),
+        0,
+    )
+
+
+def recount_users(user_ids):
+    """Пересчитывает счётчики пользователей по фактическим данным.
+
+    Обновляются только разошедшиеся строки; возвращает id их
+    пользователей.
+    """
+    existing = set(AuthorStats.objects.filter(
+        user_id__in=user_ids
+    ).values_list('user_id', flat=True))
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=user_id)
+         for user_id in user_ids if user_id not in existing],
+        ignore_conflicts=True,
+    )
+    drifted = list(AuthorStats.objects.filter(user_id__in=user_ids).annotate(
+        actual_posts=_count(Post, 'author'),
+        actual_followers=_count(Follow, 'author'),
+        actual_following=_count(Follow, 'user'),
+    ).exclude(
+        posts_count=F('actual_posts'),
+        followers_count=F('actual_followers'),
+        following_count=F('actual_following'),
+    ).values_list('user_id', flat=True))
+    AuthorStats.objects.filter(user_id__in=drifted).update(
+        posts_count=_count(Post, 'author'),
+        followers_count=_count(Follow, 'author'),
+        following_count=_count(Follow, 'user'),
+    )
+    return drifted
+
+
+def recount_posts(first_id, last_id):
+    """Пересчитывает comment_count у постов с id в [first_id, last_id].
+
+    Возвращает id постов, у которых счётчик разошёлся с данными.
+    """
+    drifted = list(Post.objects.filter(id__range=(first_id, last_id)).annotate(
+        actual_comments=_count(Comment, 'post', outer='pk')
+    ).exclude(
+        comment_count=F('actual_comments')
+    ).values_list('id', flat=True))
+    Post.objects.filter(id__in=drifted).update(
+        comment_count=_count(Comment, 'post', outer='pk')
+    )
+    return drifted
+
+
+def bump_user(user_id, **deltas):
+    AuthorStats.objects.filter(user_id=user_id).update(
+        **{field: Greatest(F(field) + delta, 0)
+           for field, delta in deltas.items()}
+    )
+
+
+def bump_post(post_id, delta):
+    Post.objects.filter(id=post_id).update(
+        comment_count=Greatest(F('comment_count') + delta, 0)
+    )
+
+
+def for_user(user):
+    """Счётчики пользователя; при отсутствии строки она создаётся."""
+    stats = AuthorStats.objects.filter(user=user).first()
+    if stats is None:
+        recount_users([user.id])
+        stats = AuthorStats.objects.get(user=user)
+    return stats
@@ -0,0 +1,145 @@
+"""Материализованная лента подписок.
+
+Новый пост раскладывается по inbox'ам подписчиков автора (FeedEntry),
+поэтому страница ленты читается одним диапазонным запросом по индексу
+(user, pub_date). Посты авторов с очень большим числом подписчиков
+в inbox'ы не пишутся, а подмешиваются при чтении.
+
+Такой автор отмечается флагом ``AuthorStats.feed_merged``, как только
+подписчиков становится больше ``FEED_FANOUT_LIMIT``, и флаг не
+снимается, когда подписчиков снова меньше: написанных в это время постов
+нет в inbox'ах, и без подмешивания они пропали бы из лент. Флаги
+пересчитывает полная пересборка ``rebuild_feeds``, которая заодно
+раскладывает эти посты.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import AuthorStats, FeedEntry, Follow, Post
+from .utils.pagination import CursorSource
+
+CELEBRITIES_KEY = 'feed:celebrities'
+BATCH_SIZE = 500
+
+
+def celebrity_ids():
+    """Авторы, чьи посты подмешиваются при чтении, а не раскладываются."""
+    ids = cache.get(CELEBRITIES_KEY)
+    if ids is None:
+        ids = frozenset(AuthorStats.objects.filter(
+            feed_merged=True
+        ).values_list('user_id', flat=True))
+        cache.set(CELEBRITIES_KEY, ids, settings.FEED_CELEBRITIES_TTL)
+    return ids
+
+
+def promote(author_id):
+    """Отмечает автора, у которого подписчиков стало больше лимита."""
+    marked = AuthorStats.objects.filter(
+        user_id=author_id, feed_merged=False,
+        followers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).update(feed_merged=True)
+    if marked:
+        cache.delete(CELEBRITIES_KEY)
+
+
+def reclassify():
+    """Флаги всех авторов по текущему числу подписчиков.
+
+    Снятый флаг оставляет посты автора без inbox'ов, поэтому вызывается
+    только перед пересборкой лент всех пользователей.
+    """
+    limit = settings.FEED_FANOUT_LIMIT
+    AuthorStats.objects.filter(followers_count__gt=limit).update(
+        feed_merged=True
+    )
+    AuthorStats.objects.filter(followers_count__lte=limit).update(
+        feed_merged=False
+    )
+    cache.delete(CELEBRITIES_KEY)
+
+
+def fan_out(post):
+    """Кладёт новый пост в ленты подписчиков автора."""
+    if post.author_id in celebrity_ids():
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=user_id, post_id=post.id, pub_date=post.pub_date)
+         for user_id in follower_ids.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту читателя последние посты нового автора.
+
+    Выполняется внутри запроса подписки, поэтому копируется не вся
+    история, а ``FEED_BACKFILL_SIZE`` новых постов — первая страница.
+    """
+    if author_id in celebrity_ids():
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id'
+    ).values_list('id', 'pub_date')[:settings.FEED_BACKFILL_SIZE]
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in posts.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты читателя посты автора после отписки."""
+    FeedEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def rebuild(user_ids):
+    """Пересобирает ленты пользователей с нуля в одной транзакции."""
+    follows = Follow.objects.filter(user_id__in=user_ids).exclude(
+        author_id__in=celebrity_ids()
+    )
+    readers = defaultdict(list)
+    for user_id, author_id in follows.values_list('user_id', 'author_id'):
+        readers[author_id].append(user_id)
+    posts = Post.objects.filter(
+        author_id__in=follows.values('author_id')
+    ).values_list('id', 'author_id', 'pub_date')
+    entries = [
+        FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        for post_id, author_id, pub_date in posts.iterator()
+        for user_id in readers[author_id]
+    ]
+    with transaction.atomic():
+        FeedEntry.objects.filter(user_id__in=user_ids).delete()
+        FeedEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+    return len(entries)
+
+
+def sources(user):
+    """Источники курсорной ленты подписок: inbox и авторы-знаменитости."""
+    inbox = CursorSource(
+        FeedEntry.objects.filter(user=user).select_related(
+            'post__author', 'post__group'
+        ),
+        ('pub_date', 'post_id'),
+        lambda entry: entry.post,
+    )
+    celebrities = celebrity_ids()
+    if not celebrities:
+        return [inbox]
+    merged = CursorSource(
+        Post.objects.select_related('author', 'group').filter(
+            author__following__user=user, author_id__in=celebrities
+        )
+    )
+    return [inbox, merged]
@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from . import images
 from .models import Comment, Post
 
 
@@ -8,6 +10,13 @@ class PostForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.fields['group'].empty_label = 'Группа не выбрана'
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # Уже сохранённая картинка при редактировании не перекодируется.
+        if isinstance(image, UploadedFile):
+            return images.ingest(image)
+        return image
+
     class Meta:
         model = Post
         fields = ['text', 'group', 'image']
@@ -0,0 +1,154 @@
+"""Обработка загруженных картинок постов.
+
+Картинка поворачивается по EXIF, уменьшается до ``IMAGE_MAX_SIDE``
+и перекодируется в прогрессивный JPEG или WebP без метаданных.
+Размер проверяется по заголовку файла до декодирования пикселей,
+поэтому «бомбы декомпрессии» отклоняются без выделения памяти.
+GIF не перекодируется, чтобы сохранить анимацию, а пересобирается из
+кадров: без комментариев и расширений, в пределах ``IMAGE_MAX_PIXELS``
+на все кадры и ``IMAGE_MAX_BYTES``.
+Работа с Pillow выполняется в ограниченном пуле потоков, чтобы
+одновременные загрузки не занимали память без предела.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, ImageSequence
+
+from . import metrics
+
+# Анимированные GIF пересобираются покадрово: перекодирование в JPEG
+# или WebP сломало бы анимацию.
+FRAMES_FORMATS = ('GIF',)
+# Из сведений кадра в пересобранный файл переносится только прозрачность.
+FRAME_INFO = ('transparency',)
+EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='images',
+        )
+    return _executor
+
+
+def check_size(image):
+    width, height = image.size
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Слишком большое изображение: %(width)s×%(height)s.',
+            code='image_too_large',
+            params={'width': width, 'height': height},
+        )
+
+
+def check_bytes(size):
+    if size > settings.IMAGE_MAX_BYTES:
+        raise ValidationError(
+            'Слишком большой файл: %(size)s байт.',
+            code='image_too_large',
+            params={'size': size},
+        )
+
+
+def rebuild_frames(image, name):
+    """GIF из тех же кадров и задержек, без метаданных.
+
+    Кадры декодируются по одному, пока их суммарная площадь не превысит
+    ``IMAGE_MAX_PIXELS``.
+    """
+    width, height = image.size
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(image):
+        if (len(frames) + 1) * width * height > settings.IMAGE_MAX_PIXELS:
+            raise ValidationError(
+                'Слишком много кадров: больше %(frames)s.',
+                code='image_too_large',
+                params={'frames': len(frames)},
+            )
+        durations.append(frame.info.get('duration', 100))
+        copy = frame.copy()
+        copy.info = {key: value for key, value in frame.info.items()
+                     if key in FRAME_INFO}
+        frames.append(copy)
+    options = {'save_all': True, 'append_images': frames[1:],
+               'duration': durations}
+    if 'loop' in image.info:
+        options['loop'] = image.info['loop']
+    buffer = BytesIO()
+    frames[0].save(buffer, image.format, **options)
+    check_bytes(buffer.tell())
+    return ContentFile(buffer.getvalue(), name=os.path.basename(name))
+
+
+def reencode(upload):
+    """Возвращает перекодированную картинку.
+
+    ``verify()`` в ImageField проверяет только структуру файла: обрезанный
+    JPEG её проходит и ломается уже при декодировании пикселей.
+    """
+    try:
+        return convert(upload)
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise ValidationError(
+            'Не удалось прочитать изображение: файл повреждён.',
+            code='invalid_image',
+        )
+
+
+def convert(upload):
+    upload.seek(0)
+    image = Image.open(upload)
+    check_size(image)
+    if image.format in FRAMES_FORMATS:
+        check_bytes(upload.size)
+        return rebuild_frames(image, upload.name)
+    max_side = settings.IMAGE_MAX_SIDE
+    # Для JPEG декодер сразу уменьшает картинку кратно 1/2..1/8.
+    image.draft('RGB', (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    output_format = settings.IMAGE_FORMAT
+    if image.mode not in ('RGB', 'L'):
+        has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        if has_alpha and output_format == 'JPEG':
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image.convert('RGBA'), mask=image.convert(
+                'RGBA'
+            ).getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    buffer = BytesIO()
+    options = {'quality': settings.IMAGE_QUALITY}
+    if output_format == 'JPEG':
+        options.update(progressive=True, optimize=True)
+    else:
+        options.update(method=4)
+    icc_profile = image.info.get('icc_profile')
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    image.save(buffer, output_format, **options)
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    return ContentFile(
+        buffer.getvalue(), name=stem + EXTENSIONS[output_format]
+    )
+
+
+def ingest(upload):
+    """Обрабатывает загруженный файл в пуле потоков и ждёт результата."""
+    result = get_executor().submit(reencode, upload).result()
+    metrics.UPLOAD_SIZE.observe(upload.size, stage='received')
+    metrics.UPLOAD_SIZE.observe(result.size, stage='stored')
+    return result
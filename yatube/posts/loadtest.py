@@ -0,0 +1,260 @@
+"""Нагрузочный генератор: запросы прямо в WSGI-приложение, без сети.
+
+Прибытие запросов открытое (open loop): моменты отправки заранее
+разыгрываются пуассоновским потоком с заданной интенсивностью и не
+зависят от того, успевает ли приложение. Задержка считается от
+запланированного момента, поэтому очередь перед перегруженным
+приложением видна в ней, а не прячется (coordinated omission).
+"""
+import io
+import random
+import sys
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import reverse
+from PIL import Image
+
+from .utils.stats import histogram, percentile
+
+SCENARIOS = ('index', 'follow', 'comment', 'upload')
+
+# Время от старта прогона, с: запланированная отправка, фактическое
+# начало обработки и её конец. status 0 — исключение в приложении,
+# его класс в error.
+Record = namedtuple('Record',
+                    'scenario scheduled started finished status error')
+Record.__new__.__defaults__ = (None,)
+
+
+def parse_mix(value):
+    """``index=60,follow=25`` -> {'index': 60.0, 'follow': 25.0}."""
+    mix = {}
+    for part in filter(None, value.split(',')):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise ValueError(f'Неизвестный сценарий: {name}')
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError('Пустая смесь запросов')
+    return mix
+
+
+def arrivals(mix, rate, duration, rng):
+    """Пуассоновский поток: (момент отправки, сценарий) до конца прогона."""
+    names, weights = list(mix), list(mix.values())
+    moment = 0.0
+    while True:
+        moment += rng.expovariate(rate)
+        if moment >= duration:
+            return
+        yield moment, rng.choices(names, weights)[0]
+
+
+def sample_image():
+    output = io.BytesIO()
+    Image.linear_gradient('L').resize((800, 600)).convert('RGB').save(
+        output, 'JPEG', quality=85
+    )
+    return output.getvalue()
+
+
+class Traffic:
+    """Сценарии запросов к WSGI-приложению.
+
+    ``users`` — cookie залогиненных пользователей (sessionid и
+    csrftoken), ``post_ids`` — посты для комментариев.
+    """
+    def __init__(self, app, users, post_ids, host='localhost', seed=None):
+        self.app = app
+        self.users = users
+        self.post_ids = post_ids
+        self.host = host
+        self.image = sample_image()
+        self.rng = random.Random(seed)
+
+    def request(self, method, path, cookies=None, body=b'',
+                content_type=''):
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_HOST': self.host,
+            'HTTP_COOKIE': '; '.join(
+                f'{name}={value}' for name, value in (cookies or {}).items()
+            ),
+            'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split()[0])
+            response['headers'] = headers
+
+        body = self.app(environ, start_response)
+        try:
+            for _ in body:
+                pass
+        finally:
+            # close() отправляет request_finished: Django закрывает
+            # соединения с базой так же, как под настоящим сервером.
+            if hasattr(body, 'close'):
+                body.close()
+        return response['status'], response['headers']
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def index(self):
+        return self.request('GET', reverse('posts:index'))[0]
+
+    def follow(self):
+        return self.request('GET', reverse('posts:follow_index'),
+                            self.user())[0]
+
+    def comment(self):
+        cookies = self.user()
+        path = reverse('posts:add_comment',
+                       kwargs={'post_id': self.rng.choice(self.post_ids)})
+        body = urlencode({
+            'text': 'Комментарий под нагрузкой',
+            'csrfmiddlewaretoken': cookies['csrftoken'],
+        }).encode()
+        return self.request('POST', path, cookies, body,
+                            'application/x-www-form-urlencoded')[0]
+
+    def upload(self):
+        cookies = self.user()
+        body = encode_multipart(BOUNDARY, {
+            'text': 'Пост с картинкой под нагрузкой',
+            'image': SimpleUploadedFile('load.jpg', self.image,
+                                        'image/jpeg'),
+            'csrfmiddlewaretoken': cookies['csrftoken'],
+        })
+        return self.request('POST', reverse('posts:post_create'), cookies,
+                            body, MULTIPART_CONTENT)[0]
+
+    def csrf_cookie(self, cookies):
+        """Получает csrftoken, как браузер: GET страницы с формой.
+
+        Маскированный токен из cookie годится и как значение поля формы.
+        """
+        path = reverse('posts:post_create')
+        status, headers = self.request('GET', path, cookies)
+        jar = SimpleCookie()
+        for name, value in headers:
+            if name.lower() == 'set-cookie':
+                jar.load(value)
+        if settings.CSRF_COOKIE_NAME not in jar:
+            raise RuntimeError(
+                f'{path} ответил {status} без CSRF-cookie: проверьте '
+                f'--host и ALLOWED_HOSTS'
+            )
+        return jar[settings.CSRF_COOKIE_NAME].value
+
+
+def run(traffic, mix, rate, duration, workers, seed=None):
+    """Прогон открытого потока; workers=0 — всё в текущем потоке."""
+    schedule = list(arrivals(mix, rate, duration, random.Random(seed)))
+    start = time.perf_counter()
+
+    def execute(scheduled, scenario):
+        started = time.perf_counter() - start
+        error = None
+        try:
+            status = getattr(traffic, scenario)()
+        except Exception as exception:
+            status, error = 0, type(exception).__name__
+        return Record(scenario, scheduled, started,
+                      time.perf_counter() - start, status, error)
+
+    def wait(moment):
+        delay = start + moment - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    if not workers:
+        records = []
+        for moment, scenario in schedule:
+            wait(moment)
+            records.append(execute(moment, scenario))
+        return records
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for moment, scenario in schedule:
+            wait(moment)
+            futures.append(pool.submit(execute, moment, scenario))
+        return [future.result() for future in futures]
+
+
+def is_error(record):
+    return record.status == 0 or record.status >= 400
+
+
+def latency_stats(records):
+    latencies = [(r.finished - r.scheduled) * 1000 for r in records]
+    if not latencies:
+        return {
+            'requests': 0, 'errors': 0, 'p50_ms': 0.0, 'p95_ms': 0.0,
+            'p99_ms': 0.0, 'max_ms': 0.0, 'service_ms': 0.0,
+            'histogram': histogram(()),
+        }
+    return {
+        'requests': len(records),
+        'errors': sum(map(is_error, records)),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(max(latencies), 3),
+        'service_ms': round(sum(
+            (r.finished - r.started) * 1000 for r in records
+        ) / len(records), 3),
+        'histogram': histogram(latencies),
+    }
+
+
+def summarize(records, rate, interval=1.0):
+    """Итоги прогона, по сценариям и по окнам времени."""
+    elapsed = max((r.finished for r in records), default=0) or 1
+    errors = sum(map(is_error, records))
+    windows = {}
+    for record in records:
+        windows.setdefault(int(record.scheduled // interval), []).append(
+            record)
+    return {
+        'offered_rps': rate,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round((len(records) - errors) / elapsed, 2),
+        'error_rate': round(errors / len(records), 4) if records else 0,
+        'exceptions': dict(Counter(
+            r.error for r in records if r.error is not None
+        ).most_common()),
+        'total': latency_stats(records),
+        'scenarios': {
+            name: latency_stats([r for r in records if r.scenario == name])
+            for name in SCENARIOS if any(r.scenario == name for r in records)
+        },
+        'timeline': [
+            {'start_s': index * interval, **latency_stats(windows[index])}
+            for index in sorted(windows)
+        ],
+    }
@@ -0,0 +1,351 @@
+import json
+import platform
+import random
+import re
+import time
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from faker import Faker
+
+from posts.management.commands.import_yatube import keep_dates
+from posts.models import Comment, Follow, Group, Post
+from posts.urls import app_name, urlpatterns
+from posts.utils import page_cache
+from posts.utils.stats import percentile
+
+User = get_user_model()
+
+PREFIX = 'bench'
+# Замер без --cache очищает кеш перед каждым запросом, поэтому идёт
+# в отдельном кеше процесса, а не в общем кеше сайта.
+BENCH_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': PREFIX,
+    },
+}
+READER = f'{PREFIX}_reader'
+BASE_DATE = datetime(2020, 1, 1, tzinfo=timezone.utc)
+TEXT_POOL = 2000
+READER_FOLLOWS = 50
+# Вью, которые меняют данные даже на GET, и выгрузка всей базы.
+SKIPPED = ('profile_follow', 'profile_unfollow', 'export')
+# Абсолютный допуск к порогу регрессии: меньше него — шум таймера.
+NOISE_MS = 1.0
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит детерминированный синтетический набор данных и замеряет '
+        'каждый URL из posts/urls.py: p50/p95/p99, число запросов и размер '
+        'ответа. Пример масштаба: --users 100000 --posts 10000000 '
+        '--follows 1000000 --comments 1000000.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--follows', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument(
+            '--cache', action='store_true',
+            help='Не очищать кеш перед запросами: замер тёплых страниц '
+                 'в кеше из настроек.'
+        )
+        parser.add_argument('--output', default='bench.json')
+        parser.add_argument(
+            '--compare', metavar='BASELINE',
+            help='JSON прошлого запуска: ошибка при росте p95 или запросов.'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Допустимый относительный рост p95.'
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть не меньше 1.')
+        if User.objects.filter(username=READER).exists():
+            self.stdout.write('Набор данных уже построен, используется он.')
+        else:
+            self.build(options)
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        if not options['cache']:
+            overrides['CACHES'] = BENCH_CACHES
+        with override_settings(**overrides):
+            views = self.measure(options)
+        results = {
+            'meta': {
+                'dataset': self.dataset_size(),
+                'seed': options['seed'],
+                'repeat': options['repeat'],
+                'cache': options['cache'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'created': datetime.now(timezone.utc).isoformat(),
+            },
+            'views': views,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(results, output, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Результаты записаны в {options["output"]}')
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as baseline:
+                self.compare(results, json.load(baseline),
+                             options['threshold'])
+
+    def build(self, options):
+        """Пользователи, группы, посты, комментарии и подписки.
+
+        Всё определяется --seed: случайные выборы, тексты Faker и даты
+        (от BASE_DATE с шагом в минуту), поэтому повторная сборка на
+        пустой базе даёт те же данные.
+        """
+        rng = random.Random(options['seed'])
+        fake = Faker('ru_RU')
+        fake.seed_instance(options['seed'])
+        texts = [fake.paragraph(nb_sentences=3) for _ in range(TEXT_POOL)]
+        batch_size = options['batch_size']
+        password = make_password(None)
+        start = time.perf_counter()
+
+        users = (
+            User(username=f'{PREFIX}_{number}_{fake.user_name()}'[:150],
+                 first_name=fake.first_name(), last_name=fake.last_name(),
+                 email=fake.email(), password=password)
+            for number in range(options['users'])
+        )
+        self.insert(User, users, batch_size)
+        User.objects.create(username=READER, password=password)
+        user_ids = list(User.objects.filter(
+            username__startswith=f'{PREFIX}_'
+        ).exclude(username=READER).order_by('id').values_list('id',
+                                                              flat=True))
+        if not user_ids:
+            raise CommandError('Нужен хотя бы один пользователь: --users.')
+
+        groups = (
+            Group(title=fake.catch_phrase()[:200],
+                  slug=f'{PREFIX}-{number}',
+                  description=fake.paragraph())
+            for number in range(options['groups'])
+        )
+        self.insert(Group, groups, batch_size)
+        group_ids = list(Group.objects.filter(
+            slug__startswith=f'{PREFIX}-'
+        ).order_by('id').values_list('id', flat=True))
+
+        def author():
+            # Перекос к первым пользователям: у популярных авторов
+            # постов на порядки больше, чем у остальных, как в жизни.
+            return user_ids[int(len(user_ids) * rng.random() ** 3)]
+
+        posts = (
+            Post(text=rng.choice(texts), author_id=author(),
+                 group_id=(rng.choice(group_ids)
+                           if group_ids and rng.random() < 0.6 else None),
+                 pub_date=BASE_DATE + timedelta(minutes=number))
+            for number in range(options['posts'])
+        )
+        # Посты вставляются подряд, их id занимают отрезок после last_id.
+        last_id = Post.objects.aggregate(last=Max('id'))['last'] or 0
+        with keep_dates():
+            self.insert(Post, posts, batch_size)
+            first, last = last_id + 1, last_id + options['posts']
+            if options['comments'] and options['posts']:
+                comments = (
+                    Comment(
+                        post_id=rng.randint(first, last),
+                        author_id=rng.choice(user_ids),
+                        text=rng.choice(texts)[:300],
+                        created=BASE_DATE + timedelta(
+                            minutes=options['posts'] + number),
+                    )
+                    for number in range(options['comments'])
+                )
+                self.insert(Comment, comments, batch_size)
+
+        reader = User.objects.get(username=READER)
+        self.insert(Follow, (
+            Follow(user=reader, author_id=author_id)
+            for author_id in user_ids[:READER_FOLLOWS]
+        ), batch_size)
+        self.insert(Follow, self.follows(rng, user_ids, options['follows']),
+                    batch_size)
+
+        call_command('recount_counters', workers=1, stdout=self.stdout)
+        call_command('rebuild_feeds', stdout=self.stdout)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Набор данных построен за {time.perf_counter() - start:.1f} с'
+        ))
+
+    def invalidate(self):
+        """Сбрасывает кеш страниц, которые показывают новые данные."""
+        page_cache.bump(page_cache.GLOBAL)
+        for slug in Group.objects.filter(
+            slug__startswith=f'{PREFIX}-'
+        ).values_list('slug', flat=True).iterator():
+            page_cache.bump(page_cache.GROUP, slug)
+        for username in User.objects.filter(
+            username__startswith=f'{PREFIX}_'
+        ).values_list('username', flat=True).iterator():
+            page_cache.bump(page_cache.AUTHOR, username)
+
+    def follows(self, rng, user_ids, total):
+        """Уникальные подписки: каждому подписчику — выборка без повторов."""
+        if len(user_ids) < 2:
+            return
+        per_user, extra = divmod(total, len(user_ids))
+        for position, user_id in enumerate(user_ids):
+            count = min(per_user + (position < extra), len(user_ids) - 1)
+            authors = rng.sample(user_ids, count + 1)
+            for author_id in [a for a in authors if a != user_id][:count]:
+                yield Follow(user_id=user_id, author_id=author_id)
+
+    def insert(self, model, objects, batch_size):
+        total = 0
+        for batch in chunks(objects, batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+            total += len(batch)
+        self.stdout.write(f'{model._meta.verbose_name_plural}: {total}')
+
+    def dataset_size(self):
+        return {
+            'users': User.objects.count(),
+            'groups': Group.objects.count(),
+            'posts': Post.objects.count(),
+            'comments': Comment.objects.count(),
+            'follows': Follow.objects.count(),
+        }
+
+    def targets(self):
+        """Имя URL и адрес для каждого маршрута posts/urls.py."""
+        reader = User.objects.get(username=READER)
+        group = Group.objects.filter(
+            slug__startswith=f'{PREFIX}-'
+        ).order_by('id').first() or Group.objects.first()
+        author = reader.follower.order_by('author_id').first()
+        post = Post.objects.order_by('-comment_count', '-id').first()
+        word = re.sub(r'\W', '', post.text.split()[0]) if post else 'пост'
+        values = {
+            'slug': group.slug if group else 'missing',
+            'username': author.author.username if author else READER,
+            'post_id': post.pk if post else 0,
+        }
+        extra = {'post_search': f'?q={word}'}
+        for pattern in urlpatterns:
+            if pattern.name in SKIPPED:
+                continue
+            names = re.findall(r'<(?:\w+:)?(\w+)>', str(pattern.pattern))
+            url = reverse(f'{app_name}:{pattern.name}',
+                          kwargs={name: values[name] for name in names})
+            yield f'{app_name}:{pattern.name}', url + extra.get(
+                pattern.name, '')
+
+    def measure(self, options):
+        client = Client()
+        client.force_login(User.objects.get(username=READER))
+        views = {}
+        for name, url in self.targets():
+            timings = []
+            try:
+                for _ in range(options['repeat']):
+                    if not options['cache']:
+                        cache.clear()
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    size = len(b''.join(response.streaming_content)
+                               if response.streaming else response.content)
+                    timings.append((time.perf_counter() - start) * 1000)
+                if not options['cache']:
+                    cache.clear()
+                # Все базы: с репликами чтения уходят не в default.
+                with ExitStack() as stack:
+                    captured = [
+                        stack.enter_context(CaptureQueriesContext(db))
+                        for db in connections.all()
+                    ]
+                    client.get(url)
+                queries = sum(len(context) for context in captured)
+            except Exception as error:
+                views[name] = {'url': url, 'error': repr(error)}
+                self.stderr.write(f'{name}: {error!r}')
+                continue
+            views[name] = {
+                'url': url,
+                'status': response.status_code,
+                'p50_ms': round(percentile(timings, 0.50), 3),
+                'p95_ms': round(percentile(timings, 0.95), 3),
+                'p99_ms': round(percentile(timings, 0.99), 3),
+                'queries': queries,
+                'bytes': size,
+            }
+            self.stdout.write(
+                '{:<24} {:>3} p50 {:>8.2f} p95 {:>8.2f} p99 {:>8.2f} мс '
+                '{:>3} запр. {:>8} Б'.format(
+                    name, response.status_code, views[name]['p50_ms'],
+                    views[name]['p95_ms'], views[name]['p99_ms'],
+                    queries, size,
+                )
+            )
+        return views
+
+    def compare(self, results, baseline, threshold):
+        if results['meta']['dataset'] != baseline['meta'].get('dataset'):
+            self.stderr.write('Внимание: наборы данных запусков различаются.')
+        regressions = []
+        for name, current in results['views'].items():
+            before = baseline['views'].get(name)
+            if not before or 'error' in before:
+                continue
+            if 'error' in current:
+                regressions.append(f'{name}: {current["error"]}')
+                continue
+            limit = before['p95_ms'] * (1 + threshold) + NOISE_MS
+            if current['p95_ms'] > limit:
+                regressions.append(
+                    f'{name}: p95 {before["p95_ms"]:.2f} -> '
+                    f'{current["p95_ms"]:.2f} мс'
+                )
+            if current['queries'] > before['queries']:
+                regressions.append(
+                    f'{name}: запросов {before["queries"]} -> '
+                    f'{current["queries"]}'
+                )
+        if regressions:
+            raise CommandError(
+                'Регрессии относительно базового запуска:\n'
+                + '\n'.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS('Регрессий нет.'))
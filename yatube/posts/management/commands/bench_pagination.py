@@ -0,0 +1,78 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+
+from posts.models import Post
+from posts.utils.pagination import FORWARD, CursorPaginator, encode_cursor
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает задержку OFFSET- и курсорной пагинации '
+        'на глубокой странице.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--populate', action='store_true',
+            help='Досоздать синтетические посты, если их не хватает.'
+        )
+
+    def handle(self, *args, **options):
+        page, repeat = options['page'], options['repeat']
+        per_page = settings.PAGE_SIZE
+        needed = page * per_page
+        missing = needed - Post.objects.count()
+        if missing > 0:
+            if not options['populate']:
+                self.stderr.write(
+                    f'Нужно минимум {needed} постов, не хватает {missing}. '
+                    'Запустите с --populate.'
+                )
+                return
+            self.populate(missing)
+
+        posts = Post.objects.select_related('author')
+        boundary = posts.order_by('-pub_date', '-id').values_list(
+            'pub_date', 'id'
+        )[(page - 1) * per_page - 1]
+        cursor = encode_cursor(*boundary, FORWARD)
+
+        offset_time = self.measure(
+            lambda: list(Paginator(
+                posts.order_by('-pub_date', '-id'), per_page
+            ).get_page(page)),
+            repeat,
+        )
+        cursor_time = self.measure(
+            lambda: list(CursorPaginator(posts, per_page, cursor).get_page()),
+            repeat,
+        )
+        self.stdout.write(f'Страница {page}, медиана из {repeat} запусков:')
+        self.stdout.write(f'  OFFSET: {offset_time * 1000:.2f} мс')
+        self.stdout.write(f'  cursor: {cursor_time * 1000:.2f} мс')
+
+    def measure(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    def populate(self, count):
+        author, _ = User.objects.get_or_create(username='bench_author')
+        Post.objects.bulk_create(
+            (Post(text=f'Синтетический пост #{i}', author=author)
+             for i in range(count)),
+            batch_size=500,
+        )
+        self.stdout.write(f'Создано синтетических постов: {count}')
@@ -0,0 +1,68 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts import search
+from posts.models import Post
+
+User = get_user_model()
+
+WORDS = (
+    'граф', 'бал', 'письмо', 'карета', 'сад', 'дуэль', 'вечер', 'замок',
+    'портрет', 'шпага', 'роман', 'усадьба', 'маскарад', 'тайна', 'свеча',
+)
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает задержку поиска через LIKE и через индекс FTS5.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--query', default='маскарад')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--populate', type=int, default=0, metavar='N',
+            help='Досоздать N синтетических постов перед замером.'
+        )
+
+    def handle(self, *args, **options):
+        if options['populate']:
+            self.populate(options['populate'])
+        query, repeat = options['query'], options['repeat']
+        posts = Post.objects.select_related('author', 'group')
+        per_page = settings.PAGE_SIZE
+
+        like_time = self.measure(
+            lambda: list(posts.filter(text__icontains=query)[:per_page]),
+            repeat,
+        )
+        fts_time = self.measure(
+            lambda: list(search.search(posts, query)[:per_page]),
+            repeat,
+        )
+        self.stdout.write(
+            f'«{query}» среди {Post.objects.count()} постов, '
+            f'медиана из {repeat} запусков:'
+        )
+        self.stdout.write(f'  LIKE: {like_time * 1000:.2f} мс')
+        self.stdout.write(f'  FTS5: {fts_time * 1000:.2f} мс')
+
+    def measure(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    def populate(self, count):
+        author, _ = User.objects.get_or_create(username='bench_author')
+        Post.objects.bulk_create(
+            (Post(text=' '.join(random.choices(WORDS, k=30)), author=author)
+             for _ in range(count)),
+            batch_size=500,
+        )
+        self.stdout.write(f'Создано синтетических постов: {count}')
@@ -0,0 +1,136 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.utils import sqlite
+
+# Настройки SQLite по умолчанию: журнал отката (и при нём synchronous
+# FULL) и без ожидания блокировки.
+DEFAULT_PRAGMAS = {'journal_mode': 'DELETE'}
+SCHEMA = (
+    'CREATE TABLE comment (id INTEGER PRIMARY KEY, post_id INTEGER, '
+    'text TEXT, created REAL)',
+    'CREATE INDEX comment_post_idx ON comment (post_id, created)',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает конкурентную запись в SQLite с настройками по умолчанию '
+        'и с SQLITE_PRAGMAS и повтором транзакций: коммиты в секунду и '
+        'ошибки «database is locked». Работает на временной базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument(
+            '--commits', type=int, default=200,
+            help='Транзакций на одного писателя.'
+        )
+
+    def handle(self, *args, **options):
+        profiles = (
+            ('по умолчанию', DEFAULT_PRAGMAS, False),
+            ('настроенный', settings.SQLITE_PRAGMAS, True),
+        )
+        for name, pragmas, retry in profiles:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                commits, failed, crashed, elapsed = self.run(
+                    path, pragmas, retry,
+                    options['writers'], options['commits'],
+                )
+            finished = options['writers'] - len(crashed)
+            self.stdout.write(
+                f'{name}: {commits / elapsed:.0f} коммитов/с, '
+                f'успешно {commits}, ошибок {failed}, '
+                f'потоков завершилось {finished} из {options["writers"]}, '
+                f'{elapsed:.2f} с'
+            )
+            for error in crashed:
+                self.stderr.write(f'  поток упал: {error!r}')
+
+    def run(self, path, pragmas, retry, writers, commits):
+        setup = sqlite3.connect(path, isolation_level=None)
+        sqlite.configure(setup, pragmas)
+        for statement in SCHEMA:
+            setup.execute(statement)
+        setup.close()
+
+        results, crashed = [], []
+        threads = [
+            threading.Thread(
+                target=self.writer,
+                args=(path, pragmas, retry, number, commits, results,
+                      crashed),
+            )
+            for number in range(writers)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        done = sum(results)
+        # Неудачи — всё, что не закоммичено: ошибки блокировки и
+        # транзакции упавших потоков, включая несостоявшиеся.
+        return done, writers * commits - done, crashed, elapsed
+
+    def writer(self, path, pragmas, retry, number, commits, results,
+               crashed):
+        done = 0
+        try:
+            # timeout=0 отключает встроенное ожидание модуля sqlite3:
+            # ждать ли блокировку, решает только PRAGMA busy_timeout.
+            db = sqlite3.connect(path, timeout=0, isolation_level=None,
+                                 check_same_thread=False)
+            try:
+                # Режим журнала хранится в файле и уже выставлен при
+                # создании базы; PRAGMA journal_mode берёт блокировку.
+                sqlite.configure(db, {
+                    name: value for name, value in pragmas.items()
+                    if name != 'journal_mode'
+                })
+                done = self.write(db, retry, number, commits)
+            finally:
+                db.close()
+        except Exception as error:
+            crashed.append(error)
+        finally:
+            results.append(done)
+
+    def write(self, db, retry, number, commits):
+        def transaction():
+            # Как save() в Django: отложенная транзакция, чтение, запись.
+            db.execute('BEGIN')
+            try:
+                db.execute('SELECT COUNT(*) FROM comment WHERE post_id = ?',
+                           (number,)).fetchone()
+                db.execute(
+                    'INSERT INTO comment (post_id, text, created) '
+                    'VALUES (?, ?, ?)', (number, 'Комментарий', time.time())
+                )
+                db.execute('COMMIT')
+            except sqlite3.Error:
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+                raise
+
+        done = 0
+        for _ in range(commits):
+            try:
+                if retry:
+                    sqlite.retry_on_busy(transaction)
+                else:
+                    transaction()
+                done += 1
+            except sqlite3.OperationalError as error:
+                if not sqlite.is_busy(error):
+                    raise
+        return done
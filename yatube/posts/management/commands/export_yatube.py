@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+from posts.models import Group, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоково выгружает все данные, посты группы или посты автора '
+        'в NDJSON или CSV для import_yatube.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=tuple(export.FORMATS), default='ndjson'
+        )
+        scope = parser.add_mutually_exclusive_group()
+        scope.add_argument('--group', help='Slug группы.')
+        scope.add_argument('--author', help='Имя пользователя автора.')
+        parser.add_argument(
+            '--output', help='Файл для записи, по умолчанию stdout.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=export.CHUNK_SIZE
+        )
+
+    def handle(self, *args, **options):
+        group = author = None
+        try:
+            if options['group']:
+                group = Group.objects.get(slug=options['group'])
+            if options['author']:
+                author = User.objects.get(username=options['author'])
+        except (Group.DoesNotExist, User.DoesNotExist) as error:
+            raise CommandError(error)
+        lines, _ = export.FORMATS[options['format']]
+        rows = export.records(group, author, options['chunk_size'])
+        start = time.perf_counter()
+        count = 0
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8',
+                      newline='') as target:
+                for line in lines(rows):
+                    target.write(line)
+                    count += 1
+        else:
+            for line in lines(rows):
+                self.stdout.write(line, ending='')
+                count += 1
+        self.stderr.write(
+            f'Выгружено строк: {count} '
+            f'за {time.perf_counter() - start:.1f} с'
+        )
@@ -0,0 +1,174 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+
+from posts import loadtest
+from posts.models import AuthorStats, Follow, Post
+from posts.utils.stats import LATENCY_BUCKETS
+
+User = get_user_model()
+
+POST_SAMPLE = 1000
+AUTHORS_TO_FOLLOW = 10
+
+
+def application():
+    from yatube.wsgi import application
+    return application
+
+
+def run_process(users, post_ids, host, mix, rate, duration, workers, seed):
+    """Прогон в дочернем процессе со своим пулом потоков."""
+    traffic = loadtest.Traffic(application(), users, post_ids, host, seed)
+    return loadtest.run(traffic, mix, rate, duration, workers, seed)
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон по yatube.wsgi.application внутри процесса: '
+        'открытый пуассоновский поток запросов с заданной смесью, '
+        'пропускная способность, гистограммы задержек и ошибки по времени. '
+        'Пишет в базу и MEDIA_ROOT: запускайте на копии данных.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mix', default='index=60,follow=25,comment=10,upload=5',
+            help='Веса сценариев: {}.'.format(', '.join(loadtest.SCENARIOS))
+        )
+        parser.add_argument('--rate', type=float, default=50,
+                            help='Запросов в секунду, всего.')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Длительность прогона, с.')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Потоков на процесс; 0 — без пула.')
+        parser.add_argument(
+            '--processes', type=int, default=0,
+            help='Дочерних процессов, поток запросов делится между ними.'
+        )
+        parser.add_argument('--users', type=int, default=20,
+                            help='Залогиненных виртуальных пользователей.')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Ширина окна в отчёте по времени, с.')
+        parser.add_argument('--output', help='Сохранить итоги в JSON.')
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as error:
+            raise CommandError(error)
+        post_ids = list(Post.objects.order_by('-id').values_list(
+            'id', flat=True)[:POST_SAMPLE])
+        if 'comment' in mix and not post_ids:
+            raise CommandError('Для сценария comment нужны посты.')
+        traffic = loadtest.Traffic(application(), [], post_ids,
+                                   options['host'], options['seed'])
+        try:
+            traffic.users = self.sessions(traffic, options['users'])
+        except RuntimeError as error:
+            raise CommandError(error)
+        rate, duration = options['rate'], options['duration']
+        self.stdout.write(
+            f'Прогон {duration:g} с, {rate:g} запросов/с, смесь {mix}'
+        )
+
+        processes = options['processes']
+        if processes:
+            # Соединения с базой не должны переживать fork.
+            connections.close_all()
+            context = get_context('fork')
+            with ProcessPoolExecutor(processes, mp_context=context) as pool:
+                futures = [
+                    pool.submit(run_process, traffic.users, post_ids,
+                                options['host'], mix, rate / processes,
+                                duration, options['workers'],
+                                options['seed'] + number)
+                    for number in range(processes)
+                ]
+                records = [record for future in futures
+                           for record in future.result()]
+        else:
+            records = loadtest.run(traffic, mix, rate, duration,
+                                   options['workers'], options['seed'])
+
+        summary = loadtest.summarize(records, rate, options['interval'])
+        self.report(summary)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(summary, output, ensure_ascii=False, indent=2)
+
+    def sessions(self, traffic, count):
+        """Cookie сессии и CSRF для count пользователей.
+
+        Недостающие пользователи создаются и подписываются на самых
+        активных авторов, чтобы их лента подписок не была пустой.
+        """
+        users = list(User.objects.filter(is_active=True).order_by('id')[
+            :count])
+        if len(users) < count:
+            authors = list(AuthorStats.objects.order_by(
+                '-posts_count').values_list('user_id', flat=True)[
+                :AUTHORS_TO_FOLLOW])
+            for number in range(len(users), count):
+                user, _ = User.objects.get_or_create(
+                    username=f'load_{number}')
+                # Через get_or_create, чтобы сигналы разложили ленту.
+                for author_id in authors:
+                    if author_id != user.pk:
+                        Follow.objects.get_or_create(user=user,
+                                                     author_id=author_id)
+                users.append(user)
+        cookies = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            session = {settings.SESSION_COOKIE_NAME: client.cookies[
+                settings.SESSION_COOKIE_NAME].value}
+            session[settings.CSRF_COOKIE_NAME] = traffic.csrf_cookie(session)
+            cookies.append(session)
+        return cookies
+
+    def report(self, summary):
+        self.stdout.write(
+            'Пропускная способность {throughput_rps} успешных/с при '
+            '{offered_rps:g} предложенных, ошибок {error_rate:.2%}, '
+            'прогон {elapsed_s} с'.format(**summary)
+        )
+        for name, count in summary['exceptions'].items():
+            self.stdout.write(f'Исключений {name}: {count}')
+        self.stdout.write(
+            f'{"сценарий":<10} {"запросов":>8} {"ошибок":>6} '
+            f'{"p50":>9} {"p95":>9} {"p99":>9} {"обработка":>10}'
+        )
+        for name, stats in [*summary['scenarios'].items(),
+                            ('всего', summary['total'])]:
+            self.stdout.write(
+                '{:<10} {requests:>8} {errors:>6} {p50_ms:>9.2f} '
+                '{p95_ms:>9.2f} {p99_ms:>9.2f} {service_ms:>10.2f}'.format(
+                    name, **stats)
+            )
+
+        self.stdout.write('Гистограмма задержек, мс:')
+        counts = summary['total']['histogram']
+        labels = [f'<= {bound}' for bound in LATENCY_BUCKETS] + [
+            f'> {LATENCY_BUCKETS[-1]}']
+        widest = max(counts) or 1
+        for label, count in zip(labels, counts):
+            if count:
+                bar = '#' * max(1, round(40 * count / widest))
+                self.stdout.write(f'{label:>8} {count:>7} {bar}')
+
+        self.stdout.write('По времени (окно от запланированной отправки):')
+        for window in summary['timeline']:
+            self.stdout.write(
+                '{start_s:>7.1f} с {requests:>6} запр. {errors:>4} ош. '
+                'p50 {p50_ms:>9.2f} p95 {p95_ms:>9.2f} мс'.format(**window)
+            )
@@ -0,0 +1,80 @@
+import os
+import pstats
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import profiling
+from posts.utils.stats import percentile
+
+SORT_KEYS = {'tottime': 2, 'cumtime': 3, 'ncalls': 1}
+
+
+def location(filename, line, function):
+    """Путь функции относительно проекта или site-packages."""
+    for prefix in (settings.BASE_DIR, *sorted(sys.path, key=len,
+                                              reverse=True)):
+        if prefix and filename.startswith(prefix + os.sep):
+            filename = filename[len(prefix) + 1:]
+            break
+    if filename == '~':
+        return function
+    return f'{filename}:{line}({function})'
+
+
+class Command(BaseCommand):
+    help = (
+        'Сливает профили из PROFILING_DIR по вью и печатает самые '
+        'горячие функции каждого.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.PROFILING_DIR)
+        parser.add_argument('--view', help='Только это вью, posts:index.')
+        parser.add_argument('--limit', type=int, default=15)
+        parser.add_argument('--sort', choices=SORT_KEYS, default='tottime')
+        parser.add_argument(
+            '--output', metavar='DIR',
+            help='Сохранить слитые профили: <вью>.pstats для snakeviz.'
+        )
+
+    def handle(self, *args, **options):
+        views = defaultdict(list)
+        for path in profiling.profiles(options['dir']):
+            try:
+                view, duration = profiling.parse(path)
+            except ValueError:
+                continue
+            if not options['view'] or view == options['view']:
+                views[view].append((path, duration))
+        if not views:
+            raise CommandError(f'В {options["dir"]} нет профилей.')
+        if options['output']:
+            os.makedirs(options['output'], exist_ok=True)
+
+        column = SORT_KEYS[options['sort']]
+        for view, captured in sorted(views.items()):
+            durations = [duration for _, duration in captured]
+            stats = pstats.Stats(*(path for path, _ in captured),
+                                 stream=self.stdout)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{view}: профилей {len(captured)}, p50 '
+                f'{percentile(durations, 0.5):.0f} мс, максимум '
+                f'{max(durations)} мс'
+            ))
+            self.stdout.write(
+                f'{"вызовов":>10} {"своё, мс":>10} {"всего, мс":>10}  функция'
+            )
+            rows = sorted(stats.stats.items(),
+                          key=lambda item: -item[1][column])
+            for function, (_, calls, own, total, _) in rows[
+                    :options['limit']]:
+                self.stdout.write('{:>10} {:>10.1f} {:>10.1f}  {}'.format(
+                    calls, own * 1000, total * 1000, location(*function)
+                ))
+            if options['output']:
+                stats.dump_stats(os.path.join(
+                    options['output'], view.replace(':', '.') + '.pstats'
+                ))
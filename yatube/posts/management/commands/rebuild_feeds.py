@@ -0,0 +1,42 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts import feed
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок порциями.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200)
+        parser.add_argument(
+            '--user', action='append', dest='usernames', default=[],
+            help='Пересобрать ленту только указанного пользователя.'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        else:
+            # Авторы, у которых подписчиков снова меньше лимита, после
+            # пересборки всех лент раскладываются по inbox'ам.
+            feed.reclassify()
+        user_ids = list(users.values_list('id', flat=True))
+        chunk_size = options['chunk_size']
+        start = time.perf_counter()
+        total = 0
+        for offset in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[offset:offset + chunk_size]
+            total += feed.rebuild(chunk)
+            self.stdout.write(
+                f'Пользователей: {offset + len(chunk)}/{len(user_ids)}, '
+                f'записей ленты: {total}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - start:.1f} с'
+        ))
@@ -0,0 +1,77 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from posts import counters
+from posts.models import Post
+from posts.utils import page_cache
+
+User = get_user_model()
+
+
+def in_thread(func, *args):
+    """Выполняет пересчёт в своём соединении и закрывает его."""
+    try:
+        with transaction.atomic():
+            return func(*args)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает хранимые счётчики параллельными порциями.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        start = time.perf_counter()
+        user_ids = list(
+            User.objects.order_by('id').values_list('id', flat=True)
+        )
+        bounds = Post.objects.aggregate(first=Min('id'), last=Max('id'))
+        post_ranges = []
+        if bounds['first'] is not None:
+            post_ranges = [
+                (first, first + chunk_size - 1)
+                for first in range(
+                    bounds['first'], bounds['last'] + 1, chunk_size
+                )
+            ]
+        tasks = [
+            (counters.recount_users, user_ids[offset:offset + chunk_size])
+            for offset in range(0, len(user_ids), chunk_size)
+        ] + [(counters.recount_posts, *bounds) for bounds in post_ranges]
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(lambda task: in_thread(*task), tasks))
+        else:
+            results = []
+            for func, *args in tasks:
+                with transaction.atomic():
+                    results.append(func(*args))
+        users = [user_id for ids in results[:len(tasks) - len(post_ranges)]
+                 for user_id in ids]
+        posts = [post_id for ids in results[len(tasks) - len(post_ranges):]
+                 for post_id in ids]
+        self.invalidate(users, posts, chunk_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено пользователей: {len(users)}, постов: {len(posts)} '
+            f'за {time.perf_counter() - start:.1f} с'
+        ))
+
+    def invalidate(self, user_ids, post_ids, chunk_size):
+        """Сбрасывает кеш страниц, где выводятся исправленные счётчики."""
+        for offset in range(0, len(user_ids), chunk_size):
+            for username in User.objects.filter(
+                id__in=user_ids[offset:offset + chunk_size]
+            ).values_list('username', flat=True):
+                page_cache.bump(page_cache.AUTHOR, username)
+        for post_id in post_ids:
+            page_cache.bump(page_cache.POST, post_id)
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import slow_queries
+
+SQL_WIDTH = 300
+
+
+class Command(BaseCommand):
+    help = (
+        'Сводка журнала медленных запросов (SLOW_QUERY_LOG вместе с '
+        'ротированными файлами): запросы, сгруппированные по тексту, по '
+        'убыванию суммарного времени, с вью, строками шаблонов и планом '
+        'самого медленного выполнения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=settings.SLOW_QUERY_LOG)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--view', help='Только запросы этого вью.')
+
+    def handle(self, *args, **options):
+        try:
+            records = [
+                record for record in slow_queries.read(options['file'])
+                if not options['view'] or record['view'] == options['view']
+            ]
+        except ValueError as error:
+            raise CommandError(f'Повреждённая строка журнала: {error}')
+        if not records:
+            self.stdout.write('Медленных запросов нет.')
+            return
+        groups = slow_queries.summarize(records)
+        self.stdout.write(
+            f'Записей {len(records)}, разных запросов {len(groups)}'
+        )
+        for number, group in enumerate(groups[:options['limit']], 1):
+            self.stdout.write(
+                '\n{}. всего {total_ms:.1f} мс, {count} раз, среднее '
+                '{mean_ms:.1f} мс, максимум {max_ms:.1f} мс'.format(
+                    number, **group)
+            )
+            self.stdout.write('   вью: ' + ', '.join(
+                f'{view} ({count})'
+                for view, count in group['views'].most_common(3)
+            ))
+            if group['templates']:
+                self.stdout.write('   шаблоны: ' + ', '.join(
+                    f'{place} ({count})'
+                    for place, count in group['templates'].most_common(3)
+                ))
+            sql = group['sql']
+            if len(sql) > SQL_WIDTH:
+                sql = sql[:SQL_WIDTH] + '…'
+            self.stdout.write(f'   {sql}')
+            for step in group['plan'] or ():
+                self.stdout.write(f'   > {step}')
@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в файлы реплик из DATABASE_REPLICAS '
+        'через backup API. Для локальной проверки чтения с реплик.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', action='append', dest='replicas',
+            help='Псевдоним реплики; по умолчанию все.'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Повторять синхронизацию каждые N секунд.'
+        )
+        parser.add_argument(
+            '--pages', type=int, default=1024,
+            help='Страниц за шаг копирования: между шагами база '
+                 'доступна для записи.'
+        )
+
+    def handle(self, *args, **options):
+        replicas = options['replicas'] or settings.DATABASE_REPLICAS
+        if not replicas:
+            raise CommandError(
+                'Реплики не настроены: задайте DB_REPLICAS.'
+            )
+        unknown = set(replicas) - set(settings.DATABASE_REPLICAS)
+        if unknown:
+            raise CommandError(
+                'Неизвестные реплики: {}'.format(', '.join(sorted(unknown)))
+            )
+        source = settings.DATABASES[DEFAULT_DB_ALIAS]['NAME']
+        while True:
+            for alias in replicas:
+                start = time.perf_counter()
+                copy(source, settings.DATABASES[alias]['NAME'],
+                     options['pages'])
+                self.stdout.write(
+                    f'{alias}: {(time.perf_counter() - start) * 1000:.0f} мс'
+                )
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+
+def copy(source, target, pages):
+    """Согласованный снимок source во временный файл и атомарная подмена.
+
+    Читатели реплики со старым соединением дочитывают прежний файл,
+    новые соединения открывают уже новый (см. utils.sqlite).
+    """
+    temporary = f'{target}.sync'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    primary = sqlite3.connect(source)
+    replica = sqlite3.connect(temporary)
+    try:
+        primary.backup(replica, pages=pages)
+        # Копия наследует WAL из заголовка; реплике он не нужен, а
+        # чужие -wal и -shm рядом с подменённым файлом опасны.
+        replica.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        replica.close()
+        primary.close()
+    os.replace(temporary, target)
@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+
+def init_worker():
+    django.setup()
+    connections.close_all()
+
+
+def warm_one(name):
+    try:
+        thumbnails.warm(name)
+    except Exception as error:
+        return name, str(error)
+    return name, None
+
+
+class Command(BaseCommand):
+    help = 'Создаёт миниатюры для всех картинок постов на всех ядрах.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--chunk-size', type=int, default=16)
+
+    def handle(self, *args, **options):
+        names = list(
+            Post.objects.exclude(image='').order_by('id').values_list(
+                'image', flat=True
+            )
+        )
+        connections.close_all()
+        start = time.perf_counter()
+        failed = 0
+        with ProcessPoolExecutor(
+            max_workers=options['workers'], initializer=init_worker
+        ) as pool:
+            results = pool.map(
+                warm_one, names, chunksize=options['chunk_size']
+            )
+            for done, (name, error) in enumerate(results, 1):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                if done % 100 == 0:
+                    self.report(done, len(names), start)
+        self.report(len(names), len(names), start)
+        if failed:
+            self.stderr.write(f'Ошибок: {failed}')
+
+    def report(self, done, total, start):
+        elapsed = time.perf_counter() - start
+        rate = done / elapsed if elapsed else 0
+        self.stdout.write(
+            f'Картинок: {done}/{total}, {rate:.1f} изображений/с'
+        )
@@ -0,0 +1,440 @@
+"""Метрики в формате Prometheus, общие для всех процессов сервера.
+
+Под pre-fork сервером у каждого воркера свои счётчики, поэтому каждый
+процесс пишет в собственный файл ``<pid>-<время старта>.db`` в
+``METRICS_DIR``, отображённый в память. Значение — float64 по
+постоянному смещению: запись метрики — словарь, лок процесса и 8 байт в
+mmap, без системных вызовов и без блокировок между процессами.
+``/metrics`` в любом воркере читает файлы всех процессов и складывает
+значения.
+
+Живой процесс держит flock на своём файле. Процесс, открывающий свой
+файл, переносит значения из файлов завершившихся процессов в
+``archive.db`` и удаляет их: счётчики не убывают, а число файлов не
+растёт с каждым перезапуском воркера. Перенос и чтение ``/metrics``
+разделены блокировкой ``.lock`` в каталоге.
+"""
+import fcntl
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import Http404, HttpResponse
+from sorl.thumbnail.base import ThumbnailBackend
+
+from .timing import get_many_outcome, get_outcome, list_keys
+from .utils.stats import LATENCY_BUCKETS
+
+# Файл процесса: занятая длина, затем записи «длина ключа, JSON-ключ,
+# выравнивание до 8 байт, значение».
+USED = struct.Struct('<I4x')
+LENGTH = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+INITIAL_SIZE = 64 * 1024
+SUFFIX = '.db'
+ARCHIVE = 'archive' + SUFFIX
+LOCK = '.lock'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = []
+
+
+def align(position):
+    return (position + 7) & ~7
+
+
+def entries(buffer):
+    """(ключ, значение, смещение значения) всех записей файла."""
+    used, = USED.unpack_from(buffer, 0)
+    position = USED.size
+    while position < used:
+        length, = LENGTH.unpack_from(buffer, position)
+        start = position + LENGTH.size
+        sample, labels = json.loads(bytes(buffer[start:start + length]))
+        offset = align(start + length)
+        yield ((sample, tuple(map(tuple, labels))),
+               VALUE.unpack_from(buffer, offset)[0], offset)
+        position = offset + VALUE.size
+
+
+def read(source):
+    """Значения файла метрик, открытого на чтение."""
+    if not os.fstat(source.fileno()).st_size:
+        return {}
+    with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return {key: value for key, value, _ in entries(buffer)}
+
+
+@contextmanager
+def locked(directory, operation):
+    with open(os.path.join(directory, LOCK), 'a') as lock:
+        fcntl.flock(lock, operation)
+        yield
+
+
+class File:
+    """Файл метрик, отображённый в память; уже записанные значения
+    подхватываются."""
+    def __init__(self, path):
+        self.file = open(os.open(path, os.O_RDWR | os.O_CREAT), 'r+b')
+        size = os.fstat(self.file.fileno()).st_size
+        if not size:
+            size = INITIAL_SIZE
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        if not USED.unpack_from(self.map, 0)[0]:
+            USED.pack_into(self.map, 0, USED.size)
+        self.offsets = {key: offset for key, _, offset in entries(self.map)}
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def append(self, key):
+        data = json.dumps(key, ensure_ascii=False).encode()
+        used, = USED.unpack_from(self.map, 0)
+        offset = align(used + LENGTH.size + len(data))
+        if offset + VALUE.size > len(self.map):
+            size = len(self.map)
+            while offset + VALUE.size > size:
+                size *= 2
+            self.map.close()
+            self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), size)
+        LENGTH.pack_into(self.map, used, len(data))
+        self.map[used + LENGTH.size:used + LENGTH.size + len(data)] = data
+        VALUE.pack_into(self.map, offset, 0.0)
+        # Длина меняется последней: читатель не увидит запись без значения.
+        USED.pack_into(self.map, 0, offset + VALUE.size)
+        self.offsets[key] = offset
+        return offset
+
+    def add(self, increments):
+        for key, amount in increments:
+            offset = self.offsets.get(key)
+            if offset is None:
+                offset = self.append(key)
+            value, = VALUE.unpack_from(self.map, offset)
+            VALUE.pack_into(self.map, offset, value + amount)
+
+
+def compact(directory):
+    """Переносит файлы завершившихся процессов в архив.
+
+    Вызывать под исключительной блокировкой каталога.
+    """
+    archive = None
+    for path in glob.glob(os.path.join(directory, '*' + SUFFIX)):
+        if os.path.basename(path) == ARCHIVE:
+            continue
+        try:
+            source = open(path, 'rb')
+        except FileNotFoundError:
+            continue
+        with source:
+            try:
+                fcntl.flock(source, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Процесс жив.
+                continue
+            if archive is None:
+                archive = File(os.path.join(directory, ARCHIVE))
+            archive.add(read(source).items())
+            os.remove(path)
+    if archive is not None:
+        archive.close()
+
+
+class Store:
+    """Файл метрик текущего процесса.
+
+    После fork или смены ``METRICS_DIR`` открывается файл нового
+    процесса или каталога.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = self.directory = self.name = self.file = None
+
+    def open(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        if self.pid != os.getpid():
+            # Время старта в имени: файл процесса с тем же pid, например
+            # в другом контейнере с общим каталогом, не продолжается.
+            self.name = f'{os.getpid()}-{time.time_ns()}{SUFFIX}'
+        # Под блокировкой каталога: перенос не заберёт файл между его
+        # созданием и flock.
+        with locked(directory, fcntl.LOCK_EX):
+            compact(directory)
+            if self.file is not None:
+                # Копия дескриптора в потомке после fork: flock остаётся
+                # за родителем, пока тот жив.
+                self.file.close()
+            self.file = File(os.path.join(directory, self.name))
+            fcntl.flock(self.file.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.pid, self.directory = os.getpid(), directory
+
+    def add(self, *increments):
+        """Прибавляет значения: пары (ключ, приращение)."""
+        with self.lock:
+            if (self.pid != os.getpid()
+                    or self.directory != settings.METRICS_DIR):
+                self.open(settings.METRICS_DIR)
+            self.file.add(increments)
+
+
+store = Store()
+
+
+def collect(directory):
+    """Сумма значений по файлам всех процессов и архиву."""
+    totals = defaultdict(float)
+    if not os.path.isdir(directory):
+        return totals
+    with locked(directory, fcntl.LOCK_SH):
+        for path in glob.glob(os.path.join(directory, '*' + SUFFIX)):
+            with open(path, 'rb') as source:
+                for key, value in read(source).items():
+                    totals[key] += value
+    return totals
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def format_sample(sample, labels, value):
+    if not labels:
+        return f'{sample} {format_value(value)}'
+    pairs = ','.join('{}="{}"'.format(name, text.replace(
+        '\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, text in labels)
+    return f'{sample}{{{pairs}}} {format_value(value)}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    def labels(self, values):
+        return tuple((name, str(values[name])) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}',
+                f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        store.add(((f'{self.name}_total', self.labels(labels)), amount))
+
+    def samples(self, totals):
+        sample = f'{self.name}_total'
+        return [format_sample(sample, labels, value)
+                for (name, labels), value in sorted(totals.items())
+                if name == sample]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = [float(bound) for bound in buckets]
+        self.bounds = [*map(format_value, self.buckets), '+Inf']
+
+    def observe(self, value, **labels):
+        labels = self.labels(labels)
+        bound = self.bounds[bisect_left(self.buckets, value)]
+        store.add(
+            ((f'{self.name}_bucket', labels + (('le', bound),)), 1),
+            ((f'{self.name}_sum', labels), value),
+            ((f'{self.name}_count', labels), 1),
+        )
+
+    def samples(self, totals):
+        series = defaultdict(dict)
+        for (name, labels), value in totals.items():
+            if name == f'{self.name}_bucket':
+                series[labels[:-1]][labels[-1][1]] = value
+        lines = []
+        for labels, counts in sorted(series.items()):
+            cumulative = 0
+            for bound in self.bounds:
+                cumulative += counts.get(bound, 0)
+                lines.append(format_sample(
+                    f'{self.name}_bucket', labels + (('le', bound),),
+                    cumulative
+                ))
+            for suffix in ('sum', 'count'):
+                lines.append(format_sample(
+                    f'{self.name}_{suffix}', labels,
+                    totals.get((f'{self.name}_{suffix}', labels), 0)
+                ))
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'yatube_request_duration_seconds', 'Время ответа по имени URL.',
+    [bound / 1000 for bound in LATENCY_BUCKETS], ('view',)
+)
+RESPONSES = Counter(
+    'yatube_responses', 'Ответы по имени URL и коду статуса.',
+    ('view', 'status')
+)
+DB_QUERIES = Histogram(
+    'yatube_request_db_queries', 'SQL-запросов за один запрос по имени URL.',
+    (0, 1, 2, 3, 5, 8, 13, 21, 34, 55), ('view',)
+)
+CACHE_LOOKUPS = Counter(
+    'yatube_cache_lookups', 'Чтения ключей из кеша: hit или miss.',
+    ('result',)
+)
+THUMBNAIL_DURATION = Histogram(
+    'yatube_thumbnail_generation_seconds',
+    'Время создания одной миниатюры sorl-thumbnail.',
+    (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+UPLOAD_SIZE = Histogram(
+    'yatube_upload_bytes',
+    'Размер картинок постов: received — загруженный файл, stored — '
+    'после перекодирования.',
+    [kib * 1024 for kib in (16, 64, 256, 512, 1024, 2048, 5120, 10240,
+                            20480)],
+    ('stage',)
+)
+
+state = threading.local()
+# Уже обёрнутые классы: бэкенд кеша может смениться вместе с CACHES.
+_instrumented = set()
+
+
+def count_cache(owner, name, outcome, prepare=None):
+    """Считает попадания и промахи самого внешнего чтения из кеша."""
+    original = getattr(owner, name)
+
+    @wraps(original)
+    def wrapper(*args, **kwargs):
+        if prepare:
+            args, kwargs = prepare(args, kwargs)
+        if getattr(state, 'in_cache', False):
+            return original(*args, **kwargs)
+        state.in_cache = True
+        try:
+            result = original(*args, **kwargs)
+        finally:
+            state.in_cache = False
+        hits, misses = outcome(args, kwargs, result)
+        if hits:
+            CACHE_LOOKUPS.inc(hits, result='hit')
+        if misses:
+            CACHE_LOOKUPS.inc(misses, result='miss')
+        return result
+
+    setattr(owner, name, wrapper)
+
+
+def time_thumbnails():
+    original = ThumbnailBackend._create_thumbnail
+
+    @wraps(original)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            THUMBNAIL_DURATION.observe(time.perf_counter() - start)
+
+    ThumbnailBackend._create_thumbnail = wrapper
+
+
+def instrument():
+    if ThumbnailBackend not in _instrumented:
+        _instrumented.add(ThumbnailBackend)
+        time_thumbnails()
+    for backend in {type(caches[alias]) for alias in settings.CACHES}:
+        if backend not in _instrumented:
+            _instrumented.add(backend)
+            count_cache(backend, 'get', get_outcome)
+            count_cache(backend, 'get_many', get_many_outcome, list_keys)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument()
+
+    def __call__(self, request):
+        queries = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        REQUEST_DURATION.observe(duration, view=view)
+        RESPONSES.inc(view=view, status=response.status_code)
+        DB_QUERIES.observe(queries.count, view=view)
+        return response
+
+
+def hit_ratio(totals):
+    lookups = {labels[0][1]: value for (name, labels), value
+               in totals.items() if name == f'{CACHE_LOOKUPS.name}_total'}
+    total = lookups.get('hit', 0) + lookups.get('miss', 0)
+    return [
+        '# HELP yatube_cache_hit_ratio Доля попаданий среди чтений кеша.',
+        '# TYPE yatube_cache_hit_ratio gauge',
+        format_sample('yatube_cache_hit_ratio', (),
+                      lookups.get('hit', 0) / total if total else 0),
+    ]
+
+
+def render(totals):
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.header() + metric.samples(totals)
+    lines += hit_ratio(totals)
+    return '\n'.join(lines) + '\n'
+
+
+def exposition(request):
+    """Страница для Prometheus; доступна только с METRICS_ALLOWED_IPS.
+
+    Адрес берётся из REMOTE_ADDR: за прокси на том же хосте там всегда
+    127.0.0.1, поэтому по умолчанию список пуст и страница закрыта.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(render(collect(settings.METRICS_DIR)),
+                        content_type=CONTENT_TYPE)
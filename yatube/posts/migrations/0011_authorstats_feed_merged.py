@@ -0,0 +1,31 @@
+# Generated by Django 2.2.16 on 2026-10-18 06:27
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def mark_merged(apps, schema_editor):
+    """Авторы, чьи посты уже подмешивались по живому числу подписчиков."""
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    Follow = apps.get_model('posts', 'Follow')
+    authors = Follow.objects.values('author').annotate(
+        followers=Count('id')
+    ).filter(followers__gt=settings.FEED_FANOUT_LIMIT).values('author')
+    AuthorStats.objects.filter(user_id__in=authors).update(feed_merged=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorstats',
+            name='feed_merged',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='Подмешивается в ленты'),
+        ),
+        migrations.RunPython(mark_merged, migrations.RunPython.noop),
+    ]
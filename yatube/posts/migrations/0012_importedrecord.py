@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-18 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_authorstats_feed_merged'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run', models.CharField(max_length=32, verbose_name='Импорт')),
+                ('kind', models.CharField(max_length=10, verbose_name='Тип записи')),
+                ('key', models.CharField(max_length=255, verbose_name='Ключ в выгрузке')),
+                ('object_id', models.PositiveIntegerField(null=True, verbose_name='Новый id')),
+            ],
+            options={
+                'verbose_name': 'Импортированная запись',
+                'verbose_name_plural': 'Импортированные записи',
+                'unique_together': {('run', 'kind', 'key')},
+            },
+        ),
+    ]
@@ -55,11 +55,26 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
+    comment_count = models.PositiveIntegerField(
+        verbose_name='Количество комментариев',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = "Пост"
         verbose_name_plural = ("Посты")
         ordering = ['-pub_date']
+        # Ленты сортируются по (pub_date, id): индексы отдают строки
+        # сразу в нужном порядке, без сортировки после выборки.
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -91,6 +106,10 @@ class Comment(models.Model):
         verbose_name = "Комментария"
         verbose_name_plural = ("Комментарии")
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['post', '-created', '-id'],
+                         name='comment_post_created_idx'),
+        ]
 
     def __str__(self):
         return self.text[:10]
@@ -114,6 +133,98 @@ class Follow(models.Model):
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
         unique_together = ['user', 'author']
+        # unique_together даёт индекс (user, author), этот — для выборок
+        # подписчиков автора.
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user} подписался(лась) на {self.author}'
+
+
+class AuthorStats(models.Model):
+    """Хранимые счётчики пользователя, чтобы не считать COUNT(*)."""
+    user = models.OneToOneField(
+        User,
+        verbose_name='Пользователь',
+        related_name='stats',
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    posts_count = models.PositiveIntegerField(
+        verbose_name='Постов', default=0
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков', default=0
+    )
+    following_count = models.PositiveIntegerField(
+        verbose_name='Подписок', default=0
+    )
+    # Посты автора подмешиваются в ленты при чтении: см. posts.feed.
+    feed_merged = models.BooleanField(
+        verbose_name='Подмешивается в ленты', default=False, db_index=True
+    )
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+    def __str__(self):
+        return f'Счётчики {self.user_id}'
+
+
+class ImportedRecord(models.Model):
+    """Запись выгрузки, уже обработанная командой import_yatube.
+
+    Соответствие ключа записи (username, slug или id поста в выгрузке)
+    новому id хранится в базе, а не в памяти команды: память импорта не
+    зависит от размера файла.
+    """
+    run = models.CharField(verbose_name='Импорт', max_length=32)
+    kind = models.CharField(verbose_name='Тип записи', max_length=10)
+    key = models.CharField(verbose_name='Ключ в выгрузке', max_length=255)
+    # None — запись пропущена из-за конфликта с данными базы.
+    object_id = models.PositiveIntegerField(
+        verbose_name='Новый id', null=True
+    )
+
+    class Meta:
+        verbose_name = 'Импортированная запись'
+        verbose_name_plural = 'Импортированные записи'
+        unique_together = ['run', 'kind', 'key']
+
+    def __str__(self):
+        return f'{self.kind} {self.key} -> {self.object_id}'
+
+
+class FeedEntry(models.Model):
+    """Запись в ленте подписок пользователя (материализованный inbox)."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Читатель',
+        related_name='feed_entries',
+        on_delete=models.CASCADE
+    )
+    post = models.ForeignKey(
+        Post,
+        verbose_name='Пост',
+        related_name='feed_entries',
+        on_delete=models.CASCADE
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        unique_together = ['user', 'post']
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='feed_user_pub_date_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.post_id} в ленте {self.user_id}'
@@ -0,0 +1,95 @@
+"""Профилирование живых запросов через cProfile.
+
+Профилируется запрос с заголовком ``X-Profile: 1`` или параметром
+``?_profile=1`` (подходит и ``true``) от пользователя со статусом
+staff, а также случайная доля ``PROFILING_SAMPLE_RATE`` всех запросов.
+Под профилировщиком выполняется всё, что ниже middleware: вью, запросы
+к базе и рендеринг шаблонов. Тело потоковых ответов генерируется позже
+и в профиль не попадает.
+
+Каждый профиль — файл ``.pstats`` в ``PROFILING_DIR``, в имени время,
+pid, имя URL и длительность. Хранятся ``PROFILING_MAX_FILES`` самых
+новых. Сводка по вью — команда ``profile_report``.
+"""
+import cProfile
+import glob
+import os
+import random
+import time
+
+from django.conf import settings
+
+HEADER = 'HTTP_X_PROFILE'
+QUERY_FLAG = '_profile'
+ENABLED = ('1', 'true')
+SUFFIX = '.pstats'
+
+
+def filename(view, duration):
+    """``<ns>-<pid>-<view>-<ms>ms.pstats``: по имени сортируется по времени."""
+    view = (view or 'unresolved').replace(':', '.')
+    return '{}-{}-{}-{}ms{}'.format(time.time_ns(), os.getpid(), view,
+                                    round(duration), SUFFIX)
+
+
+def parse(name):
+    """Имя URL и длительность в мс из имени файла профиля."""
+    _, _, rest = os.path.basename(name)[:-len(SUFFIX)].split('-', 2)
+    view, duration = rest.rsplit('-', 1)
+    return view.replace('.', ':'), int(duration[:-2])
+
+
+def profiles(directory):
+    return sorted(glob.glob(os.path.join(directory, '*' + SUFFIX)))
+
+
+def save(profiler, view, duration):
+    directory = settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, filename(view, duration))
+    # Через временный файл: команда не прочитает профиль недописанным.
+    profiler.dump_stats(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    for old in profiles(directory)[:-settings.PROFILING_MAX_FILES]:
+        try:
+            os.remove(old)
+        except FileNotFoundError:
+            # Его уже удалил соседний процесс.
+            pass
+    return path
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def requested(self, request):
+        values = (request.META.get(HEADER, ''),
+                  request.GET.get(QUERY_FLAG, ''))
+        if not any(value.lower() in ENABLED for value in values):
+            return False
+        return request.user.is_staff
+
+    def __call__(self, request):
+        requested = self.requested(request)
+        if not requested and (
+            random.random() >= settings.PROFILING_SAMPLE_RATE
+        ):
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # В потоке уже работает другой профилировщик.
+            return self.get_response(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = (time.perf_counter() - start) * 1000
+        match = request.resolver_match
+        path = save(profiler, match.view_name if match else None, duration)
+        if requested:
+            response['X-Profile'] = os.path.basename(path)
+        return response
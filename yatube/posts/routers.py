@@ -0,0 +1,98 @@
+"""Чтение с реплик, запись в основную базу.
+
+Реплики перечислены в ``settings.DATABASE_REPLICAS``; без них всё идёт
+в ``default``. Чтения отправляются на основную базу, когда реплика
+может отдать устаревшие данные:
+
+* внутри транзакции на основной базе;
+* в запросе, который уже что-то записал, и ещё
+  ``REPLICA_STICKY_SECONDS`` после любого запроса с записью, включая
+  GET вроде подписки (read-your-writes, метка хранится в cookie);
+* внутри ``primary()``.
+
+Кеш страниц (posts.utils.page_cache) читает с реплик и сам учитывает
+их отставание.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+STICKY_COOKIE = 'primary_until'
+# Сессии читаются на каждом запросе и должны видеть вход и выход сразу.
+PRIMARY_ONLY_APPS = ('sessions',)
+
+state = threading.local()
+
+
+def is_pinned():
+    return getattr(state, 'pinned', 0) > 0 or getattr(state, 'wrote', False)
+
+
+@contextmanager
+def primary():
+    """Все чтения внутри блока идут в основную базу."""
+    state.pinned = getattr(state, 'pinned', 0) + 1
+    try:
+        yield
+    finally:
+        state.pinned -= 1
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (not replicas or is_pinned()
+                or model._meta.app_label in PRIMARY_ONLY_APPS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # Сессии и так читаются из основной базы, их сохранение на
+        # каждом запросе не закрепляет пользователя за ней.
+        if model._meta.app_label not in PRIMARY_ONLY_APPS:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии основной базы, объекты из них связываются.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class StickyPrimaryMiddleware:
+    """Read-your-writes: после записи пользователь читает из основной базы.
+
+    Метка в cookie не подписана: подделав её, можно лишь читать из
+    основной базы дольше.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            until = float(request.COOKIES.get(STICKY_COOKIE, 0))
+        except ValueError:
+            until = 0
+        state.wrote = False
+        state.pinned = 1 if until > time.time() else 0
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote, state.wrote, state.pinned = state.wrote, False, 0
+        # Метод не важен: подписка и отписка пишут по GET.
+        if wrote:
+            response.set_cookie(
+                STICKY_COOKIE,
+                str(time.time() + settings.REPLICA_STICKY_SECONDS),
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -0,0 +1,69 @@
+"""Полнотекстовый поиск по постам на FTS5.
+
+Индекс ``posts_post_fts`` — внешнее содержимое для ``posts_post``:
+сам текст хранится только в таблице постов, а триггеры из миграции
+0009 обновляют индекс при любой записи, включая ``bulk_create`` и
+``update()``. SQLite удаляет триггеры вместе с таблицей, поэтому после
+миграций, которые пересоздают ``posts_post``, нужно выполнить
+``manage.py reindex_posts``: он восстанавливает триггеры и индекс.
+"""
+import re
+
+from django.db import connection
+
+FTS_TABLE = 'posts_post_fts'
+MAX_TERMS = 10
+
+TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS posts_post_fts_insert
+    AFTER INSERT ON posts_post BEGIN
+        INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_post_fts_delete
+    AFTER DELETE ON posts_post BEGIN
+        INSERT INTO posts_post_fts(posts_post_fts, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_post_fts_update
+    AFTER UPDATE OF text ON posts_post BEGIN
+        INSERT INTO posts_post_fts(posts_post_fts, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+)
+
+
+def fts_query(text):
+    """Запрос FTS5 из пользовательского ввода: все слова, по префиксу.
+
+    Каждое слово берётся в кавычки, поэтому операторы FTS5 и спецсимволы
+    из ввода не интерпретируются.
+    """
+    terms = re.findall(r'\w+', text.lower())[:MAX_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search(queryset, text):
+    """Посты из ``queryset``, подходящие под запрос, от лучших к худшим."""
+    match = fts_query(text)
+    if not match:
+        return queryset.none()
+    return queryset.extra(
+        select={'rank': f'bm25({FTS_TABLE})'},
+        tables=[FTS_TABLE],
+        where=[
+            f'{FTS_TABLE}.rowid = posts_post.id',
+            f'{FTS_TABLE} MATCH %s',
+        ],
+        params=[match],
+    ).order_by('rank', '-pub_date')
+
+
+def reindex():
+    """Восстанавливает триггеры и перестраивает индекс по таблице постов."""
+    with connection.cursor() as cursor:
+        for statement in TRIGGERS:
+            cursor.execute(statement)
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+        )
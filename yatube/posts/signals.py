@@ -0,0 +1,134 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counters, feed
+from .models import AuthorStats, Comment, Follow, Group, Post
+from .utils import page_cache
+
+User = get_user_model()
+
+
+def username(user_id):
+    """Имя автора без обращения к связанному объекту при каскаде."""
+    return User.objects.filter(pk=user_id).values_list(
+        'username', flat=True
+    ).first()
+
+
+def invalidate_post_pages(post, *group_slugs):
+    page_cache.bump(page_cache.GLOBAL)
+    page_cache.bump(page_cache.AUTHOR, username(post.author_id))
+    page_cache.bump(page_cache.POST, post.pk)
+    for slug in set(group_slugs):
+        if slug:
+            page_cache.bump(page_cache.GROUP, slug)
+
+
+def group_slug(group_id):
+    if group_id is None:
+        return None
+    return Group.objects.filter(pk=group_id).values_list(
+        'slug', flat=True
+    ).first()
+
+
+@receiver(pre_save, sender=Post)
+def remember_group(sender, instance, raw=False, **kwargs):
+    instance.previous_group_slug = None
+    if instance.pk and not raw:
+        instance.previous_group_slug = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group__slug', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.bump_user(instance.author_id, posts_count=1)
+        feed.fan_out(instance)
+    invalidate_post_pages(
+        instance,
+        group_slug(instance.group_id),
+        getattr(instance, 'previous_group_slug', None),
+    )
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, posts_count=-1)
+    invalidate_post_pages(instance, group_slug(instance.group_id))
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_post(instance.post_id, 1)
+    page_cache.bump(page_cache.POST, instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.bump_post(instance.post_id, -1)
+    page_cache.bump(page_cache.POST, instance.post_id)
+
+
+@receiver(pre_save, sender=Group)
+def remember_slug(sender, instance, raw=False, **kwargs):
+    instance.previous_slug = None
+    if instance.pk and not raw:
+        instance.previous_slug = Group.objects.filter(
+            pk=instance.pk
+        ).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    page_cache.bump(page_cache.GLOBAL)
+    page_cache.bump(page_cache.GROUP, instance.slug)
+    if getattr(instance, 'previous_slug', None):
+        page_cache.bump(page_cache.GROUP, instance.previous_slug)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.bump_user(instance.author_id, followers_count=1)
+        counters.bump_user(instance.user_id, following_count=1)
+        feed.promote(instance.author_id)
+        feed.backfill(instance.user_id, instance.author_id)
+        # Профиль подписчика тоже меняется: в нём число подписок.
+        page_cache.bump(page_cache.AUTHOR, instance.author.username)
+        page_cache.bump(page_cache.AUTHOR, instance.user.username)
+        page_cache.bump(page_cache.FOLLOWER, instance.user_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.bump_user(instance.author_id, followers_count=-1)
+    counters.bump_user(instance.user_id, following_count=-1)
+    feed.prune(instance.user_id, instance.author_id)
+    page_cache.bump(page_cache.AUTHOR, username(instance.author_id))
+    page_cache.bump(page_cache.AUTHOR, username(instance.user_id))
+    page_cache.bump(page_cache.FOLLOWER, instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def author_renamed(sender, instance, created, raw=False, update_fields=None,
+                   **kwargs):
+    """Имя автора выводится в карточках всех лент, где есть его посты."""
+    if raw or update_fields == frozenset(['last_login']):
+        return
+    if created:
+        AuthorStats.objects.get_or_create(user=instance)
+        return
+    page_cache.bump(page_cache.GLOBAL)
+    page_cache.bump(page_cache.AUTHOR, instance.username)
+    slugs = Post.objects.filter(
+        author=instance, group__isnull=False
+    ).order_by().values_list('group__slug', flat=True).distinct()
+    for slug in slugs:
+        page_cache.bump(page_cache.GROUP, slug)
@@ -0,0 +1,194 @@
+"""Журнал медленных SQL-запросов, безопасный для продакшена.
+
+Middleware ставит обёртку ``execute_wrapper`` на все соединения на
+время запроса. Для быстрых запросов она только засекает время. Запрос
+дольше ``SLOW_QUERY_MS`` пишется одной JSON-строкой в лог
+``posts.slow_queries`` (в настройках — ротируемый NDJSON-файл
+``SLOW_QUERY_LOG``). В записи есть имя вью, строка шаблона, где
+ленивый QuerySet выполнился при рендеринге, место в коде проекта,
+параметры без строковых значений и план ``EXPLAIN QUERY PLAN``.
+
+План строится на курсоре без обёрток: он не попадает ни в журнал, ни в
+бюджеты запросов вью. Сводка по журналу — команда ``slow_queries``.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.template.base import Node
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+RENDER_CODE = Node.render_annotated.__code__
+NUMBERS = (bool, int, float, type(None))
+SCALARS = (Decimal, date, datetime, timedelta, uuid.UUID)
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def redact(value):
+    """Числа и даты остаются, строки и байты заменяются их длиной."""
+    if isinstance(value, NUMBERS):
+        return value
+    if isinstance(value, SCALARS):
+        return str(value)
+    if isinstance(value, str):
+        return f'<str:{len(value)}>'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'<bytes:{len(value)}>'
+    return f'<{type(value).__name__}>'
+
+
+def redact_params(params, many):
+    if many:
+        # Генератор строк executemany уже израсходован — только размер.
+        if isinstance(params, (list, tuple)):
+            return {'rows': len(params)}
+        return None
+    if isinstance(params, dict):
+        return {key: redact(value) for key, value in params.items()}
+    return [redact(value) for value in params or ()]
+
+
+def origin(frame):
+    """Строка шаблона и место в коде проекта, откуда пришёл запрос.
+
+    Шаблон — самый внутренний ``Node.render_annotated`` на стеке: у
+    каждого узла парсер запоминает ``origin`` и ``token.lineno``.
+    """
+    template = line = code = None
+    while frame is not None and (template is None or code is None):
+        filename = frame.f_code.co_filename
+        if template is None and frame.f_code is RENDER_CODE:
+            node = frame.f_locals.get('self')
+            source = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if source is not None:
+                template = source.template_name or source.name
+                line = getattr(token, 'lineno', None)
+        elif (code is None and filename.startswith(settings.BASE_DIR)
+              and filename != __file__):
+            code = '{}:{}'.format(
+                os.path.relpath(filename, settings.BASE_DIR),
+                frame.f_lineno,
+            )
+        frame = frame.f_back
+    return template, line, code
+
+
+def explain(connection, sql, params):
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute(
+            f'{connection.ops.explain_query_prefix()} {sql}', params
+        )
+        return [str(row[-1]) for row in cursor.fetchall()]
+    except DatabaseError as error:
+        return [f'ошибка EXPLAIN: {error}']
+    finally:
+        cursor.close()
+
+
+class SlowQueryRecorder:
+    def __init__(self, request, threshold):
+        self.request = request
+        self.threshold = threshold
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = (time.perf_counter() - start) * 1000
+        if duration >= self.threshold:
+            self.record(sql, params, many, context['connection'], duration)
+        return result
+
+    def record(self, sql, params, many, connection, duration):
+        template, line, code = origin(sys._getframe(2))
+        match = getattr(self.request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'time': timezone.now().isoformat(),
+            'duration_ms': round(duration, 3),
+            'database': connection.alias,
+            'method': self.request.method,
+            'path': self.request.path,
+            'view': match.view_name if match else None,
+            'template': template,
+            'template_line': line,
+            'code': code,
+            'sql': sql,
+            'params': redact_params(params, many),
+            'plan': None if many else explain(connection, sql, params),
+        }, ensure_ascii=False))
+
+
+class SlowQueryMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not logger.isEnabledFor(logging.INFO):
+            return self.get_response(request)
+        recorder = SlowQueryRecorder(request, settings.SLOW_QUERY_MS)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            return self.get_response(request)
+
+
+def fingerprint(sql):
+    """SQL без различий в пробелах и длине списков IN (...)."""
+    return IN_LIST.sub('IN (...)', ' '.join(sql.split()))
+
+
+def read(path):
+    """Записи журнала вместе с ротированными файлами, от старых к новым."""
+    paths = [path]
+    number = 1
+    while os.path.exists(f'{path}.{number}'):
+        paths.insert(0, f'{path}.{number}')
+        number += 1
+    for name in filter(os.path.exists, paths):
+        with open(name, encoding='utf-8') as log:
+            for line in log:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def summarize(records):
+    """Запросы, сгруппированные по тексту, по убыванию суммарного времени."""
+    groups = {}
+    for record in records:
+        group = groups.setdefault(fingerprint(record['sql']), {
+            'sql': fingerprint(record['sql']),
+            'count': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'views': Counter(),
+            'templates': Counter(),
+            'plan': None,
+        })
+        group['count'] += 1
+        group['total_ms'] += record['duration_ms']
+        if record['duration_ms'] >= group['max_ms']:
+            group['max_ms'] = record['duration_ms']
+            group['plan'] = record.get('plan')
+        group['views'][record.get('view')] += 1
+        if record.get('template'):
+            group['templates'][
+                f'{record["template"]}:{record["template_line"]}'] += 1
+    for group in groups.values():
+        group['total_ms'] = round(group['total_ms'], 3)
+        group['mean_ms'] = round(group['total_ms'] / group['count'], 3)
+    return sorted(groups.values(), key=lambda group: -group['total_ms'])
@@ -0,0 +1,94 @@
+"""RSS- и Atom-ленты записей: вся лента, группа и автор.
+
+Тело ленты кешируется до смены поколения области (см. page_cache),
+а ETag и Last-Modified вычисляются один раз на поколение (см.
+conditional), поэтому повторный опрос без изменений отвечает
+304 без обращения к базе. Ленты не зависят от пользователя.
+"""
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+
+from .models import Group, Post, User
+from .utils.conditional import newest, tag
+
+FEED_TYPES = {'rss': Rss201rev2Feed, 'atom': Atom1Feed}
+
+
+class LatestPostsFeed(Feed):
+    title = 'Yatube: последние записи'
+    description = 'Последние обновления на сайте'
+
+    def __init__(self, kind='rss'):
+        self.feed_type = FEED_TYPES[kind]
+
+    def link(self):
+        return reverse('posts:index')
+
+    def items(self):
+        return Post.objects.select_related('author')[:settings.FEED_SIZE]
+
+    def item_title(self, item):
+        return str(item)
+
+    def item_description(self, item):
+        return item.text
+
+    def item_link(self, item):
+        return reverse('posts:post_detail', kwargs={'post_id': item.pk})
+
+    def item_pubdate(self, item):
+        return item.pub_date
+
+    def item_author_name(self, item):
+        return item.author.get_full_name() or item.author.username
+
+
+class GroupPostsFeed(LatestPostsFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Group, slug=slug)
+
+    def title(self, group):
+        return f'Yatube: {group.title}'
+
+    def description(self, group):
+        return group.description
+
+    def link(self, group):
+        return reverse('posts:group_list', kwargs={'slug': group.slug})
+
+    def items(self, group):
+        return group.posts.select_related('author')[:settings.FEED_SIZE]
+
+
+class AuthorPostsFeed(LatestPostsFeed):
+    def get_object(self, request, username):
+        return get_object_or_404(User, username=username)
+
+    def title(self, author):
+        return f'Yatube: записи {author.get_full_name() or author.username}'
+
+    def description(self, author):
+        return self.title(author)
+
+    def link(self, author):
+        return reverse('posts:profile', kwargs={'username': author.username})
+
+    def items(self, author):
+        return author.posts.select_related('author')[:settings.FEED_SIZE]
+
+
+def etag(scope, kwarg=None):
+    """Функция ETag для декоратора condition(); учитывает формат ленты."""
+    def func(request, kind, **kwargs):
+        ident = kwargs.get(kwarg, '') if kwarg else ''
+        return f'{tag(scope, ident)}-{kind}'
+    return func
+
+
+def last_modified(scope, kwarg=None):
+    def func(request, kind, **kwargs):
+        return newest(scope, kwargs.get(kwarg, '') if kwarg else '')
+    return func
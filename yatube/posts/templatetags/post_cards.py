@@ -0,0 +1,63 @@
+"""Карточки постов для лент с кешированием готового HTML.
+
+Ключ карточки строится из данных, которые в ней выводятся (текст,
+картинка, группа, имя автора), поэтому при их изменении карточка
+перерисовывается без отдельной инвалидации, а вся страница получает
+кеш за один ``cache.get_many``.
+"""
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils import translation
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+CARD_TEMPLATE = 'posts/includes/post_card.html'
+VARIANTS = {
+    'index': {'show_author': True, 'show_group': True},
+    'group': {'show_author': True, 'show_group': False},
+    'profile': {'show_author': False, 'show_group': False},
+}
+
+
+def card_version(post):
+    author, group = post.author, post.group
+    parts = [
+        post.text, post.image.name, post.pub_date.isoformat(),
+        author.username, author.get_full_name(),
+        group.slug if group else '', group.title if group else '',
+    ]
+    return hashlib.md5('\x00'.join(parts).encode()).hexdigest()
+
+
+def card_key(post, variant):
+    return 'post_card:{}:{}:{}:{}'.format(
+        post.id, card_version(post), variant, translation.get_language()
+    )
+
+
+@register.inclusion_tag(CARD_TEMPLATE)
+def post_card(post, variant='index'):
+    return {'post': post, **VARIANTS[variant]}
+
+
+@register.simple_tag
+def post_cards(posts, variant='index'):
+    """HTML карточек страницы: из кеша, недостающие рендерятся."""
+    posts = list(posts)
+    keys = [card_key(post, variant) for post in posts]
+    cached = cache.get_many(keys)
+    missing = {}
+    for post, key in zip(posts, keys):
+        if key not in cached:
+            missing[key] = render_to_string(
+                CARD_TEMPLATE, post_card(post, variant)
+            )
+    if missing:
+        cache.set_many(missing, settings.POST_CARD_CACHE_TIMEOUT)
+        cached.update(missing)
+    return [mark_safe(cached[key]) for key in keys]
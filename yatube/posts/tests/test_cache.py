@@ -0,0 +1,129 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from multiprocessing import get_context
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from posts.cache import TwoTierCache
+from posts.models import Post
+
+User = get_user_model()
+
+
+def write_in_child(key, value):
+    caches['default'].set(key, value)
+
+
+class TwoTierCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='author')
+        Post.objects.create(text='Пост', author=author)
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.location = os.path.join(directory, 'cache.sqlite3')
+        settings_override = override_settings(CACHES={'default': {
+            'BACKEND': 'posts.cache.TwoTierCache',
+            'LOCATION': self.location,
+            'OPTIONS': {'L1_MAX_ENTRIES': 3, 'STAMP_SLOTS': 1024},
+        }})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.cache = caches['default']
+        self.addCleanup(self.cache.stamps.map.close)
+
+    def sqlite(self):
+        connection = sqlite3.connect(self.location, isolation_level=None)
+        self.addCleanup(connection.close)
+        return connection
+
+    def test_cache_api(self):
+        self.cache.set('key', {'value': 1})
+        self.assertEqual(self.cache.get('key'), {'value': 1})
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertTrue(self.cache.add('other', 2))
+        self.assertEqual(self.cache.incr('other', 3), 5)
+        self.assertEqual(self.cache.decr('other'), 4)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+        self.cache.set_many({'a': 1, 'b': None})
+        self.assertEqual(self.cache.get_many(['a', 'b', 'missing']),
+                         {'a': 1, 'b': None})
+        self.cache.delete_many(['a', 'b'])
+        self.assertEqual(self.cache.get('a', 'default'), 'default')
+        self.assertTrue(self.cache.touch('key', 60))
+        self.cache.set('gone', 1, 0)
+        self.assertIsNone(self.cache.get('gone'))
+        self.assertTrue(self.cache.add('gone', 2))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_l1_serves_until_stamp_changes(self):
+        self.cache.set('key', 'cached')
+        self.assertEqual(self.cache.get('key'), 'cached')
+        # Строку удалили в обход бэкенда: штамп цел, отвечает L1.
+        self.sqlite().execute('DELETE FROM cache')
+        self.assertEqual(self.cache.get('key'), 'cached')
+        self.cache.stamps.renew([self.cache.make_key('key')])
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_write_in_other_process_is_seen(self):
+        self.cache.set('generation', 1)
+        self.assertEqual(self.cache.get('generation'), 1)
+        child = get_context('fork').Process(target=write_in_child,
+                                            args=('generation', 2))
+        child.start()
+        child.join()
+        self.assertEqual(child.exitcode, 0)
+        self.assertEqual(self.cache.get('generation'), 2)
+
+    def test_get_many_is_one_query(self):
+        self.cache.set_many({f'key{number}': number for number in range(5)})
+        self.cache.l1.clear()
+        statements = []
+        self.cache.connection().set_trace_callback(statements.append)
+        self.addCleanup(self.cache.connection().set_trace_callback, None)
+        values = self.cache.get_many([f'key{number}' for number in range(5)])
+        self.assertEqual(len(values), 5)
+        self.assertEqual(len(statements), 1)
+
+    def test_l1_is_bounded(self):
+        self.cache.set_many({f'key{number}': number for number in range(5)})
+        self.cache.get_many([f'key{number}' for number in range(5)])
+        self.assertEqual(len(self.cache.l1.entries), 3)
+
+    def test_cull(self):
+        self.cache._max_entries, self.cache._cull_frequency = 4, 2
+        self.cache.set_many({f'key{number}': number for number in range(6)})
+        self.cache.cull()
+        count, = self.sqlite().execute(
+            'SELECT COUNT(*) FROM cache').fetchone()
+        self.assertEqual(count, 3)
+
+    def test_private_directory(self):
+        location = os.path.join(os.path.dirname(self.location), 'private',
+                                'cache.sqlite3')
+        stamps = TwoTierCache(location, {}).stamps
+        self.addCleanup(stamps.map.close)
+        self.assertEqual(
+            os.stat(os.path.dirname(location)).st_mode & 0o777, 0o700)
+        with mock.patch('posts.cache.os.getuid',
+                        return_value=os.getuid() + 1):
+            with self.assertRaises(ImproperlyConfigured):
+                TwoTierCache(location, {})
+
+    def test_views_use_backend(self):
+        self.client.get(reverse('posts:index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Пост')
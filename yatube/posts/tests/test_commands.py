@@ -0,0 +1,377 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import export, loadtest
+from posts.models import (Comment, FeedEntry, Follow, Group, ImportedRecord,
+                          Post)
+from posts.utils import page_cache
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+name_users = ['TestUser1', 'TestUser2']
+name_slugs = ['test_group', 'bag_slug']
+
+
+class ImportTest(TestCase):
+    RECORDS = [
+        {'model': 'user', 'username': 'alice'},
+        {'model': 'user', 'username': 'bob'},
+        {'model': 'group', 'slug': 'imported', 'title': 'Импорт'},
+        {'model': 'post', 'id': 500, 'author': 'alice', 'group': 'imported',
+         'text': 'Первый', 'pub_date': '2020-01-01T10:00:00'},
+        {'model': 'post', 'id': 501, 'author': 'alice', 'text': 'Второй',
+         'pub_date': '2020-01-02T10:00:00'},
+        {'model': 'post', 'author': 'nobody', 'text': 'Без автора'},
+        {'model': 'comment', 'post': 500, 'author': 'bob', 'text': 'Ок'},
+        {'model': 'follow', 'user': 'bob', 'author': 'alice'},
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as target:
+            target.write(''.join(lines))
+        return path
+
+    def run_import(self, path, *args):
+        call_command('import_yatube', path, *args, stdout=StringIO())
+
+    def test_import_ndjson(self):
+        path = self.write('dump.ndjson', (
+            json.dumps(record, ensure_ascii=False) + '\n'
+            for record in self.RECORDS
+        ))
+        self.run_import(path, '--batch-size', '3')
+        alice = User.objects.get(username='alice')
+        post = Post.objects.get(text='Первый')
+        self.assertEqual(post.author, alice)
+        self.assertEqual(post.group.slug, 'imported')
+        self.assertEqual(post.pub_date.year, 2020)
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(alice.stats.posts_count, 2)
+        self.assertEqual(alice.stats.followers_count, 1)
+        self.assertEqual(
+            FeedEntry.objects.filter(user__username='bob').count(), 2)
+        self.assertFalse(alice.has_usable_password())
+
+    def test_resume_from_checkpoint(self):
+        lines = [json.dumps(record) + '\n' for record in self.RECORDS]
+        path = self.write('dump.ndjson', lines[:4] + ['{broken\n'])
+        with self.assertRaises(CommandError):
+            self.run_import(path, '--batch-size', '2')
+        self.assertEqual(Post.objects.count(), 1)
+        self.write('dump.ndjson', lines)
+        self.run_import(path, '--batch-size', '2')
+        self.assertEqual(Post.objects.count(), 2)
+        # Комментарий из второго запуска нашёл пост из первого.
+        self.assertEqual(Comment.objects.get().post.text, 'Первый')
+        # В точке только позиция и счётчики, id записей — в базе.
+        with open(f'{path}.checkpoint', encoding='utf-8') as source:
+            state = json.load(source)
+        self.assertEqual(set(state),
+                         {'run', 'position', 'rows', 'skipped', 'conflicts'})
+        self.assertEqual(state['rows'], len(self.RECORDS))
+        self.assertEqual(ImportedRecord.objects.filter(
+            run=state['run'], kind='posts').count(), 2)
+
+        call_command('import_yatube', path, '--restart', '--skip-derived',
+                     '--on-conflict', 'skip', stdout=StringIO(),
+                     stderr=StringIO())
+        self.assertFalse(
+            ImportedRecord.objects.filter(run=state['run']).exists())
+
+    def test_import_csv(self):
+        path = self.write('posts.csv', [
+            'author,id,text\n',
+            'alice,7,"Текст\nв две строки"\n',
+        ])
+        User.objects.create_user(username='alice')
+        self.run_import(path, '--model', 'post')
+        self.assertEqual(Post.objects.get().text, 'Текст\nв две строки')
+
+    def dump(self):
+        return self.write('dump.ndjson', (
+            json.dumps(record, ensure_ascii=False) + '\n'
+            for record in self.RECORDS
+        ))
+
+    def test_import_into_non_empty_database(self):
+        """id из выгрузки заняты: посты получают новые, ссылки следуют."""
+        carol = User.objects.create_user(username='carol')
+        for pk in (500, 501):
+            Post.objects.create(pk=pk, author=carol, text=f'Старый {pk}')
+        self.run_import(self.dump())
+        self.assertEqual(
+            list(Post.objects.filter(pk__in=(500, 501)).order_by(
+                'pk').values_list('author__username', 'text')),
+            [('carol', 'Старый 500'), ('carol', 'Старый 501')],
+        )
+        post = Post.objects.get(text='Первый')
+        self.assertNotIn(post.pk, (500, 501))
+        self.assertEqual(post.author.username, 'alice')
+        self.assertEqual(
+            list(Comment.objects.values_list('post_id', flat=True)),
+            [post.pk],
+        )
+        self.assertEqual(post.comment_count, 1)
+
+    def test_username_conflict_fails(self):
+        User.objects.create_user(username='alice')
+        with self.assertRaisesMessage(CommandError, 'alice'):
+            self.run_import(self.dump())
+        self.assertFalse(Post.objects.exists())
+        self.assertFalse(User.objects.filter(username='bob').exists())
+
+    def test_username_conflict_skipped(self):
+        alice = User.objects.create_user(username='alice')
+        Group.objects.create(slug='imported', title='Своя')
+        stderr = StringIO()
+        call_command('import_yatube', self.dump(), '--on-conflict', 'skip',
+                     stdout=StringIO(), stderr=stderr)
+        self.assertIn('alice', stderr.getvalue())
+        self.assertIn('imported', stderr.getvalue())
+        # Посты и подписки на чужого alice не привязываются.
+        self.assertFalse(Post.objects.filter(author=alice).exists())
+        self.assertFalse(Follow.objects.exists())
+        self.assertTrue(User.objects.filter(username='bob').exists())
+        self.assertEqual(Group.objects.get(slug='imported').title, 'Своя')
+
+    def test_existing_pages_invalidated(self):
+        """Посты в существующей группе и у автора сбрасывают их страницы."""
+        dave = User.objects.create_user(username='dave')
+        Group.objects.create(slug='existing', title='Старая')
+        pages = [reverse('posts:group_list', kwargs={'slug': 'existing'}),
+                 reverse('posts:profile', kwargs={'username': 'dave'})]
+        etags = [self.client.get(page)['ETag'] for page in pages]
+        path = self.write('dump.ndjson', [json.dumps(
+            {'model': 'post', 'author': 'dave', 'group': 'existing',
+             'text': 'Импортированный'}, ensure_ascii=False) + '\n'])
+        self.run_import(path, '--skip-derived')
+        self.assertTrue(Post.objects.filter(author=dave).exists())
+        for page, etag in zip(pages, etags):
+            with self.subTest(page=page):
+                response = self.client.get(page, HTTP_IF_NONE_MATCH=etag)
+                self.assertContains(response, 'Импортированный')
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username=name_users[0])
+        cls.user = User.objects.create_user(username=name_users[1])
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug=name_slugs[0],
+            description='Описание группы',
+        )
+        for i in range(5):
+            cls.post = Post.objects.create(
+                text=f'Пост #{i}\nс переводом строки',
+                author=cls.author,
+                group=cls.group if i % 2 else None,
+            )
+        Comment.objects.create(post=cls.post, author=cls.user, text='Ок')
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def snapshot(self):
+        return (
+            list(Post.objects.order_by('id').values_list(
+                'author__username', 'group__slug', 'text', 'pub_date'
+            )),
+            list(Comment.objects.values_list(
+                'post__text', 'author__username', 'text', 'created'
+            )),
+            list(Follow.objects.values_list(
+                'user__username', 'author__username'
+            )),
+        )
+
+    def test_round_trip(self):
+        """Выгрузка импортируется в пустую базу без потерь."""
+        expected = self.snapshot()
+        for file_format in ('ndjson', 'csv'):
+            with self.subTest(format=file_format):
+                path = os.path.join(self.directory, f'dump.{file_format}')
+                call_command(
+                    'export_yatube', '--format', file_format,
+                    '--output', path, '--chunk-size', '2',
+                    stderr=StringIO(),
+                )
+                Post.objects.all().delete()
+                Group.objects.all().delete()
+                User.objects.all().delete()
+                call_command('import_yatube', path, stdout=StringIO())
+                self.assertEqual(self.snapshot(), expected)
+
+    def test_keyset_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(export.keyset(Post.objects.all(), ('text',), 2))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(len(queries), 3)
+
+    def test_scoped_export(self):
+        output = StringIO()
+        call_command('export_yatube', '--group', self.group.slug,
+                     stdout=output, stderr=StringIO())
+        models = [json.loads(line)['model']
+                  for line in output.getvalue().splitlines()]
+        self.assertEqual(models, ['user', 'group', 'post', 'post'])
+
+    def test_endpoint_staff_only(self):
+        client = Client()
+        client.force_login(self.user)
+        url = reverse('posts:export')
+        self.assertEqual(client.get(url).status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        response = client.get(
+            url, {'format': 'csv', 'author': self.author.username})
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        self.assertTrue(content.startswith('model,id,username'))
+        self.assertEqual(content.count('\r\npost,'), 5)
+
+
+class BenchTest(TestCase):
+    def test_bench_reports_and_compares(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = os.path.join(directory, 'bench.json')
+        call_command('bench', users=5, groups=2, posts=40, comments=20,
+                     follows=10, repeat=2, output=output, stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 40)
+        self.assertEqual(Comment.objects.count(), 20)
+        with open(output, encoding='utf-8') as file:
+            results = json.load(file)
+        self.assertEqual(results['meta']['dataset']['posts'], 40)
+        index = results['views']['posts:index']
+        self.assertEqual(index['status'], 200)
+        self.assertLessEqual(index['p50_ms'], index['p99_ms'])
+        self.assertGreater(index['bytes'], 0)
+        self.assertNotIn('posts:profile_follow', results['views'])
+
+        for view in results['views'].values():
+            view['queries'] = 0
+        baseline = os.path.join(directory, 'baseline.json')
+        with open(baseline, 'w', encoding='utf-8') as file:
+            json.dump(results, file)
+        with self.assertRaisesMessage(CommandError, 'запросов 0 ->'):
+            call_command('bench', repeat=2, output=output, compare=baseline,
+                         stdout=StringIO())
+        # Повторный запуск не строит набор данных заново.
+        self.assertEqual(Post.objects.count(), 40)
+
+    def test_bench_keeps_shared_cache(self):
+        """Замер не очищает общий кеш, а сборка сбрасывает страницы."""
+        output = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        cache.set('sentinel', 'value')
+        self.addCleanup(cache.delete, 'sentinel')
+        call_command('bench', users=3, groups=1, posts=5, comments=0,
+                     follows=2, repeat=1, output=output, stdout=StringIO())
+        self.assertEqual(cache.get('sentinel'), 'value')
+        group = Group.objects.get()
+        author = Post.objects.first().author
+        for scope, ident in ((page_cache.GROUP, group.slug),
+                             (page_cache.AUTHOR, author.username)):
+            with self.subTest(scope=scope):
+                self.assertIsNotNone(
+                    cache.get(page_cache.generation_key(scope, ident)))
+
+    def test_bench_rejects_zero_repeat(self):
+        with self.assertRaisesMessage(CommandError, '--repeat'):
+            call_command('bench', repeat=0, stdout=StringIO())
+        self.assertFalse(Post.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class LoadTestTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        Post.objects.create(text='Пост под нагрузку', author=cls.author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Как и Client: соединение теста не закрывается между запросами.
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+    def test_arrivals_are_open_loop(self):
+        moments = [moment for moment, _ in loadtest.arrivals(
+            {'index': 1}, 100, 10, random.Random(1))]
+        self.assertEqual(moments, sorted(moments))
+        self.assertLess(moments[-1], 10)
+        self.assertAlmostEqual(len(moments), 1000, delta=150)
+
+    def test_exceptions_are_collected(self):
+        class Traffic:
+            def index(self):
+                raise KeyError('index')
+
+        records = loadtest.run(Traffic(), {'index': 1}, 200, 0.05,
+                               workers=0, seed=1)
+        summary = loadtest.summarize(records, 200)
+        self.assertEqual(summary['exceptions'], {'KeyError': len(records)})
+        self.assertEqual(summary['error_rate'], 1)
+
+    def test_empty_run_stats(self):
+        stats = loadtest.summarize([], 10)['total']
+        self.assertEqual(stats['requests'], 0)
+        self.assertEqual(stats['p99_ms'], 0)
+        self.assertEqual(sum(stats['histogram']), 0)
+
+    def test_loadtest_runs_mix(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = os.path.join(directory, 'load.json')
+        comments = Comment.objects.count()
+        call_command('loadtest', mix='index=2,follow=1,comment=1,upload=1',
+                     rate=100, duration=0.3, workers=0, users=2,
+                     host='testserver', output=output, stdout=StringIO())
+        with open(output, encoding='utf-8') as file:
+            summary = json.load(file)
+        self.assertEqual(summary['error_rate'], 0)
+        self.assertEqual(
+            set(summary['scenarios']),
+            {'index', 'follow', 'comment', 'upload'},
+        )
+        self.assertEqual(
+            Comment.objects.count() - comments,
+            summary['scenarios']['comment']['requests'],
+        )
+        self.assertEqual(
+            Post.objects.filter(text__contains='под нагрузкой').count(),
+            summary['scenarios']['upload']['requests'],
+        )
+        self.assertEqual(sum(summary['total']['histogram']),
+                         summary['total']['requests'])
@@ -1,12 +1,20 @@
 import shutil
 import tempfile
+from io import BytesIO
+from unittest import mock, skipUnless
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image, features
 
+from sorl.thumbnail import default, get_thumbnail
+
+from posts import images, thumbnails
+from posts.forms import PostForm
 from posts.models import Group, Post, Comment
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -14,6 +22,15 @@ TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 User = get_user_model()
 name_users = ['TestUser1', 'TestUser2']
 
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PostFormTests(TestCase):
@@ -148,3 +165,148 @@ class PostFormTests(TestCase):
             response,
             reverse('posts:post_detail', kwargs={'post_id': post.id})
         )
+
+    def test_thumbnails_warmed_for_post_image(self):
+        """Миниатюры всех размеров создаются до первого показа поста."""
+        uploaded = SimpleUploadedFile(
+            name='warm.gif',
+            content=SMALL_GIF,
+            content_type='image/gif'
+        )
+        post = Post.objects.create(
+            text='Пост с картинкой',
+            author=self.author,
+            image=uploaded
+        )
+        thumbnails.warm(post.image.name)
+        for geometry, options in settings.THUMBNAIL_PRESETS:
+            with self.subTest(geometry=geometry), mock.patch.object(
+                default.engine, 'get_image', side_effect=AssertionError
+            ):
+                thumbnail = get_thumbnail(post.image, geometry, **options)
+                self.assertTrue(thumbnail.exists())
+
+
+def make_image(size, image_format, mode='RGB', **options):
+    """Картинка с плавными переходами, похожая на фотографию."""
+    channels = [
+        Image.linear_gradient('L').resize(size),
+        Image.radial_gradient('L').resize(size),
+        Image.effect_mandelbrot(size, (-2, -1.5, 1, 1.5), 50),
+    ]
+    if mode == 'RGBA':
+        channels.append(Image.new('L', size, 200))
+    buffer = BytesIO()
+    Image.merge(mode, channels).save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    IMAGE_MAX_SIDE=1280,
+    IMAGE_FORMAT='JPEG',
+)
+class ImageIngestionTest(TestCase):
+    def ingest(self, name, content):
+        return images.ingest(SimpleUploadedFile(name, content))
+
+    def test_corpus_bytes_saved(self):
+        """Перекодирование заметно уменьшает типичные загрузки."""
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        corpus = {
+            'photo.jpg': make_image(
+                (3000, 2000), 'JPEG', quality=100, exif=exif.tobytes()
+            ),
+            'screenshot.png': make_image((1600, 1000), 'PNG'),
+            'sticker.png': make_image((800, 800), 'PNG', mode='RGBA'),
+        }
+        before = after = 0
+        for name, content in corpus.items():
+            with self.subTest(name=name):
+                result = self.ingest(name, content)
+                data = result.read()
+                image = Image.open(BytesIO(data))
+                self.assertEqual(image.format, 'JPEG')
+                self.assertTrue(result.name.endswith('.jpg'))
+                self.assertLessEqual(max(image.size), 1280)
+                self.assertNotIn('exif', image.info)
+                before += len(content)
+                after += len(data)
+        self.assertLess(after, before * 0.3)
+
+    def test_exif_orientation_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        result = self.ingest('rotated.jpg', make_image(
+            (400, 200), 'JPEG', exif=exif.tobytes()
+        ))
+        image = Image.open(result)
+        self.assertEqual(image.size, (200, 400))
+        self.assertIsNone(image.getexif().get(0x0112))
+
+    @skipUnless(features.check('webp'), 'Pillow собран без WebP')
+    @override_settings(IMAGE_FORMAT='WEBP')
+    def test_webp_output(self):
+        result = self.ingest('photo.jpg', make_image((300, 200), 'JPEG'))
+        self.assertEqual(result.name, 'photo.webp')
+        self.assertEqual(Image.open(result).format, 'WEBP')
+
+    def test_truncated_image_rejected(self):
+        """Обрезанный файл — ошибка формы, а не 500."""
+        content = make_image((400, 300), 'JPEG')
+        self.client.force_login(User.objects.create_user(username='cutter'))
+        response = self.client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Обрезанный', 'image': SimpleUploadedFile(
+                'cut.jpg', content[:len(content) // 2], 'image/jpeg'
+            )},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('image', response.context['form'].errors)
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(IMAGE_MAX_PIXELS=100 * 100)
+    def test_decompression_bomb_rejected(self):
+        """Слишком большая по заголовку картинка не декодируется."""
+        upload = SimpleUploadedFile(
+            'bomb.png', make_image((200, 200), 'PNG'), 'image/png'
+        )
+        with mock.patch.object(
+            images.ImageOps, 'exif_transpose', side_effect=AssertionError
+        ):
+            form = PostForm(
+                data={'text': 'Бомба'}, files={'image': upload}
+            )
+            self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+
+    def gif(self, frames, **options):
+        buffer = BytesIO()
+        pictures = [Image.new('P', (40, 30), color) for color in range(frames)]
+        pictures[0].save(buffer, 'GIF', save_all=True,
+                         append_images=pictures[1:], **options)
+        return buffer.getvalue()
+
+    def test_gif_rebuilt_without_comments(self):
+        """Анимация сохраняется, комментарии и лишние блоки — нет."""
+        result = self.ingest('anim.gif', self.gif(
+            3, duration=[50, 60, 70], loop=0, comment=b'secret-comment'))
+        data = result.read()
+        self.assertNotIn(b'secret-comment', data)
+        image = Image.open(BytesIO(data))
+        self.assertEqual(image.n_frames, 3)
+        self.assertEqual(image.info['loop'], 0)
+        image.seek(2)
+        self.assertEqual(image.info['duration'], 70)
+
+    @override_settings(IMAGE_MAX_PIXELS=40 * 30 * 4)
+    def test_gif_picturescount_against_pixels(self):
+        self.ingest('four.gif', self.gif(4))
+        with self.assertRaises(ValidationError):
+            self.ingest('five.gif', self.gif(5))
+
+    @override_settings(IMAGE_MAX_BYTES=100)
+    def test_gif_bytes_limit(self):
+        with self.assertRaises(ValidationError):
+            self.ingest('big.gif', self.gif(3))
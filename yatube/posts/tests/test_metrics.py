@@ -0,0 +1,190 @@
+import os
+import shutil
+import tempfile
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts import metrics
+from posts.models import Post
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+def record_in_child():
+    metrics.RESPONSES.inc(2, view='posts:index', status=200)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT,
+                   METRICS_ALLOWED_IPS=['127.0.0.1'])
+class MetricsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        Post.objects.create(text='Пост', author=cls.author)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(METRICS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def files(self):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.endswith(metrics.SUFFIX))
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode().splitlines()
+
+    def test_requests_are_exposed(self):
+        self.client.get(reverse('posts:index'))
+        self.client.get('/missing/')
+        lines = self.scrape()
+        self.assertIn(
+            'yatube_responses_total{view="posts:index",status="200"} 1', lines
+        )
+        self.assertIn(
+            'yatube_responses_total{view="unresolved",status="404"} 1', lines
+        )
+        self.assertIn('yatube_request_duration_seconds_bucket'
+                      '{view="posts:index",le="+Inf"} 1', lines)
+        self.assertIn('# TYPE yatube_request_db_queries histogram', lines)
+        queries = next(line for line in lines if line.startswith(
+            'yatube_request_db_queries_sum{view="posts:index"}'))
+        self.assertGreater(float(queries.split()[-1]), 0)
+
+    def test_histogram_buckets_are_cumulative(self):
+        for seconds in (0.0005, 0.003, 0.003, 30):
+            metrics.REQUEST_DURATION.observe(seconds, view='test')
+        lines = self.scrape()
+        prefix = 'yatube_request_duration_seconds_bucket{view="test",'
+        self.assertIn(prefix + 'le="0.001"} 1', lines)
+        self.assertIn(prefix + 'le="0.005"} 3', lines)
+        self.assertIn(prefix + 'le="5"} 3', lines)
+        self.assertIn(prefix + 'le="+Inf"} 4', lines)
+        self.assertIn('yatube_request_duration_seconds_count{view="test"} 4',
+                      lines)
+
+    def test_processes_are_summed(self):
+        metrics.RESPONSES.inc(view='posts:index', status=200)
+        child = get_context('fork').Process(target=record_in_child)
+        child.start()
+        child.join()
+        self.assertEqual(child.exitcode, 0)
+        self.assertEqual(len(self.files()), 2)
+        totals = metrics.collect(self.directory)
+        self.assertEqual(totals[('yatube_responses_total', (
+            ('view', 'posts:index'), ('status', '200')))], 3)
+
+    def test_file_grows_and_reopens(self):
+        for number in range(2000):
+            metrics.RESPONSES.inc(view=f'view_{number}', status=200)
+        metrics.store.open(self.directory)
+        metrics.RESPONSES.inc(view='view_0', status=200)
+        totals = metrics.collect(self.directory)
+        self.assertEqual(len(totals), 2000)
+        self.assertEqual(totals[('yatube_responses_total', (
+            ('view', 'view_0'), ('status', '200')))], 2)
+
+    def test_cache_hit_ratio(self):
+        self.client.get(reverse('posts:index'))
+        cache.get('metrics-missing')
+        cache.set('metrics-present', 1)
+        cache.get_many(['metrics-present', 'metrics-missing'])
+        totals = metrics.collect(self.directory)
+        hits = totals[('yatube_cache_lookups_total', (('result', 'hit'),))]
+        misses = totals[('yatube_cache_lookups_total',
+                         (('result', 'miss'),))]
+        self.assertGreaterEqual(hits, 1)
+        self.assertGreaterEqual(misses, 2)
+        self.assertIn(f'yatube_cache_hit_ratio {hits / (hits + misses)!r}',
+                      self.scrape())
+
+    def test_exited_process_is_archived(self):
+        metrics.RESPONSES.inc(view='posts:index', status=200)
+        child = get_context('fork').Process(
+            target=metrics.RESPONSES.inc,
+            kwargs={'view': 'posts:index', 'status': 200},
+        )
+        child.start()
+        child.join()
+        self.assertEqual(len(self.files()), 2)
+        # Новый процесс забирает файл завершившегося, живой не трогает.
+        metrics.store.open(self.directory)
+        self.assertEqual(self.files(),
+                         sorted([metrics.ARCHIVE, metrics.store.name]))
+        totals = metrics.collect(self.directory)
+        self.assertEqual(totals[('yatube_responses_total', (
+            ('view', 'posts:index'), ('status', '200')))], 2)
+
+    def test_get_many_with_generator(self):
+        metrics.instrument()
+        cache.set('metrics-present', 1)
+        values = cache.get_many(
+            key for key in ('metrics-present', 'metrics-missing'))
+        self.assertEqual(values, {'metrics-present': 1})
+        totals = metrics.collect(self.directory)
+        self.assertEqual(
+            totals[('yatube_cache_lookups_total', (('result', 'hit'),))], 1)
+        self.assertEqual(
+            totals[('yatube_cache_lookups_total', (('result', 'miss'),))], 1)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }})
+    def test_cache_backend_swapped_after_start(self):
+        """Бэкенд, появившийся после первой обёртки, тоже считается."""
+        metrics.instrument()
+        caches['default'].get('metrics-missing')
+        totals = metrics.collect(self.directory)
+        self.assertEqual(
+            totals[('yatube_cache_lookups_total', (('result', 'miss'),))], 1)
+
+    def test_upload_sizes(self):
+        client = Client()
+        client.force_login(self.author)
+        small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x02\x00'
+            b'\x01\x00\x80\x00\x00\x00\x00\x00'
+            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+            b'\x0A\x00\x3B'
+        )
+        client.post(reverse('posts:post_create'), {
+            'text': 'Пост с картинкой',
+            'image': SimpleUploadedFile('metrics.gif', small_gif,
+                                        'image/gif'),
+        })
+        lines = self.scrape()
+        stored = Post.objects.get(text='Пост с картинкой').image.size
+        for stage, size in (('received', len(small_gif)),
+                            ('stored', stored)):
+            self.assertIn(f'yatube_upload_bytes_sum{{stage="{stage}"}} '
+                          f'{size}', lines)
+
+    def test_only_allowed_addresses(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS_ALLOWED_IPS=[])
+    def test_empty_allowlist_closes_page(self):
+        """Пустой список, как по умолчанию, закрывает и loopback."""
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
@@ -0,0 +1,261 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.template import engines
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import profiling, slow_queries
+from posts.models import Group, Post
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ServerTimingTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='author')
+        small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x02\x00'
+            b'\x01\x00\x80\x00\x00\x00\x00\x00'
+            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+            b'\x0A\x00\x3B'
+        )
+        Post.objects.create(
+            text='Пост с картинкой', author=author,
+            image=SimpleUploadedFile('timing.gif', small_gif, 'image/gif'),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def metrics(self, response):
+        return {
+            name: params for name, _, params in (
+                part.partition(';') for part in
+                response['Server-Timing'].split(', ')
+            )
+        }
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    def test_header_and_log_line(self):
+        with self.assertLogs('posts.timing', 'INFO') as logs:
+            first = self.client.get(reverse('posts:index'))
+            second = self.client.get(reverse('posts:index'))
+        cold, warm = self.metrics(first), self.metrics(second)
+        self.assertIn('total', cold)
+        self.assertNotIn('desc="0 queries"', cold['sql'])
+        self.assertIn('desc="1 renders"', cold['tpl'])
+        self.assertNotIn('desc="0 lookups', cold['thumb'])
+        # Повторный запрос отдаётся из кеша страниц.
+        self.assertIn('desc="0 queries"', warm['sql'])
+        self.assertIn('desc="0 renders"', warm['tpl'])
+        self.assertIn('0 misses', warm['cache'])
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['path'], reverse('posts:index'))
+        self.assertEqual(line['status'], 200)
+        self.assertGreater(line['sql_count'], 0)
+        self.assertGreater(line['thumbnail_count'], 0)
+        self.assertGreater(json.loads(logs.records[1].getMessage())[
+            'cache_hits'], 0)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_request_has_no_header(self):
+        response = self.client.get(reverse('posts:index'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+@override_settings(SLOW_QUERY_MS=0)
+class SlowQueryLogTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='slow', description='Описание'
+        )
+        cls.post = Post.objects.create(text='Пост', author=cls.author,
+                                       group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+
+    def records(self, logs):
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_request_records_view_params_and_plan(self):
+        with self.assertLogs('posts.slow_queries', 'INFO') as logs:
+            self.client.get(reverse('posts:profile',
+                                    kwargs={'username': 'author'}))
+        records = self.records(logs)
+        self.assertTrue(records)
+        self.assertEqual({r['view'] for r in records}, {'posts:profile'})
+        lookup = next(r for r in records
+                      if r['params'] == ['<str:{}>'.format(len('author'))])
+        self.assertNotIn('author', json.dumps(lookup['params']))
+        self.assertTrue(lookup['code'].startswith('posts/'))
+        self.assertIn('SEARCH auth_user', ' '.join(lookup['plan']))
+
+    def test_lazy_query_points_to_template_line(self):
+        template = engines['django'].from_string(
+            '<ul>\n{% for post in posts %}<li>{{ post.text }}</li>'
+            '{% endfor %}\n</ul>'
+        )
+        request = RequestFactory().get('/')
+        recorder = slow_queries.SlowQueryRecorder(request, 0)
+        with self.assertLogs('posts.slow_queries', 'INFO') as logs:
+            with connection.execute_wrapper(recorder):
+                template.render({'posts': Post.objects.all()})
+        record, = self.records(logs)
+        self.assertEqual(record['template_line'], 2)
+        self.assertIsNone(record['view'])
+
+    def test_explain_is_not_counted(self):
+        with self.assertLogs('posts.slow_queries', 'INFO'):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('posts:group_list',
+                                        kwargs={'slug': 'slow'}))
+        self.assertFalse(any('EXPLAIN' in query['sql']
+                             for query in queries))
+
+    def test_summary_command(self):
+        with self.assertLogs('posts.slow_queries', 'INFO') as logs:
+            for _ in range(2):
+                cache.clear()
+                self.client.get(reverse('posts:index'))
+        log = os.path.join(tempfile.mkdtemp(),
+                           'slow.ndjson')
+        self.addCleanup(shutil.rmtree, os.path.dirname(log))
+        lines = [record.getMessage() for record in logs.records]
+        half = len(lines) // 2
+        # Первая половина уже ушла в ротированный файл.
+        with open(log + '.1', 'w', encoding='utf-8') as rotated:
+            rotated.write('\n'.join(lines[:half]) + '\n')
+        with open(log, 'w', encoding='utf-8') as current:
+            current.write('\n'.join(lines[half:]) + '\n')
+
+        groups = slow_queries.summarize(slow_queries.read(log))
+        self.assertEqual(sum(group['count'] for group in groups),
+                         len(lines))
+        self.assertTrue(all(group['count'] == 2 for group in groups))
+        totals = [group['total_ms'] for group in groups]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+
+        output = StringIO()
+        call_command('slow_queries', file=log, limit=1, stdout=output)
+        self.assertIn(f'разных запросов {len(groups)}', output.getvalue())
+        self.assertIn('posts:index (2)', output.getvalue())
+        self.assertIn('1. всего', output.getvalue())
+        self.assertNotIn('2. всего', output.getvalue())
+
+    def test_fingerprint_folds_in_lists(self):
+        self.assertEqual(
+            slow_queries.fingerprint('SELECT 1\n WHERE id IN (%s, %s)'),
+            slow_queries.fingerprint('SELECT 1 WHERE id IN (%s)'),
+        )
+
+
+class ProfilingTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        cls.user = User.objects.create_user(username='user')
+        Post.objects.create(text='Пост', author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings_override = override_settings(PROFILING_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.staff_client = Client()
+        self.staff_client.force_login(self.staff)
+
+    def captured(self):
+        return profiling.profiles(self.directory)
+
+    def test_staff_header_and_flag_trigger_profile(self):
+        response = self.staff_client.get(reverse('posts:index'),
+                                         HTTP_X_PROFILE='1')
+        path, = self.captured()
+        self.assertEqual(response['X-Profile'], os.path.basename(path))
+        view, duration = profiling.parse(path)
+        self.assertEqual(view, 'posts:index')
+        self.assertGreaterEqual(duration, 0)
+        self.staff_client.get(reverse('posts:profile',
+                                      kwargs={'username': 'user'}),
+                              {'_profile': '1'})
+        self.assertEqual(profiling.parse(self.captured()[-1])[0],
+                         'posts:profile')
+
+    def test_flag_ignored_for_other_users(self):
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(reverse('posts:index'), HTTP_X_PROFILE='1')
+        self.assertFalse(response.has_header('X-Profile'))
+        self.client.get(reverse('posts:index'), {'_profile': '1'})
+        self.assertEqual(self.captured(), [])
+
+    def test_disabled_flag_ignored(self):
+        """``?_profile=0`` и ``X-Profile: 0`` профилирование не включают."""
+        response = self.staff_client.get(reverse('posts:index'),
+                                         {'_profile': '0'})
+        self.assertFalse(response.has_header('X-Profile'))
+        response = self.staff_client.get(reverse('posts:index'),
+                                         HTTP_X_PROFILE='0')
+        self.assertFalse(response.has_header('X-Profile'))
+        self.assertEqual(self.captured(), [])
+        self.staff_client.get(reverse('posts:index'), {'_profile': 'true'})
+        self.assertEqual(len(self.captured()), 1)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_MAX_FILES=2)
+    def test_sampling_keeps_newest_profiles(self):
+        for _ in range(3):
+            response = self.client.get(reverse('posts:index'))
+        self.assertFalse(response.has_header('X-Profile'))
+        self.assertEqual(len(self.captured()), 2)
+
+    def test_report_merges_profiles_per_view(self):
+        for _ in range(2):
+            self.staff_client.get(reverse('posts:index'),
+                                  HTTP_X_PROFILE='1')
+        self.staff_client.get(reverse('posts:post_detail', kwargs={
+            'post_id': Post.objects.get().pk}), HTTP_X_PROFILE='1')
+        output = StringIO()
+        merged = os.path.join(self.directory, 'merged')
+        call_command('profile_report', dir=self.directory,
+                     view='posts:index', limit=50, sort='cumtime',
+                     output=merged, stdout=output)
+        self.assertIn('posts:index: профилей 2', output.getvalue())
+        self.assertNotIn('posts:post_detail', output.getvalue())
+        self.assertIn('posts/views.py', output.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(merged,
+                                                    'posts.index.pstats')))
+
+    def test_report_without_profiles(self):
+        with self.assertRaises(CommandError):
+            call_command('profile_report', dir=self.directory,
+                         stdout=StringIO())
@@ -0,0 +1,122 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# Таблицы, которые всегда маленькие или не относятся к коду вью.
+IGNORED_TABLES = ('django_session', 'django_content_type',
+                  'thumbnail_kvstore', 'posts_group')
+# Запросы, которые не читают данные страницы.
+IGNORED_PREFIXES = ('SAVEPOINT', 'RELEASE', 'ROLLBACK', 'BEGIN',
+                    'INSERT', 'UPDATE', 'DELETE')
+
+
+class PlanRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not (many or sql.lstrip().upper().startswith(IGNORED_PREFIXES)):
+            self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def explain(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def regressions(sql, plan):
+    """Полные просмотры таблиц и сортировки во временном B-дереве.
+
+    Результаты полнотекстового поиска сортируются по релевантности,
+    которую индекс дать не может, поэтому сортировка для них допустима.
+    """
+    problems = []
+    for step in plan:
+        if 'USE TEMP B-TREE' in step:
+            if ' MATCH ' in sql:
+                continue
+            problems.append(step)
+        elif step.startswith('SCAN ') and 'INDEX' not in step:
+            table = step.split()[1]
+            if table not in IGNORED_TABLES:
+                problems.append(step)
+    return problems
+
+
+class QueryPlanTest(TestCase):
+    """Запросы вью идут по индексам и не сортируют строки после выборки.
+
+    Планировщику SQLite нужна статистика, чтобы выбрать индекс, поэтому
+    перед проверкой выполняется ANALYZE на заполненной базе.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание')
+        authors = [cls.author] + [
+            User.objects.create_user(username=f'author{i}') for i in range(5)
+        ]
+        Post.objects.bulk_create(
+            Post(text=f'Пост #{i}', author=authors[i % len(authors)],
+                 group=cls.group if i % 3 else None)
+            for i in range(200)
+        )
+        cls.post = Post.objects.filter(author=cls.author).first()
+        Comment.objects.bulk_create(
+            Comment(post_id=post_id, author=cls.user, text='Комментарий')
+            for post_id in Post.objects.values_list('id', flat=True)
+        )
+        for author in authors[:3]:
+            Follow.objects.create(user=cls.user, author=author)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_views_use_indexes(self):
+        post_args = {'post_id': self.post.pk}
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:index') + '?page=2',
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile',
+                    kwargs={'username': self.author.username}),
+            reverse('posts:post_detail', kwargs=post_args),
+            reverse('posts:post_comments', kwargs=post_args),
+            reverse('posts:follow_index'),
+            reverse('posts:index_rss'),
+            reverse('posts:group_rss', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile_rss',
+                    kwargs={'username': self.author.username}),
+            reverse('posts:post_search') + '?q=пост',
+            reverse('posts:api_posts'),
+            reverse('posts:api_group_posts',
+                    kwargs={'slug': self.group.slug}),
+            reverse('posts:api_profile_posts',
+                    kwargs={'username': self.author.username}),
+            reverse('posts:api_post', kwargs=post_args),
+            reverse('posts:api_follow'),
+        ]
+        for url in urls:
+            recorder = PlanRecorder()
+            with connection.execute_wrapper(recorder):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            for sql, params in recorder.queries:
+                with self.subTest(url=url, sql=sql):
+                    self.assertEqual(
+                        regressions(sql, explain(sql, params)), [])
@@ -0,0 +1,59 @@
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase
+
+from posts.utils import sqlite
+
+
+class SqliteTuningTest(TestCase):
+    def test_pragmas_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0],
+                             settings.SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_retry_on_busy(self):
+        calls = []
+
+        def write():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'ok'
+
+        self.assertEqual(sqlite.retry_on_busy(write, delay=0), 'ok')
+        self.assertEqual(len(calls), 3)
+
+        def broken():
+            calls.append(1)
+            raise OperationalError('no such table')
+
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            sqlite.retry_on_busy(broken, delay=0)
+        self.assertEqual(len(calls), 1)
+
+    def test_replaced_database_file_closes_connection(self):
+        connection.ensure_connection()
+        known = connection.sqlite_file_id
+        connection.sqlite_file_id = (0, 0)
+        try:
+            with mock.patch.object(connection, 'close') as close:
+                sqlite.check_connections()
+        finally:
+            connection.sqlite_file_id = known
+        close.assert_called_once()
+
+    def test_bench_writers(self):
+        out = StringIO()
+        call_command('bench_sqlite_writers', writers=2, commits=5,
+                     stdout=out)
+        self.assertIn('настроенный', out.getvalue())
+        self.assertIn('успешно 10, ошибок 0, потоков завершилось 2 из 2',
+                      out.getvalue())
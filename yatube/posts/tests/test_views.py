@@ -1,15 +1,32 @@
+import base64
+import os
 import shutil
+import sqlite3
 import tempfile
+import time
+from io import StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from posts.models import Group, Post, Follow
+from posts import counters, routers
+from posts.management.commands import sync_replica
+from posts.models import AuthorStats, Comment, FeedEntry, Follow, Group, Post
+from posts.templatetags.post_cards import card_key
+from posts.urls import urlpatterns
+from posts.utils import page_cache, pagination
+from posts.utils.query_budget import QueryBudgetExceeded, query_budget
 
 User = get_user_model()
 
@@ -129,15 +146,51 @@ class PostViewsTests(TestCase):
         )
         page_add = self.author_client.get(
             reverse('posts:index')).content
-        post.delete()
-        page_delete = self.author_client.get(
+        Post.objects.filter(pk=post.pk).update(text='Изменён мимо сигналов')
+        page_cached = self.author_client.get(
             reverse('posts:index')).content
-        self.assertEqual(page_add, page_delete)
+        self.assertEqual(page_add, page_cached)
         cache.clear()
         page_cache_clear = self.author_client.get(
             reverse('posts:index')).content
         self.assertNotEqual(page_add, page_cache_clear)
 
+    def test_cache_invalidated_on_change(self):
+        """Кеш страниц сбрасывается сразу после изменения данных."""
+        urls = [
+            name_reverses['index'],
+            name_reverses['group'],
+            name_reverses['profile'],
+        ]
+        pages = {url: self.author_client.get(url).content for url in urls}
+        Post.objects.create(
+            text='Пост сбрасывает кеш',
+            author=self.user,
+            group=self.group
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertNotEqual(
+                    self.author_client.get(url).content, pages[url])
+
+    def test_post_cards_cached(self):
+        """Карточки постов берутся из кеша и обновляются с именем автора."""
+        self.author_client.get(name_reverses['index'])
+        self.assertIsNotNone(cache.get(card_key(self.post, 'index')))
+
+        self.user.first_name = 'Граф'
+        self.user.last_name = 'Толстой'
+        self.user.save()
+        response = self.author_client.get(name_reverses['index'])
+        self.assertContains(response, 'Граф Толстой')
+
+    def test_cache_invalidated_on_group_change(self):
+        page = self.author_client.get(name_reverses['group']).content
+        self.group.description = 'Новое описание группы'
+        self.group.save()
+        self.assertNotEqual(
+            self.author_client.get(name_reverses['group']).content, page)
+
 
 class PaginatorViewsTest(TestCase):
     @classmethod
@@ -181,6 +234,51 @@ class PaginatorViewsTest(TestCase):
                 self.assertEqual(
                     len(response.context['page_obj'].object_list), page)
 
+    def test_cursor_navigation(self):
+        """Переход по курсорам вперёд и назад возвращает те же посты."""
+        first = self.guest_client.get(name_reverses['index'])
+        first_page = first.context['page_obj']
+        next_cursor = first_page.paginator.next_cursor
+        self.assertIsNotNone(next_cursor)
+        self.assertIsNone(first_page.paginator.previous_cursor)
+
+        second = self.guest_client.get(
+            name_reverses['index'], {'cursor': next_cursor})
+        second_page = second.context['page_obj']
+        self.assertEqual(len(second_page.object_list), 1)
+        self.assertFalse(second_page.has_next())
+        self.assertTrue(second_page.has_previous())
+        self.assertNotIn(second_page[0], first_page.object_list)
+
+        back = self.guest_client.get(
+            name_reverses['index'],
+            {'cursor': second_page.paginator.previous_cursor}
+        )
+        self.assertEqual(
+            list(back.context['page_obj'].object_list),
+            list(first_page.object_list)
+        )
+        self.assertFalse(back.context['page_obj'].has_previous())
+
+    def test_broken_cursor_shows_first_page(self):
+        response = self.guest_client.get(
+            name_reverses['group'], {'cursor': 'не-курсор'})
+        self.assertEqual(
+            len(response.context['page_obj'].object_list),
+            settings.PAGE_SIZE
+        )
+
+    def test_cursor_pk_out_of_range(self):
+        date = '2020-01-01T00:00:00'
+        for pk in ('Infinity', '1e400', '0', str(2 ** 63)):
+            token = base64.urlsafe_b64encode(
+                f'["{date}", {pk}, "n"]'.encode()).decode()
+            with self.subTest(pk=pk):
+                self.assertIsNone(pagination.decode_cursor(token))
+                response = self.guest_client.get(
+                    name_reverses['group'], {'cursor': token})
+                self.assertEqual(response.status_code, 200)
+
 
 class FollowViewsTest(TestCase):
     @classmethod
@@ -211,6 +309,18 @@ class FollowViewsTest(TestCase):
         self.assertEqual(follow.author_id, self.author.id)
         self.assertEqual(follow.user_id, self.user.id)
 
+    def test_follower_profile_cache_invalidated(self):
+        """Профиль подписчика показывает новое число подписок."""
+        profile = reverse('posts:profile', kwargs={'username': self.user})
+        self.assertContains(self.author_client.get(profile), 'подписок: 0')
+        follow = reverse('posts:profile_follow',
+                         kwargs={'username': self.author})
+        self.user_client.get(follow)
+        self.assertContains(self.author_client.get(profile), 'подписок: 1')
+        self.user_client.get(reverse('posts:profile_unfollow',
+                                     kwargs={'username': self.author}))
+        self.assertContains(self.author_client.get(profile), 'подписок: 0')
+
     def test_unfollow_on_user(self):
         """Проверка отписки от пользователя."""
         Follow.objects.create(
@@ -258,3 +368,744 @@ class FollowViewsTest(TestCase):
         )
         response = self.user_client.get(name_reverses['follow'])
         self.assertNotIn(post, response.context['page_obj'].object_list)
+
+    def test_feed_entries_follow_subscriptions(self):
+        """Лента подписок пополняется и чистится вместе с подпиской."""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(
+            text='Пост в ленту подписчика',
+            author=self.author
+        )
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.user, post=post).exists())
+
+        Follow.objects.filter(user=self.user, author=self.author).delete()
+        self.assertFalse(FeedEntry.objects.filter(user=self.user).exists())
+
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.user, post=post).exists())
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_celebrity_posts_merged_on_read(self):
+        """Посты популярных авторов подмешиваются при чтении ленты."""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(
+            text='Пост популярного автора',
+            author=self.author
+        )
+        self.assertFalse(FeedEntry.objects.filter(user=self.user).exists())
+        response = self.user_client.get(name_reverses['follow'])
+        self.assertIn(post, response.context['page_obj'].object_list)
+
+    @override_settings(FEED_FANOUT_LIMIT=2)
+    def test_former_celebrity_posts_stay_in_feed(self):
+        """Посты, написанные, пока автор был популярен, не пропадают."""
+        fans = [User.objects.create_user(username=f'fan{number}')
+                for number in range(2)]
+        late = User.objects.create_user(username='late')
+        for user in (self.user, *fans):
+            Follow.objects.create(user=user, author=self.author)
+        post = Post.objects.create(text='Пост знаменитости',
+                                   author=self.author)
+        # Подписался, пока автор был популярен: история не копировалась.
+        Follow.objects.create(user=late, author=self.author)
+        self.assertFalse(FeedEntry.objects.filter(post=post).exists())
+        Follow.objects.filter(user__in=fans).delete()
+
+        late_client = Client()
+        late_client.force_login(late)
+        for client in (self.user_client, late_client):
+            response = client.get(name_reverses['follow'])
+            self.assertIn(post, response.context['page_obj'].object_list)
+
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertFalse(
+            AuthorStats.objects.get(user=self.author).feed_merged)
+        self.assertEqual(
+            set(FeedEntry.objects.filter(post=post).values_list(
+                'user', flat=True)),
+            {self.user.pk, late.pk},
+        )
+
+    @override_settings(FEED_BACKFILL_SIZE=3)
+    def test_backfill_copies_recent_posts_only(self):
+        posts = [
+            Post.objects.create(text=f'Пост {number}', author=self.author)
+            for number in range(5)
+        ]
+        self.user_client.get(reverse('posts:profile_follow',
+                                     kwargs={'username': self.author}))
+        self.assertEqual(
+            set(FeedEntry.objects.filter(user=self.user).values_list(
+                'post', flat=True)),
+            {post.pk for post in posts[-3:]},
+        )
+
+    def test_rebuild_feeds_command(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(
+            text='Пост для пересборки',
+            author=self.author
+        )
+        FeedEntry.objects.all().delete()
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.user, post=post).exists())
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username=name_users[0])
+        cls.user = User.objects.create_user(username=name_users[1])
+        cls.post = Post.objects.create(
+            text='Пост со счётчиками',
+            author=cls.author
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.user_client = Client()
+        self.user_client.force_login(self.user)
+
+    def test_counters_follow_views(self):
+        """Счётчики меняются вместе с подписками и комментариями."""
+        self.user_client.get(
+            reverse('posts:profile_follow', kwargs={'username': self.author})
+        )
+        self.user_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.id}),
+            data={'text': 'Комментарий'}
+        )
+        author_stats = counters.for_user(self.author)
+        self.assertEqual(author_stats.posts_count, 1)
+        self.assertEqual(author_stats.followers_count, 1)
+        self.assertEqual(counters.for_user(self.user).following_count, 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+        self.user_client.get(
+            reverse('posts:profile_unfollow',
+                    kwargs={'username': self.author})
+        )
+        author_stats.refresh_from_db()
+        self.assertEqual(author_stats.followers_count, 0)
+
+    def test_recount_counters_repairs_drift(self):
+        counters.for_user(self.author)
+        AuthorStats.objects.update(posts_count=42)
+        Post.objects.update(comment_count=7)
+        call_command('recount_counters', workers=1, stdout=StringIO())
+        self.assertEqual(counters.for_user(self.author).posts_count, 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+
+    def test_recount_counters_invalidates_pages(self):
+        """Исправленные счётчики сразу видны на закешированных страницах."""
+        counters.for_user(self.author)
+        AuthorStats.objects.filter(user=self.author).update(posts_count=42)
+        Post.objects.update(comment_count=7)
+        profile = reverse('posts:profile', args=[self.author.username])
+        self.assertContains(self.user_client.get(profile), 'Всего постов: 42')
+        out = StringIO()
+        call_command('recount_counters', workers=1, stdout=out)
+        self.assertIn('Исправлено пользователей: 1, постов: 1', out.getvalue())
+        self.assertContains(self.user_client.get(profile), 'Всего постов: 1')
+        generation = page_cache.get_generation(page_cache.POST, self.post.id)
+        call_command('recount_counters', workers=1, stdout=out)
+        self.assertEqual(
+            page_cache.get_generation(page_cache.POST, self.post.id),
+            generation)
+
+
+@override_settings(COMMENTS_PAGE_SIZE=3)
+class CommentsPaginationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username=name_users[0])
+        cls.post = Post.objects.create(
+            text='Пост с комментариями',
+            author=cls.user
+        )
+        for i in range(4):
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f'Комментарий #{i}')
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_first_page_inlined(self):
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}))
+        comments = response.context['comments']
+        self.assertEqual(len(comments.object_list), 3)
+        self.assertEqual(comments[0].text, 'Комментарий #3')
+        self.assertContains(response, 'js-more-comments')
+
+    def test_next_page_fragment(self):
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}))
+        cursor = response.context['comments'].paginator.next_cursor
+        fragment = self.guest_client.get(
+            reverse('posts:post_comments', kwargs={'post_id': self.post.id}),
+            {'cursor': cursor}
+        )
+        self.assertTemplateUsed(fragment, 'posts/includes/comments.html')
+        self.assertNotContains(fragment, '<html')
+        self.assertEqual(
+            [comment.text for comment in fragment.context['comments']],
+            ['Комментарий #0']
+        )
+        self.assertNotContains(fragment, 'js-more-comments')
+
+
+class SyndicationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username=name_users[0])
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug=name_slugs[0],
+            description='Описание группы',
+        )
+        cls.post = Post.objects.create(
+            text='Запись для ленты', author=cls.author, group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_feeds_render(self):
+        urls = {
+            reverse('posts:index_rss'): 'application/rss+xml',
+            reverse('posts:index_atom'): 'application/atom+xml',
+            reverse('posts:group_rss', args=[self.group.slug]):
+                'application/rss+xml',
+            reverse('posts:profile_atom', args=[self.author.username]):
+                'application/atom+xml',
+        }
+        for url, content_type in urls.items():
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertTrue(response['Content-Type'].startswith(
+                    content_type))
+                self.assertContains(response, 'Запись для ленты')
+                self.assertIn('ETag', response)
+                self.assertIn('Last-Modified', response)
+
+    def test_not_modified(self):
+        """Повторный опрос без изменений получает 304 без запросов к БД."""
+        url = reverse('posts:group_rss', args=[self.group.slug])
+        response = self.guest_client.get(url)
+        for headers in (
+            {'HTTP_IF_NONE_MATCH': response['ETag']},
+            {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']},
+        ):
+            with self.subTest(headers=headers), self.assertNumQueries(0):
+                self.assertEqual(
+                    self.guest_client.get(url, **headers).status_code, 304)
+
+    def test_new_post_changes_etag(self):
+        url = reverse('posts:index_rss')
+        etag = self.guest_client.get(url)['ETag']
+        Post.objects.create(text='Свежая запись', author=self.author)
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Свежая запись')
+
+    def test_feed_cached_once_for_all_users(self):
+        """Лента не зависит от пользователя и кешируется одна на всех."""
+        url = reverse('posts:profile_atom', args=[self.author.username])
+        body = self.guest_client.get(url).content
+        reader = Client()
+        reader.force_login(User.objects.create_user(username=name_users[1]))
+        with CaptureQueriesContext(connection) as queries:
+            response = reader.get(url)
+        self.assertEqual(response.content, body)
+        self.assertFalse(any('posts_post' in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_unknown_group(self):
+        response = self.guest_client.get(
+            reverse('posts:group_rss', args=['missing']))
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username=name_users[0])
+        cls.user = User.objects.create_user(username=name_users[1])
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug=name_slugs[0],
+            description='Описание группы',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.author, group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.user_client = Client()
+        self.user_client.force_login(self.user)
+
+    def revalidate(self, client, url, response):
+        return client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_pages_not_modified(self):
+        """Неизменившаяся страница отвечает 304 без рендеринга шаблона."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.pk]),
+            reverse('posts:post_comments', args=[self.post.pk]),
+            reverse('posts:follow_index'),
+        ]
+        # Первый ответ с формой выставляет CSRF-cookie, от неё тоже
+        # зависит валидатор.
+        self.user_client.get(urls[3])
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.user_client.get(url)
+                self.assertIn('ETag', response)
+                revalidated = self.revalidate(
+                    self.user_client, url, response)
+                self.assertEqual(revalidated.status_code, 304)
+                self.assertFalse(revalidated.templates)
+
+    def test_new_comment_changes_post_detail(self):
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        response = self.guest_client.get(url)
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий')
+        self.assertEqual(
+            self.revalidate(self.guest_client, url, response).status_code,
+            200
+        )
+
+    def test_no_last_modified_on_pages(self):
+        """Правка поста не меняет дату новой записи: валидатор — ETag."""
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        response = self.guest_client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        self.post.text = 'Исправленный пост'
+        self.post.save()
+        response = self.guest_client.get(
+            url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertContains(response, 'Исправленный пост')
+
+    def test_author_post_changes_post_detail(self):
+        """На странице поста есть счётчик записей автора."""
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        response = self.guest_client.get(url)
+        Post.objects.create(text='Ещё пост', author=self.author)
+        self.assertEqual(
+            self.revalidate(self.guest_client, url, response).status_code,
+            200
+        )
+
+    def test_validator_depends_on_user(self):
+        url = reverse('posts:group_list', args=[self.group.slug])
+        anonymous = self.guest_client.get(url)
+        self.guest_client.force_login(self.user)
+        self.assertEqual(
+            self.revalidate(self.guest_client, url, anonymous).status_code,
+            200
+        )
+
+    def test_follow_changes_follow_index(self):
+        url = reverse('posts:follow_index')
+        response = self.user_client.get(url)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(
+            self.revalidate(self.user_client, url, response).status_code,
+            200
+        )
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username=name_users[0])
+        cls.user = User.objects.create_user(username=name_users[1])
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug=name_slugs[0],
+            description='Описание группы',
+        )
+        for i in range(settings.PAGE_SIZE + 3):
+            cls.post = Post.objects.create(
+                text=f'Пост #{i}', author=cls.author, group=cls.group)
+        for i in range(3):
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f'Комментарий #{i}')
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.user_client = Client()
+        self.user_client.force_login(self.user)
+
+    def test_post_lists(self):
+        """Списки постов: одна страница и курсор на следующую."""
+        urls = [
+            reverse('posts:api_posts'),
+            reverse('posts:api_group_posts', args=[self.group.slug]),
+            reverse('posts:api_profile_posts', args=[self.author.username]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                data = self.guest_client.get(url).json()
+                self.assertEqual(len(data['results']), settings.PAGE_SIZE)
+                self.assertEqual(data['results'][0]['text'], self.post.text)
+                self.assertEqual(data['results'][0]['group'], 'test_group')
+                rest = self.guest_client.get(data['next']).json()
+                self.assertEqual(len(rest['results']), 3)
+                self.assertIsNone(rest['next'])
+
+    def test_sparse_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.guest_client.get(
+                reverse('posts:api_posts'), {'fields': 'id,text'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'text'})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('auth_user', queries[0]['sql'])
+        self.assertNotIn('"image"', queries[0]['sql'])
+        response = self.guest_client.get(
+            reverse('posts:api_posts'), {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_fixed_number_of_queries(self):
+        """Число запросов не зависит от размера страницы."""
+        cases = [
+            (self.guest_client, reverse('posts:api_posts'), 1),
+            (self.guest_client,
+             reverse('posts:api_post', args=[self.post.pk]), 2),
+            (self.user_client, reverse('posts:api_follow'), 3),
+        ]
+        for client, url, queries in cases:
+            for limit in (1, 20):
+                with self.subTest(url=url, limit=limit), \
+                        self.assertNumQueries(queries):
+                    client.get(url, {'limit': limit})
+
+    def test_post_detail_with_comments(self):
+        data = self.guest_client.get(
+            reverse('posts:api_post', args=[self.post.pk])).json()
+        self.assertEqual(data['id'], self.post.pk)
+        self.assertEqual(data['comment_count'], 3)
+        self.assertEqual(
+            [comment['text'] for comment in data['comments']],
+            ['Комментарий #2', 'Комментарий #1', 'Комментарий #0']
+        )
+
+    def test_follow_feed(self):
+        response = self.guest_client.get(reverse('posts:api_follow'))
+        self.assertEqual(response.status_code, 401)
+        data = self.user_client.get(
+            reverse('posts:api_follow'), {'fields': 'id,author'}).json()
+        self.assertEqual(data['results'][0],
+                         {'id': self.post.pk, 'author': name_users[0]})
+
+    def test_groups_and_profile(self):
+        groups = self.guest_client.get(reverse('posts:api_groups')).json()
+        self.assertEqual(groups['results'][0]['slug'], self.group.slug)
+        group = self.guest_client.get(
+            reverse('posts:api_group', args=[self.group.slug])).json()
+        self.assertEqual(group['title'], self.group.title)
+        profile = self.guest_client.get(
+            reverse('posts:api_profile', args=[self.author.username])).json()
+        self.assertEqual(profile['posts_count'], settings.PAGE_SIZE + 3)
+        self.assertEqual(profile['followers_count'], 1)
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username=name_users[0])
+        cls.post_rare = Post.objects.create(
+            text='Граф прибыл на бал в карете', author=cls.author)
+        cls.post_often = Post.objects.create(
+            text='Граф, граф и снова граф', author=cls.author)
+        Post.objects.create(text='Совсем другая запись', author=cls.author)
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def search(self, query, **params):
+        response = self.guest_client.get(
+            reverse('posts:post_search'), {'q': query, **params})
+        return [post.id for post in response.context['page_obj']]
+
+    def test_ranked_results(self):
+        """Пост, где слово встречается чаще, выше в выдаче."""
+        self.assertEqual(
+            self.search('граф'), [self.post_often.id, self.post_rare.id])
+
+    def test_prefix_and_all_words(self):
+        self.assertEqual(self.search('карет'), [self.post_rare.id])
+        self.assertEqual(self.search('граф бал'), [self.post_rare.id])
+        self.assertEqual(self.search('"граф" OR NEAR('), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_index_follows_changes(self):
+        """Триггеры обновляют индекс и при update() в обход сигналов."""
+        Post.objects.filter(pk=self.post_rare.pk).update(text='Маскарад')
+        Post.objects.filter(pk=self.post_often.pk).delete()
+        self.assertEqual(self.search('граф'), [])
+        self.assertEqual(self.search('маскарад'), [self.post_rare.id])
+
+    def test_pagination_keeps_query(self):
+        Post.objects.bulk_create(
+            Post(text=f'Граф #{i}', author=self.author)
+            for i in range(settings.PAGE_SIZE)
+        )
+        response = self.guest_client.get(
+            reverse('posts:post_search'), {'q': 'граф'})
+        self.assertContains(response, '?q=%D0%B3%D1%80%D0%B0%D1%84&amp;page=2')
+        self.assertEqual(len(self.search('граф', page=2)), 2)
+
+    def test_reindex_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO posts_post_fts(posts_post_fts) "
+                           "VALUES ('delete-all')")
+        self.assertEqual(self.search('карет'), [])
+        call_command('reindex_posts', stdout=StringIO())
+        self.assertEqual(self.search('карет'), [self.post_rare.id])
+
+    def test_admin_uses_index(self):
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        self.guest_client.force_login(admin)
+        response = self.guest_client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'карет'})
+        self.assertEqual(
+            [post.id for post in response.context['cl'].result_list],
+            [self.post_rare.id]
+        )
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        routers.state.wrote = False
+        routers.state.pinned = 0
+        self.router = routers.PrimaryReplicaRouter()
+        # TestCase держит транзакцию, а в ней чтения всегда идут в default.
+        patcher = mock.patch.object(connection, 'in_atomic_block', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_go_to_replica_unless_pinned(self):
+        self.assertEqual(self.router.db_for_read(Post), 'replica1')
+        self.assertEqual(self.router.db_for_read(Session), 'default')
+        with routers.primary():
+            self.assertEqual(self.router.db_for_read(Post), 'default')
+        self.assertEqual(self.router.db_for_write(Post), 'default')
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_sticky_after_write(self):
+        def writing_view(request):
+            self.router.db_for_write(Comment)
+            return HttpResponse()
+
+        def reading_view(request):
+            return HttpResponse(self.router.db_for_read(Post))
+
+        def session_view(request):
+            self.router.db_for_write(Session)
+            return HttpResponse()
+
+        factory = RequestFactory()
+        response = routers.StickyPrimaryMiddleware(session_view)(
+            factory.post('/'))
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+        # Подписка пишет по GET и тоже закрепляет основную базу.
+        response = routers.StickyPrimaryMiddleware(writing_view)(
+            factory.get('/'))
+        cookie = response.cookies[routers.STICKY_COOKIE].value
+
+        read = routers.StickyPrimaryMiddleware(reading_view)
+        self.assertEqual(read(factory.get('/')).content, b'replica1')
+        factory.cookies[routers.STICKY_COOKIE] = cookie
+        self.assertEqual(read(factory.get('/')).content, b'default')
+
+    def replica_page(self, **headers):
+        """Главная, прочитанная с «реплики»: она подменена на default."""
+        with mock.patch.object(routers.random, 'choice',
+                               return_value='default') as choice:
+            response = self.client.get(reverse('posts:index'), **headers)
+        response.replica_reads = choice.call_count
+        return response
+
+    def test_pages_render_from_replica(self):
+        cache.clear()
+        response = self.replica_page()
+        self.assertTrue(response.replica_reads)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertEqual(
+            self.replica_page(HTTP_IF_NONE_MATCH=response['ETag']
+                              ).status_code, 304)
+
+    def test_page_after_change_is_provisional(self):
+        """Реплика может не знать о свежем изменении: без ETag, ненадолго."""
+        cache.clear()
+        page_cache.mark_changed(page_cache.GLOBAL)
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            response = self.replica_page()
+        self.assertTrue(response.replica_reads)
+        self.assertFalse(response.has_header('ETag'))
+        timeouts = [call[0][2] for call in cache_set.call_args_list
+                    if call[0][0].startswith('page:')]
+        self.assertEqual(len(timeouts), 1)
+        self.assertLessEqual(timeouts[0], settings.REPLICA_STICKY_SECONDS)
+        # Из кеша временная страница тоже уходит без ETag.
+        self.assertFalse(self.replica_page().has_header('ETag'))
+        # Автор изменения читает из основной базы: страница постоянная.
+        self.client.cookies[routers.STICKY_COOKIE] = str(time.time() + 60)
+        self.assertTrue(self.client.get(
+            reverse('posts:index'), {'page': 1}).has_header('ETag'))
+
+    def test_sync_replica_copy(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, 'primary.sqlite3')
+        target = os.path.join(directory, 'replica.sqlite3')
+        db = sqlite3.connect(source)
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('CREATE TABLE item (name TEXT)')
+        db.execute("INSERT INTO item VALUES ('пост')")
+        db.commit()
+        sync_replica.copy(source, target, pages=1)
+        db.close()
+        replica = sqlite3.connect(target)
+        self.assertEqual(
+            replica.execute('SELECT name FROM item').fetchall(), [('пост',)])
+        self.assertEqual(
+            replica.execute('PRAGMA journal_mode').fetchone(), ('delete',))
+        replica.close()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, QUERY_BUDGET_STRICT=True)
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username=name_users[0])
+        cls.user = User.objects.create_user(username=name_users[1])
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug=name_slugs[0],
+            description='Описание группы',
+        )
+        for i in range(settings.PAGE_SIZE + 1):
+            cls.post = Post.objects.create(
+                text=f'Тестовые посты #{i}',
+                author=cls.author,
+                group=cls.group
+            )
+        for i in range(5):
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f'Комментарий #{i}')
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.user_client = Client()
+        self.user_client.force_login(self.user)
+
+    def test_every_view_has_budget(self):
+        for pattern in urlpatterns:
+            with self.subTest(view=pattern.name):
+                self.assertTrue(hasattr(pattern.callback, 'query_budget'))
+
+    def test_views_within_budget(self):
+        """Ни одна страница не превышает свой бюджет SQL-запросов."""
+        post_args = {'post_id': self.post.id}
+        author_args = {'username': self.author.username}
+        requests = [
+            [self.user_client, 'get', 'posts:index', {}],
+            [self.user_client, 'get', 'posts:group_list',
+             {'slug': self.group.slug}],
+            [self.user_client, 'get', 'posts:profile', author_args],
+            [self.user_client, 'get', 'posts:post_detail', post_args],
+            [self.user_client, 'get', 'posts:post_comments', post_args],
+            [self.user_client, 'get', 'posts:post_create', {}],
+            [self.user_client, 'post', 'posts:post_create', {}],
+            [self.author_client, 'get', 'posts:post_edit', post_args],
+            [self.author_client, 'post', 'posts:post_edit', post_args],
+            [self.user_client, 'post', 'posts:add_comment', post_args],
+            [self.user_client, 'get', 'posts:follow_index', {}],
+            [self.user_client, 'get', 'posts:post_search', {}],
+            [self.user_client, 'get', 'posts:index_rss', {}],
+            [self.user_client, 'get', 'posts:group_atom',
+             {'slug': self.group.slug}],
+            [self.user_client, 'get', 'posts:profile_rss', author_args],
+            [self.user_client, 'get', 'posts:export', {}],
+            [self.user_client, 'get', 'posts:profile_unfollow', author_args],
+            [self.user_client, 'get', 'posts:profile_follow', author_args],
+        ]
+        data = {
+            'text': 'Текст для проверки бюджета',
+            'group': self.group.id,
+            'q': 'тестовые посты',
+        }
+        for client, method, name, kwargs in requests:
+            url = reverse(name, kwargs=kwargs)
+            with self.subTest(method=method, url=url):
+                response = getattr(client, method)(url, data)
+                self.assertIn(response.status_code, (200, 302))
+
+    def test_cold_cache_within_budget(self):
+        """Бюджет учитывает и вычисление свежести при пустом кеше."""
+        post_args = {'post_id': self.post.id}
+        for name, kwargs in (('posts:post_detail', post_args),
+                             ('posts:post_comments', post_args),
+                             ('posts:group_list', {'slug': self.group.slug}),
+                             ('posts:profile_atom',
+                              {'username': self.author.username})):
+            url = reverse(name, kwargs=kwargs)
+            with self.subTest(url=url):
+                cache.clear()
+                response = self.user_client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_budget_exceeded_raises(self):
+        view = query_budget(0)(lambda request: list(Post.objects.all()))
+        with self.assertRaises(QueryBudgetExceeded):
+            view(RequestFactory().get('/'))
+
+    def test_replica_queries_counted(self):
+        """Запросы к реплике тоже входят в бюджет."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        connections.databases['replica1'] = {
+            **connections.databases['default'],
+            'NAME': os.path.join(directory, 'replica.sqlite3'),
+        }
+        self.addCleanup(self.remove_alias, 'replica1')
+
+        @query_budget(0)
+        def view(request):
+            with connections['replica1'].cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return HttpResponse()
+
+        with self.assertRaises(QueryBudgetExceeded):
+            view(RequestFactory().get('/'))
+
+    def remove_alias(self, alias):
+        connections[alias].close()
+        del connections.databases[alias]
+        delattr(connections._connections, alias)
@@ -0,0 +1,54 @@
+"""Генерация миниатюр картинок постов вне обработки запроса.
+
+Размеры берутся из ``settings.THUMBNAIL_PRESETS`` и должны совпадать
+с параметрами тега ``{% thumbnail %}`` в шаблонах: тогда шаблон находит
+готовую миниатюру в key-value хранилище sorl-thumbnail.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from sorl.thumbnail import get_thumbnail
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def warm(name):
+    """Создаёт миниатюры всех размеров для файла картинки."""
+    for geometry, options in settings.THUMBNAIL_PRESETS:
+        get_thumbnail(name, geometry, **options)
+
+
+def warm_in_background(name):
+    try:
+        warm(name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+    finally:
+        connection.close()
+
+
+def schedule(post):
+    """Ставит генерацию миниатюр поста в пул после коммита транзакции."""
+    if not post.image:
+        return
+    name = post.image.name
+    if settings.THUMBNAIL_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(warm_in_background, name)
+        )
+    else:
+        transaction.on_commit(lambda: warm(name))
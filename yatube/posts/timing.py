@@ -0,0 +1,197 @@
+"""Server-Timing: куда уходит время запроса.
+
+Для выбранной доли запросов (``SERVER_TIMING_SAMPLE_RATE``) middleware
+считает SQL-запросы и их время, рендеринг шаблонов, чтения из кеша с
+попаданиями и промахами и обращения к sorl-thumbnail с числом
+созданных миниатюр. Итог уходит в заголовок ``Server-Timing`` (виден
+во вкладке Network браузера) и одной JSON-строкой в лог ``posts.timing``.
+
+Шаблоны, кеш и sorl-thumbnail оборачиваются один раз при создании
+middleware. В запросах вне выборки обёртка только проверяет
+thread-local и сразу вызывает оригинал. Вложенные вызовы (шаблон
+карточки внутри страницы, ``get`` внутри ``get_many``) не считаются
+повторно: время учитывается по самому внешнему вызову.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template.backends.django import Template
+from sorl.thumbnail.base import ThumbnailBackend
+
+logger = logging.getLogger(__name__)
+
+state = threading.local()
+# Уже обёрнутые классы: бэкенд кеша может смениться вместе с CACHES.
+_instrumented = set()
+
+
+class Metrics:
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, metric, seconds):
+        self.durations[metric] += seconds
+        self.counts[metric] += 1
+
+    def ms(self, metric):
+        return round(self.durations[metric] * 1000, 3)
+
+    def as_dict(self):
+        return {
+            'sql_count': self.counts['sql'],
+            'sql_ms': self.ms('sql'),
+            'template_count': self.counts['template'],
+            'template_ms': self.ms('template'),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_ms': self.ms('cache'),
+            'thumbnail_count': self.counts['thumbnail'],
+            'thumbnail_created': self.counts['thumbnail_created'],
+            'thumbnail_ms': self.ms('thumbnail'),
+        }
+
+
+def current():
+    return getattr(state, 'metrics', None)
+
+
+def patch(owner, name, metric, outcome=None, prepare=None):
+    """Заменяет метод так, чтобы его время попадало в метрику запроса."""
+    original = getattr(owner, name)
+
+    @wraps(original)
+    def wrapper(*args, **kwargs):
+        if prepare:
+            args, kwargs = prepare(args, kwargs)
+        metrics = current()
+        if metrics is None or metric in state.active:
+            return original(*args, **kwargs)
+        state.active.add(metric)
+        start = time.perf_counter()
+        try:
+            result = original(*args, **kwargs)
+        finally:
+            metrics.add(metric, time.perf_counter() - start)
+            state.active.discard(metric)
+        if outcome:
+            outcome(metrics, args, kwargs, result)
+        return result
+
+    setattr(owner, name, wrapper)
+
+
+def get_outcome(args, kwargs, result):
+    """(попадания, промахи) вызова ``cache.get``."""
+    default = kwargs.get('default', args[2] if len(args) > 2 else None)
+    return (0, 1) if result is default else (1, 0)
+
+
+def list_keys(args, kwargs):
+    """Ключи ``get_many`` списком: генератор исчерпает сам вызов."""
+    if 'keys' in kwargs:
+        return args, {**kwargs, 'keys': list(kwargs['keys'])}
+    if len(args) > 1:
+        return (args[0], list(args[1]), *args[2:]), kwargs
+    return args, kwargs
+
+
+def get_many_outcome(args, kwargs, result):
+    keys = kwargs.get('keys', args[1] if len(args) > 1 else ())
+    return len(result), len(keys) - len(result)
+
+
+def cache_get(metrics, args, kwargs, result):
+    hits, misses = get_outcome(args, kwargs, result)
+    metrics.cache_hits += hits
+    metrics.cache_misses += misses
+
+
+def cache_get_many(metrics, args, kwargs, result):
+    hits, misses = get_many_outcome(args, kwargs, result)
+    metrics.cache_hits += hits
+    metrics.cache_misses += misses
+
+
+def instrument():
+    if Template not in _instrumented:
+        _instrumented.update((Template, ThumbnailBackend))
+        patch(Template, 'render', 'template')
+        patch(ThumbnailBackend, 'get_thumbnail', 'thumbnail')
+        patch(ThumbnailBackend, '_create_thumbnail', 'thumbnail_created')
+    for backend in {type(caches[alias]) for alias in settings.CACHES}:
+        if backend not in _instrumented:
+            _instrumented.add(backend)
+            patch(backend, 'get', 'cache', cache_get)
+            patch(backend, 'get_many', 'cache', cache_get_many, list_keys)
+
+
+class SqlTimer:
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.metrics.add('sql', time.perf_counter() - start)
+
+
+def server_timing(metrics, total):
+    """Значение заголовка Server-Timing, длительности в миллисекундах."""
+    return ', '.join([
+        f'total;dur={total:.1f}',
+        'sql;dur={:.1f};desc="{} queries"'.format(
+            metrics.ms('sql'), metrics.counts['sql']),
+        'tpl;dur={:.1f};desc="{} renders"'.format(
+            metrics.ms('template'), metrics.counts['template']),
+        'cache;dur={:.1f};desc="{} hits / {} misses"'.format(
+            metrics.ms('cache'), metrics.cache_hits, metrics.cache_misses),
+        'thumb;dur={:.1f};desc="{} lookups / {} generated"'.format(
+            metrics.ms('thumbnail'), metrics.counts['thumbnail'],
+            metrics.counts['thumbnail_created']),
+    ])
+
+
+class ServerTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument()
+
+    def __call__(self, request):
+        if random.random() >= settings.SERVER_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+        metrics = state.metrics = Metrics()
+        state.active = set()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(SqlTimer(metrics))
+                    )
+                response = self.get_response(request)
+        finally:
+            state.metrics = None
+        total = (time.perf_counter() - start) * 1000
+        response['Server-Timing'] = server_timing(metrics, total)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total, 3),
+            **metrics.as_dict(),
+        }))
+        return response
@@ -1,12 +1,26 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 
 app_name = 'posts'
 urlpatterns = [
     path('', views.index, name='index'),
     path('group/<slug>/', views.group_posts, name="group_list"),
+    # RSS и Atom
+    path('feed/rss/', views.index_feed, {'kind': 'rss'}, name='index_rss'),
+    path('feed/atom/', views.index_feed, {'kind': 'atom'},
+         name='index_atom'),
+    path('group/<slug>/rss/', views.group_feed, {'kind': 'rss'},
+         name='group_rss'),
+    path('group/<slug>/atom/', views.group_feed, {'kind': 'atom'},
+         name='group_atom'),
+    path('profile/<username>/rss/', views.profile_feed, {'kind': 'rss'},
+         name='profile_rss'),
+    path('profile/<username>/atom/', views.profile_feed, {'kind': 'atom'},
+         name='profile_atom'),
+    # Поиск
+    path('search/', views.post_search, name='post_search'),
     # Профайл пользователя
     path('profile/<username>/', views.profile, name='profile'),
     # Просмотр записи
@@ -17,10 +31,25 @@ urlpatterns = [
     path('posts/<post_id>/edit/', views.post_edit, name='post_edit'),
     # Комментария
     path('posts/<post_id>/comment/', views.add_comment, name='add_comment'),
+    path('posts/<post_id>/comments/',
+         views.post_comments, name='post_comments'),
     # Подписки
     path('follow/', views.follow_index, name='follow_index'),
     path('profile/<username>/follow/',
          views.profile_follow, name='profile_follow'),
     path('profile/<username>/unfollow/',
          views.profile_unfollow, name='profile_unfollow'),
+    # JSON API только для чтения
+    path('api/posts/', api.posts, name='api_posts'),
+    path('api/posts/<int:post_id>/', api.post_detail, name='api_post'),
+    path('api/groups/', api.groups, name='api_groups'),
+    path('api/groups/<slug>/', api.group_detail, name='api_group'),
+    path('api/groups/<slug>/posts/', api.group_posts,
+         name='api_group_posts'),
+    path('api/profiles/<username>/', api.profile, name='api_profile'),
+    path('api/profiles/<username>/posts/', api.profile_posts,
+         name='api_profile_posts'),
+    path('api/follow/', api.follow_posts, name='api_follow'),
+    # Выгрузка данных для персонала
+    path('export/', views.export_posts, name='export'),
 ]
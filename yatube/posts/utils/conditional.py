@@ -0,0 +1,115 @@
+"""Условные запросы (ETag/Last-Modified) для страниц и лент.
+
+ETag строится из поколений областей, от которых зависит страница,
+и из состояния пользователя: id и CSRF-cookie, так что вход, выход
+и смена токена формы меняют валидатор. Дата самой новой записи
+области для Last-Modified лент вычисляется один раз на поколение и
+хранится в кеше, поэтому проверка свежести обычно не обращается к
+базе.
+
+Временные ответы, прочитанные с реплики сразу после изменения
+(см. page_cache), уходят без валидаторов.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.views.decorators import http
+
+from posts.models import Post
+from . import page_cache
+
+
+def newest_post(queryset):
+    return queryset.aggregate(newest=Max('pub_date'))['newest']
+
+
+def newest_in_post(post_id):
+    """Дата публикации поста или его последнего комментария."""
+    dates = Post.objects.filter(pk=post_id).aggregate(
+        published=Max('pub_date'), commented=Max('comments__created')
+    )
+    return max(filter(None, dates.values()), default=None)
+
+
+NEWEST = {
+    page_cache.GLOBAL: lambda ident: newest_post(Post.objects.all()),
+    page_cache.GROUP: lambda ident: newest_post(
+        Post.objects.filter(group__slug=ident)
+    ),
+    page_cache.AUTHOR: lambda ident: newest_post(
+        Post.objects.filter(author__username=ident)
+    ),
+    page_cache.POST: newest_in_post,
+}
+
+
+def tag(scope, ident=''):
+    """Хеш текущего поколения области."""
+    generation = page_cache.get_generation(scope, ident)
+    return hashlib.md5(f'{scope}:{ident}:{generation}'.encode()).hexdigest()
+
+
+def newest(scope, ident=''):
+    """Дата самой новой записи области, вычисляется раз на поколение."""
+    generation = page_cache.get_generation(scope, ident)
+    key = f'newest:{scope}:{ident}:{generation}'
+    # Пустая область хранится как 0, чтобы отличать её от промаха кеша.
+    value = cache.get(key)
+    if value is None:
+        # Дата с отстающей реплики хранится, только пока она отстаёт.
+        remaining = page_cache.settling(scope, ident)
+        value = NEWEST[scope](ident) or 0
+        cache.set(key, value, remaining or settings.PAGE_CACHE_TIMEOUT)
+    return value or None
+
+
+def condition(etag_func=None, last_modified_func=None):
+    """``django.views.decorators.http.condition`` для кешируемых страниц.
+
+    У временного ответа (``response.provisional``) ETag и Last-Modified
+    убираются: они описывают поколение, которого в ответе может ещё не
+    быть.
+    """
+    def decorator(view):
+        conditional = http.condition(etag_func, last_modified_func)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            if getattr(response, 'provisional', False):
+                for header in ('ETag', 'Last-Modified'):
+                    if response.has_header(header):
+                        del response[header]
+            return response
+        return wrapper
+    return decorator
+
+
+def user_state(request):
+    if not request.user.is_authenticated:
+        return 'anonymous'
+    return '{}:{}'.format(request.user.pk, request.META.get('CSRF_COOKIE'))
+
+
+def revalidate(scopes):
+    """condition() для HTML-вью.
+
+    ``scopes(request, **kwargs)`` возвращает пары (область, идентификатор),
+    от поколений которых зависит страница; ``None`` — страницы нет, и
+    вью отвечает как обычно. Last-Modified не отдаётся: дата новой
+    записи не меняется при правке поста, смене счётчиков или входе
+    пользователя, и клиент, приславший только If-Modified-Since, получил
+    бы 304 на устаревшую страницу.
+    """
+    def etag(request, *args, **kwargs):
+        pairs = scopes(request, **kwargs)
+        if pairs is None:
+            return None
+        parts = [tag(scope, ident) for scope, ident in pairs]
+        parts.append(user_state(request))
+        return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    return condition(etag_func=etag)
@@ -0,0 +1,126 @@
+"""Кеш страниц с инвалидацией по поколениям.
+
+У каждой области (вся лента, группа, автор, пост) есть счётчик
+поколения. Сигналы увеличивают его при изменении данных, а ключ
+закешированной страницы включает текущее поколение, поэтому страница
+живёт долго, но перестаёт отдаваться сразу после изменения.
+
+Страницы рендерятся с реплик. Реплика может отставать от основной базы
+на ``REPLICA_STICKY_SECONDS`` (на этом допущении держится и
+read-your-writes в posts.routers), поэтому страница, отрисованная в это
+время после изменения области, временная: она живёт в кеше только до
+конца этого окна и уходит без ETag и Last-Modified, чтобы клиент не
+получал 304 на устаревшую копию. Автор изменения читает из основной
+базы, и его страницы сразу постоянные.
+"""
+import hashlib
+import time
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+from posts.routers import is_pinned
+
+GLOBAL = 'global'
+GROUP = 'group'
+AUTHOR = 'author'
+POST = 'post'
+# Подписки пользователя: меняется при подписке и отписке.
+FOLLOWER = 'follower'
+
+
+def generation_key(scope, ident=''):
+    return f'generation:{scope}:{ident}'
+
+
+def get_generation(scope, ident=''):
+    key = generation_key(scope, ident)
+    generation = cache.get(key)
+    if generation is None:
+        # Начальное значение от времени, а не 1: если счётчик вытеснят
+        # из кеша, старые страницы не совпадут с новым поколением.
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def changed_key(scope, ident=''):
+    return f'changed:{scope}:{ident}'
+
+
+def mark_changed(scope, ident=''):
+    """Время изменения области: метка живёт, пока реплики могут отставать."""
+    cache.set(changed_key(scope, ident), time.time(),
+              settings.REPLICA_STICKY_SECONDS)
+
+
+def bump(scope, ident=''):
+    key = generation_key(scope, ident)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+    if settings.DATABASE_REPLICAS:
+        # Отставание реплики отсчитывается от коммита, а не от записи.
+        transaction.on_commit(partial(mark_changed, scope, ident))
+
+
+def settling(scope, ident=''):
+    """Секунды, пока чтения запроса могут не видеть изменение области.
+
+    0 — данные запроса не старше поколения: реплик нет, запрос читает
+    из основной базы или последнее изменение реплики уже получили.
+    """
+    if not settings.DATABASE_REPLICAS or is_pinned():
+        return 0
+    changed = cache.get(changed_key(scope, ident))
+    if changed is None:
+        return 0
+    return max(changed + settings.REPLICA_STICKY_SECONDS - time.time(), 0)
+
+
+def cache_page_by_generation(scope, kwarg=None, timeout=None,
+                             per_user=True):
+    """Кеширует GET-ответы вью до смены поколения области ``scope``.
+
+    ``kwarg`` — имя аргумента вью, который определяет область,
+    например ``slug`` для группы. Ответы залогиненных пользователей
+    кешируются отдельно для каждого пользователя, если ``per_user``
+    не выключен для вью, чей ответ от пользователя не зависит.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            ident = kwargs.get(kwarg, '') if kwarg else ''
+            path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            key = 'page:{}:{}:{}:{}'.format(
+                view.__name__,
+                request.user.pk if per_user and request.user.pk
+                else 'anonymous',
+                get_generation(scope, ident),
+                path,
+            )
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type, provisional = cached
+                response = HttpResponse(content, content_type=content_type)
+                response.provisional = provisional
+                return response
+            remaining = settling(scope, ident)
+            response = view(request, *args, **kwargs)
+            response.provisional = bool(remaining)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(
+                    key,
+                    (response.content, response['Content-Type'],
+                     response.provisional),
+                    remaining or timeout or settings.PAGE_CACHE_TIMEOUT,
+                )
+            return response
+        return wrapper
+    return decorator
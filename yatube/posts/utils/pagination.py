@@ -1,9 +1,178 @@
+import base64
+import binascii
+import heapq
+import json
+from collections import namedtuple
+
 from django.conf import settings
 from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+FORWARD = 'n'
+BACKWARD = 'p'
+# Первичный ключ в курсоре: положительный и помещается в BIGINT.
+MAX_PK = 2 ** 63 - 1
+
+# Источник записей для курсорной ленты: queryset, поля ключа
+# (дата, уникальный id записи) и преобразование строки в запись ленты.
+CursorSource = namedtuple('CursorSource', 'queryset key transform')
+CursorSource.__new__.__defaults__ = (('pub_date', 'id'), None)
+
+
+def encode_cursor(date, pk, direction=FORWARD):
+    """Упаковывает позицию в ленте в непрозрачный токен для ?cursor=."""
+    raw = json.dumps([date.isoformat(), pk, direction])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает (pub_date, pk, direction) или None для битого токена."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        pub_date, pk, direction = json.loads(
+            base64.urlsafe_b64decode(padded.encode())
+        )
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError,
+            OverflowError):
+        return None
+    if (pub_date is None or direction not in (FORWARD, BACKWARD)
+            or not 1 <= pk <= MAX_PK):
+        return None
+    return pub_date, pk, direction
+
+
+def seek(source, position, limit):
+    """Не более limit записей источника после позиции в ленте."""
+    date_field, id_field = source.key
+    queryset = source.queryset
+    direction = position[2] if position else FORWARD
+    if direction == FORWARD:
+        ordering, lookup = (f'-{date_field}', f'-{id_field}'), 'lt'
+    else:
+        ordering, lookup = (date_field, id_field), 'gt'
+    queryset = queryset.order_by(*ordering)
+    if position:
+        pub_date, pk, _ = position
+        queryset = queryset.filter(
+            Q(**{f'{date_field}__{lookup}': pub_date})
+            | Q(**{date_field: pub_date, f'{id_field}__{lookup}': pk})
+        )
+    rows = queryset[:limit]
+    if source.transform:
+        return [source.transform(row) for row in rows]
+    return list(rows)
+
+
+class CursorPaginator(Paginator):
+    """Постраничный вывод по ключу (дата, id) без OFFSET и COUNT(*).
 
+    Записи могут собираться из нескольких источников, каждый из них
+    читается одним диапазонным запросом, а результаты сливаются.
+    Номер страницы условный: он нужен только для того, чтобы
+    ``Page.has_next()`` и ``Page.has_previous()`` работали как обычно.
+    Ссылки на соседние страницы строятся по ``next_cursor`` и
+    ``previous_cursor``.
+    """
+    is_cursor = True
 
-def pagination(request, objects):
-    paginator = Paginator(objects, settings.PAGE_SIZE)
+    def __init__(self, object_list, per_page, cursor=None, sources=None):
+        self.sources = sources or [CursorSource(object_list)]
+        self.date_field = self.sources[0].key[0]
+        super().__init__(
+            self.sources[0].queryset.order_by(
+                *(f'-{field}' for field in self.sources[0].key)
+            ),
+            per_page,
+        )
+        self.position = decode_cursor(cursor) if cursor else None
+        self.next_cursor = None
+        self.previous_cursor = None
+
+    def merge(self, limit):
+        forward = self.position is None or self.position[2] == FORWARD
+        streams = [seek(source, self.position, limit)
+                   for source in self.sources]
+        if len(streams) == 1:
+            return streams[0]
+        merged = heapq.merge(
+            *streams,
+            key=lambda row: (getattr(row, self.date_field), row.pk),
+            reverse=forward,
+        )
+        rows, seen = [], set()
+        for row in merged:
+            if row.pk not in seen:
+                seen.add(row.pk)
+                rows.append(row)
+            if len(rows) == limit:
+                break
+        return rows
+
+    @cached_property
+    def window(self):
+        """Записи страницы, её условный номер и число страниц."""
+        rows = self.merge(self.per_page + 1)
+        extra = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if self.position is None:
+            has_previous, has_next = False, extra
+        elif self.position[2] == FORWARD:
+            has_previous, has_next = True, extra
+        else:
+            has_previous, has_next = extra, True
+            rows = rows[::-1]
+        if rows and has_next:
+            last = rows[-1]
+            self.next_cursor = encode_cursor(
+                getattr(last, self.date_field), last.pk, FORWARD
+            )
+        if rows and has_previous:
+            first = rows[0]
+            self.previous_cursor = encode_cursor(
+                getattr(first, self.date_field), first.pk, BACKWARD
+            )
+        number = 2 if has_previous else 1
+        return rows, number, number + 1 if has_next else number
+
+    @cached_property
+    def num_pages(self):
+        return self.window[2]
+
+    @cached_property
+    def count(self):
+        return len(self.window[0])
+
+    def get_page(self, number=None):
+        rows, number, _ = self.window
+        return self._get_page(rows, number, self)
+
+
+def pagination(request, objects, sources=None):
+    """Страница ленты: по курсору, либо по номеру для старых ссылок.
+
+    ``sources`` позволяет собрать курсорную ленту из нескольких
+    источников, ``objects`` тогда используется только для ?page=N.
+    """
     page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return page
+    if page_number is not None and 'cursor' not in request.GET:
+        paginator = Paginator(objects, settings.PAGE_SIZE)
+        return paginator.get_page(page_number)
+    paginator = CursorPaginator(
+        objects, settings.PAGE_SIZE, request.GET.get('cursor'), sources
+    )
+    return paginator.get_page()
+
+
+def comment_pagination(request, comments):
+    """Страница комментариев по курсору на (created, id)."""
+    paginator = CursorPaginator(
+        comments,
+        settings.COMMENTS_PAGE_SIZE,
+        request.GET.get('cursor'),
+        [CursorSource(comments, ('created', 'id'))],
+    )
+    return paginator.get_page()
@@ -0,0 +1,70 @@
+"""Бюджет SQL-запросов на вью.
+
+Декоратор считает запросы, выполненные за время работы вью (включая
+рендеринг шаблона). При превышении бюджета в режиме отладки и в тестах
+бросается исключение, в продакшене пишется предупреждение в лог
+вместе с текстами запросов. Служебные запросы sorl-thumbnail к своему
+key-value хранилищу не считаются: их число зависит от прогрева
+миниатюр, а не от кода вью.
+"""
+import logging
+from contextlib import ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+IGNORED_TABLES = ('thumbnail_kvstore',)
+TRANSACTION_CONTROL = (
+    'BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO',
+)
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not (sql.startswith(TRANSACTION_CONTROL)
+                or any(table in sql for table in IGNORED_TABLES)):
+            self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+def query_budget(limit):
+    """Ограничивает число SQL-запросов, которые может сделать вью."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            recorder = QueryRecorder()
+            # Все базы: чтения вью могут уйти на реплику.
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = view(request, *args, **kwargs)
+            if len(recorder.queries) > limit:
+                report(view, request, limit, recorder.queries)
+            return response
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
+
+
+def report(view, request, limit, queries):
+    message = '{} ({}): {} SQL-запросов при бюджете {}'.format(
+        view.__name__, request.path, len(queries), limit
+    )
+    if settings.QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(
+            '\n'.join([message, *queries])
+        )
+    logger.warning(
+        message, extra={'queries': queries[limit:], 'path': request.path}
+    )
@@ -0,0 +1,115 @@
+"""Настройка соединений SQLite для конкурентной записи.
+
+При открытии соединения выполняются PRAGMA из ``settings.SQLITE_PRAGMAS``:
+WAL разрешает читать во время записи, ``busy_timeout`` заставляет ждать
+блокировку вместо немедленной ошибки «database is locked», а ``mmap_size``
+и ``cache_size`` сокращают число системных вызовов при чтении.
+
+Django открывает транзакции как ``BEGIN DEFERRED``: писатель, успевший
+прочитать старый снимок, получает SQLITE_BUSY без всякого ожидания.
+Поэтому записи выполняются через ``atomic_write``, которая повторяет
+транзакцию целиком.
+"""
+import os
+import random
+import sqlite3
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
+
+BUSY_ERRORS = (OperationalError, sqlite3.OperationalError)
+
+
+def configure(raw_connection, pragmas):
+    """Выполняет PRAGMA на DB-API соединении, минуя логирование Django."""
+    cursor = raw_connection.cursor()
+    # busy_timeout первым: journal_mode и другие PRAGMA сами берут
+    # блокировку и без него сразу падают с «database is locked».
+    ordered = sorted(pragmas.items(),
+                     key=lambda item: item[0] != 'busy_timeout')
+    try:
+        for name, value in ordered:
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+def file_id(path):
+    """Устройство и inode файла базы или None, если файла нет."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def on_connection_created(sender, connection, **kwargs):
+    """Обработчик connection_created: PRAGMA и отпечаток файла базы."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = settings.SQLITE_PRAGMAS
+    if connection.alias in settings.DATABASE_REPLICAS:
+        pragmas = {**pragmas, **settings.SQLITE_REPLICA_PRAGMAS}
+    configure(connection.connection, pragmas)
+    connection.sqlite_file_id = None
+    if not connection.is_in_memory_db():
+        connection.sqlite_file_id = file_id(connection.settings_dict['NAME'])
+
+
+def check_connections(**kwargs):
+    """Обработчик request_started: проверка постоянных соединений.
+
+    Соединение, пережившее запрос (CONN_MAX_AGE), закрывается, если файл
+    базы подменили (например, синхронизацией реплики) или если на нём
+    были ошибки и оно больше не отвечает.
+    """
+    for connection in connections.all():
+        if connection.vendor != 'sqlite' or connection.connection is None:
+            continue
+        known = getattr(connection, 'sqlite_file_id', None)
+        if known and known != file_id(connection.settings_dict['NAME']):
+            connection.close()
+        elif connection.errors_occurred and not is_alive(connection):
+            connection.close()
+
+
+def is_alive(connection):
+    try:
+        connection.connection.execute('SELECT 1').fetchone()
+    except sqlite3.Error:
+        return False
+    return True
+
+
+def is_busy(error):
+    message = str(error)
+    return 'locked' in message or 'busy' in message
+
+
+def retry_on_busy(func, attempts=None, delay=None):
+    """Вызывает func, повторяя при занятой базе с экспоненциальной паузой."""
+    attempts = attempts or settings.SQLITE_BUSY_RETRIES
+    delay = settings.SQLITE_BUSY_DELAY if delay is None else delay
+    for attempt in range(attempts):
+        try:
+            return func()
+        except BUSY_ERRORS as error:
+            if not is_busy(error) or attempt == attempts - 1:
+                raise
+            time.sleep(delay * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def atomic_write(func, *args, using=None, **kwargs):
+    """Выполняет func в транзакции и повторяет её, если база занята.
+
+    Внутри уже открытой транзакции повторять нечего: откатится и
+    внешний блок, поэтому func просто выполняется в точке сохранения.
+    """
+    def run():
+        with transaction.atomic(using=using):
+            return func(*args, **kwargs)
+
+    if transaction.get_connection(using).in_atomic_block:
+        return run()
+    return retry_on_busy(run)
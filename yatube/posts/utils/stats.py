@@ -0,0 +1,24 @@
+"""Перцентили и гистограммы задержек для команд замеров."""
+import math
+
+# Верхние границы корзин гистограммы задержек, мс.
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def percentile(values, share):
+    """Перцентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(share * len(ordered)) - 1)]
+
+
+def histogram(values, buckets=LATENCY_BUCKETS):
+    """Число значений в каждой корзине; последняя — всё, что больше."""
+    counts = [0] * (len(buckets) + 1)
+    for value in values:
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+    return counts
@@ -1,15 +1,40 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.http import StreamingHttpResponse
+from django.utils.http import urlencode
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
 
+from . import counters, export, feed, search, syndication, thumbnails
 from .forms import CommentForm, PostForm
 from .models import Follow, Group, Post, User
-from .utils.pagination import pagination
+from .utils import page_cache
+from .utils.conditional import condition, revalidate
+from .utils.pagination import comment_pagination, pagination
+from .utils.query_budget import query_budget
+from .utils.sqlite import atomic_write
 
 
-@cache_page(20)
+def post_scopes(request, post_id):
+    """Пост и его автор: счётчик записей автора тоже на странице."""
+    author = Post.objects.filter(pk=post_id).values_list(
+        'author__username', flat=True
+    ).first()
+    if author is None:
+        return None
+    return [(page_cache.POST, post_id), (page_cache.AUTHOR, author)]
+
+
+def follow_scopes(request):
+    return [(page_cache.GLOBAL, ''), (page_cache.FOLLOWER, request.user.pk)]
+
+
+@query_budget(4)
+@revalidate(lambda request: [(page_cache.GLOBAL, '')])
+@page_cache.cache_page_by_generation(page_cache.GLOBAL)
 def index(request):
-    post_list = Post.objects.select_related('author').all()
+    post_list = Post.objects.select_related('author', 'group').all()
     page_obj = pagination(request, post_list)
     context = {
         'page_obj': page_obj,
@@ -18,9 +43,14 @@ def index(request):
     return render(request, 'posts/index.html', context)
 
 
+@query_budget(5)
+@revalidate(lambda request, slug: [(page_cache.GROUP, slug)])
+@page_cache.cache_page_by_generation(page_cache.GROUP, 'slug')
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.select_related('author').all()
+    # Группу записям проставляет сам related manager, без JOIN: иначе
+    # SQLite начинает соединение с posts_group и сортирует страницу.
+    post_list = group.posts.select_related('author')
     page_obj = pagination(request, post_list)
     context = {
         'group': group,
@@ -30,15 +60,19 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@query_budget(7)
+@revalidate(lambda request, username: [(page_cache.AUTHOR, username)])
+@page_cache.cache_page_by_generation(page_cache.AUTHOR, 'username')
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    author_posts = author.posts.select_related('author').all()
+    author_posts = author.posts.select_related('group')
     following = request.user.is_authenticated
     if following:
         following = author.following.filter(user=request.user).exists()
     page_obj = pagination(request, author_posts)
     context = {
         'author': author,
+        'author_stats': counters.for_user(author),
         'following': following,
         'page_obj': page_obj,
     }
@@ -46,17 +80,87 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+@query_budget(4)
+@condition(syndication.etag(page_cache.GLOBAL),
+           syndication.last_modified(page_cache.GLOBAL))
+@page_cache.cache_page_by_generation(page_cache.GLOBAL, per_user=False)
+def index_feed(request, kind):
+    return syndication.LatestPostsFeed(kind)(request)
+
+
+@query_budget(5)
+@condition(syndication.etag(page_cache.GROUP, 'slug'),
+           syndication.last_modified(page_cache.GROUP, 'slug'))
+@page_cache.cache_page_by_generation(page_cache.GROUP, 'slug',
+                                     per_user=False)
+def group_feed(request, kind, slug):
+    return syndication.GroupPostsFeed(kind)(request, slug=slug)
+
+
+@query_budget(5)
+@condition(syndication.etag(page_cache.AUTHOR, 'username'),
+           syndication.last_modified(page_cache.AUTHOR, 'username'))
+@page_cache.cache_page_by_generation(page_cache.AUTHOR, 'username',
+                                     per_user=False)
+def profile_feed(request, kind, username):
+    return syndication.AuthorPostsFeed(kind)(request, username=username)
+
+
+@query_budget(4)
+@revalidate(lambda request: [(page_cache.GLOBAL, '')])
+def post_search(request):
+    query = request.GET.get('q', '').strip()
+    results = search.search(
+        Post.objects.select_related('author', 'group'), query
+    )
+    # Результаты упорядочены по релевантности, а не по дате,
+    # поэтому курсор по (pub_date, id) здесь не подходит.
+    paginator = Paginator(results, settings.PAGE_SIZE)
+    context = {
+        'query': query,
+        'query_string': urlencode({'q': query}) + '&',
+        'page_obj': paginator.get_page(request.GET.get('page')),
+    }
+
+    return render(request, 'posts/search.html', context)
+
+
+@query_budget(8)
+@revalidate(post_scopes)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author', 'group'), pk=post_id
+    )
     form = CommentForm()
+    comments = comment_pagination(
+        request, post.comments.select_related('author')
+    )
     context = {
         'post': post,
+        'comments': comments,
+        'author_stats': counters.for_user(post.author),
         'form': form,
     }
 
     return render(request, 'posts/post_detail.html', context)
 
 
+@query_budget(5)
+@revalidate(lambda request, post_id: [(page_cache.POST, post_id)])
+def post_comments(request, post_id):
+    post = get_object_or_404(Post.objects.only('id'), pk=post_id)
+    comments = comment_pagination(
+        request, post.comments.select_related('author')
+    )
+    context = {
+        'post': post,
+        'comments': comments,
+    }
+
+    return render(request, 'posts/includes/comments.html', context)
+
+
+@query_budget(10)
 @login_required
 def post_create(request):
     form = PostForm(
@@ -68,7 +172,12 @@ def post_create(request):
         if form.is_valid():
             post = form.save(commit=False)
             post.author = request.user
-            post.save()
+
+            def publish():
+                post.save()
+                thumbnails.schedule(post)
+
+            atomic_write(publish)
             return redirect('posts:profile', username=post.author)
 
     context = {
@@ -78,6 +187,7 @@ def post_create(request):
     return render(request, 'posts/create_post.html', context)
 
 
+@query_budget(10)
 @login_required
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
@@ -92,7 +202,8 @@ def post_edit(request, post_id):
 
     if request.method == "POST":
         if form.is_valid():
-            form.save()
+            post = atomic_write(form.save)
+            thumbnails.schedule(post)
             return redirect('posts:post_detail', post_id=post_id)
 
     context = {
@@ -103,6 +214,7 @@ def post_edit(request, post_id):
     return render(request, 'posts/update_post.html', context)
 
 
+@query_budget(8)
 @login_required
 def add_comment(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
@@ -112,31 +224,63 @@ def add_comment(request, post_id):
             comment = form.save(commit=False)
             comment.author = request.user
             comment.post = post
-            comment.save()
+            atomic_write(comment.save)
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@query_budget(5)
 @login_required
+@revalidate(follow_scopes)
 def follow_index(request):
-    posts = Post.objects.select_related('author').filter(
+    posts = Post.objects.select_related('author', 'group').filter(
         author__following__user=request.user)
-    page_obj = pagination(request, posts)
+    page_obj = pagination(request, posts, feed.sources(request.user))
     context = {'page_obj': page_obj}
     return render(request, 'posts/follow.html', context)
 
 
+@query_budget(14)
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author:
-        Follow.objects.get_or_create(user=request.user, author=author)
+        atomic_write(
+            Follow.objects.get_or_create, user=request.user, author=author
+        )
     return redirect('posts:profile', username=author)
 
 
+@query_budget(13)
 @login_required
 def profile_unfollow(request, username):
     user_follower = get_object_or_404(User, username=username)
     is_following = user_follower.following.filter(user=request.user).exists()
     if is_following:
-        user_follower.following.filter(user=request.user).delete()
+        atomic_write(user_follower.following.filter(user=request.user).delete)
     return redirect('posts:profile', username=request.user)
+
+
+@query_budget(3)
+@staff_member_required
+def export_posts(request):
+    """Выгрузка для import_yatube: ?format=ndjson|csv, ?group= или ?author=.
+
+    Запросы к базе выполняются уже при отдаче ответа, порциями.
+    """
+    file_format = request.GET.get('format', 'ndjson')
+    if file_format not in export.FORMATS:
+        file_format = 'ndjson'
+    group = author = None
+    if request.GET.get('group'):
+        group = get_object_or_404(Group, slug=request.GET['group'])
+    elif request.GET.get('author'):
+        author = get_object_or_404(User, username=request.GET['author'])
+    lines, content_type = export.FORMATS[file_format]
+    response = StreamingHttpResponse(
+        lines(export.records(group, author)),
+        content_type=f'{content_type}; charset=utf-8',
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="yatube.{file_format}"'
+    )
+    return response
@@ -49,11 +49,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'posts.metrics.MetricsMiddleware',
+    'posts.timing.ServerTimingMiddleware',
+    'posts.slow_queries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'posts.routers.StickyPrimaryMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'posts.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,12 +79,26 @@ TEMPLATES = [
     },
 ]
 
+# One cache for all server processes on the host: a small LRU in every
+# process over a shared SQLite file, kept coherent by version stamps in a
+# memory-mapped file next to it. The directory is created with mode 0700
+# and must belong to the server user. Test runs replace it with
+# LocMemCache (yatube.test_runner.TEST_SETTINGS)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'posts.cache.TwoTierCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(
+            BASE_DIR, 'cache', 'cache.sqlite3')),
+        'KEY_PREFIX': os.getenv('CACHE_KEY_PREFIX', 'yatube'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'L1_MAX_ENTRIES': 2000,
+        },
     }
 }
 
+TEST_RUNNER = 'yatube.test_runner.TestRunner'
+
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
@@ -87,8 +106,45 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Connections outlive requests; a replaced database file is
+        # detected by posts.utils.sqlite.check_connections
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+    }
+}
+
+# Read replicas: comma-separated SQLite files kept in sync with
+# `manage.py sync_replica`. Reads go to a replica unless the user wrote
+# within the last REPLICA_STICKY_SECONDS (see posts.routers); replicas are
+# assumed to lag by no more than that, and pages cached within that time
+# after a change are provisional (see posts.utils.page_cache)
+DATABASE_REPLICAS = []
+REPLICA_FILES = [path for path in os.getenv('DB_REPLICAS', '').split(',')
+                 if path]
+for number, path in enumerate(REPLICA_FILES, 1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': path,
+        'TEST': {'MIRROR': 'default'},
     }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['posts.routers.PrimaryReplicaRouter']
+REPLICA_STICKY_SECONDS = 10
+
+# PRAGMA for every new SQLite connection (see posts.utils.sqlite)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
 }
+# Replicas are plain copies: rollback journal, and no writes by mistake
+SQLITE_REPLICA_PRAGMAS = {'journal_mode': 'DELETE', 'query_only': 1}
+# Retries of a write transaction that hit a locked database
+SQLITE_BUSY_RETRIES = 5
+SQLITE_BUSY_DELAY = 0.05
 
 
 # Password validation
@@ -118,8 +174,112 @@ LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
 # LOGOUT_REDIRECT_URL = 'posts:index'
 
+# Pages cached by generation live until the data in their scope changes
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Rendered post cards are keyed by their content and may live long
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Views over their SQL query budget raise while debugging and only log
+# a warning in production
+QUERY_BUDGET_STRICT = DEBUG
+
+# Share of requests measured by posts.timing.ServerTimingMiddleware: the
+# Server-Timing header and a JSON line in the posts.timing log
+SERVER_TIMING_SAMPLE_RATE = float(os.getenv('SERVER_TIMING_SAMPLE_RATE',
+                                            0.01))
+
+# Queries slower than SLOW_QUERY_MS are written by
+# posts.slow_queries.SlowQueryMiddleware with their view, template line and
+# query plan to SLOW_QUERY_LOG, one JSON object per line; see the
+# slow_queries command for a summary
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 100))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG',
+                           os.path.join(BASE_DIR, 'slow_queries.ndjson'))
+
+# Requests profiled by posts.profiling.ProfilingMiddleware: staff requests
+# with an X-Profile header or ?_profile=1 and a random share of all requests.
+# Only the newest PROFILING_MAX_FILES profiles are kept in PROFILING_DIR
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+PROFILING_DIR = os.getenv('PROFILING_DIR',
+                          os.path.join(BASE_DIR, 'profiles'))
+PROFILING_MAX_FILES = 500
+
+# Prometheus metrics at /metrics, summed over all server processes: each
+# process writes its own memory-mapped file in METRICS_DIR; files of exited
+# processes are folded into METRICS_DIR/archive.db. Clear the directory to
+# reset the counters
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+# Comma-separated addresses allowed to scrape /metrics; empty (the default)
+# disables the page. The check uses REMOTE_ADDR, which must be the real
+# client address: behind a reverse proxy on the same host every request
+# comes from 127.0.0.1, so never list loopback there
+METRICS_ALLOWED_IPS = [address for address
+                       in os.getenv('METRICS_ALLOWED_IPS', '').split(',')
+                       if address]
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            # The file is created on the first slow query only
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'posts.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'posts.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Thumbnail sizes generated in the background after a post is saved.
+# They must match the {% thumbnail %} calls in the templates.
+# With THUMBNAIL_WORKERS = 0 they are generated synchronously on commit
+THUMBNAIL_PRESETS = [
+    ('960x339', {'crop': 'center', 'upscale': True}),
+]
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))
+
+# Uploaded post images: downscaled to IMAGE_MAX_SIDE, re-encoded without
+# metadata to IMAGE_FORMAT ('JPEG' or 'WEBP'); images over IMAGE_MAX_PIXELS
+# are rejected before decoding. GIFs keep their frames: IMAGE_MAX_PIXELS
+# applies to all frames together and the file must fit IMAGE_MAX_BYTES
+IMAGE_MAX_SIDE = 1920
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_FORMAT = 'JPEG'
+IMAGE_QUALITY = 82
+IMAGE_WORKERS = 2
+
 # Paginator settings
 PAGE_SIZE = 10
+COMMENTS_PAGE_SIZE = 20
+# Upper bound for ?limit= in the JSON API
+API_MAX_PAGE_SIZE = 100
+# Number of entries in RSS/Atom feeds
+FEED_SIZE = 20
+
+# Follow feed settings: authors with more followers than the limit are
+# merged into feeds at read time instead of being fanned out to inboxes
+FEED_FANOUT_LIMIT = 1000
+FEED_CELEBRITIES_TTL = 300
+# Posts of a newly followed author copied into the follower's inbox
+FEED_BACKFILL_SIZE = PAGE_SIZE
 
 # CSRF settings
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
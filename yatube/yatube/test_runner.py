@@ -0,0 +1,51 @@
+"""Настройки тестовых прогонов.
+
+``TestRunner`` (``TEST_RUNNER`` для ``manage.py test``) и хук
+``pytest_configure`` в ``tests/conftest.py`` включают одни и те же
+переопределения ``TEST_SETTINGS`` на весь прогон.
+"""
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+TEST_SETTINGS = {
+    # Свой кеш в каждом прогоне: общий файл TwoTierCache пережил бы
+    # прогон и отдавал страницы, закешированные предыдущим.
+    'CACHES': {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    },
+    # Миниатюры синхронно при коммите: фоновый поток пережил бы
+    # MEDIA_ROOT теста и писал бы мимо него.
+    'THUMBNAIL_WORKERS': 0,
+    # Без строк журнала posts.timing в выводе тестов: тесты замеров
+    # включают выборку сами.
+    'SERVER_TIMING_SAMPLE_RATE': 0,
+}
+
+
+@contextmanager
+def test_environment():
+    # Метрики прогона — во временном каталоге, а не в METRICS_DIR
+    # сервера.
+    metrics_dir = tempfile.mkdtemp(prefix='yatube-metrics-')
+    try:
+        with override_settings(**TEST_SETTINGS, METRICS_DIR=metrics_dir):
+            yield
+    finally:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.environment = test_environment()
+        self.environment.__enter__()
+
+    def teardown_test_environment(self, **kwargs):
+        self.environment.__exit__(None, None, None)
+        super().teardown_test_environment(**kwargs)